@@ -1,40 +1,241 @@
 ### This class is built for the functions calls in the FastAPI ###
 import re
 
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+from lookup_index import GroupIndex, LevelEncoder, LookupIndex
+from query import run_query
+
+# levels of the lookup index built in Analytics, from the outermost to the innermost
+INDEX_LEVELS = ["Course Code", "Instructor", "Term", "Bidding Window", "Section"]
+_NO_ROWS = np.array([], dtype=np.intp)
+# text columns stored as categoricals in filtered_data, and the ones that get their own dimension table
+CATEGORICAL_COLUMNS = ["Term", "Session", "Bidding Window", "Course Code", "Description", "Section", "Instructor", "School/Department"]
+DIMENSION_COLUMNS = {"instructor": "Instructor", "term": "Term", "window": "Bidding Window", "school": "School/Department"}
+# group indexes of Analytics: attribute -> (table, levels), each maps a key to the sorted positions of its rows in the table
+GROUP_INDEXES = {
+    "window_positions": ("filtered_data", ["Bidding Window"]),
+    "term_positions": ("filtered_data", ["Term"]),
+    "cube_by_window": ("bid_cube", ["Course Code", "Instructor", "Bidding Window"]),
+    "cube_by_term": ("bid_cube", ["Course Code", "Instructor", "Term"]),
+    "section_cube_by_window": ("section_bid_cube", ["Course Code", "Instructor", "Bidding Window", "Section"]),
+    "section_cube_by_term": ("section_bid_cube", ["Course Code", "Instructor", "Term", "Section"]),
+}
+# aggregates of the bid cubes, read by the bid price trend and vacancy charts
+CUBE_AGGREGATES = dict(
+    median_median_bid=("Median Bid", "median"),
+    mean_median_bid=("Median Bid", "mean"),
+    median_bid=("Median Bid", "median"),
+    min_bid=("Min Bid", "min"),
+    before_vacancies=("Before Process Vacancy", "sum"),
+    after_vacancies=("After Process Vacancy", "sum"),
+    row_count=("Median Bid", "size"),
+)
+NUMERIC_COLUMNS = [
+    "Vacancy", "Opening Vacancy", "Before Process Vacancy", "After Process Vacancy", "Enrolled Students",
+    "Median Bid", "Min Bid",
+]
+
+
+def float_values(series):
+    """Numeric chart data as a float64 array with missing values as NaN, serialized by the API without a list in between"""
+    return series.to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def clean_rows(data_frame):
+    """Rows of the raw dataset kept by Analytics, without the unused columns. Works row by row, so a dataset can also be
+    cleaned a chunk at a time (see sqlite_store.write_store)"""
+    # Handling missing data: Remove rows with "Median Bid" equal to 0 or empty "Instructor" column
+    # (the typed snapshot already stores the "-" Median Bid placeholder as missing, only untyped frames need coercing)
+    median_bid = data_frame["Median Bid"]
+    if not is_numeric_dtype(median_bid):
+        median_bid = pd.to_numeric(median_bid, errors="coerce")
+    filtered_data = data_frame.drop(data_frame[(median_bid == 0) | (median_bid.isna()) | (data_frame["Instructor"].fillna("") == "") | (data_frame["Session"] != "Regular Academic Session")].index)
+
+    # Strip the 'Instructor' and 'Course' values for better data integrity
+    filtered_data["Instructor"] = filtered_data["Instructor"].str.strip()
+    filtered_data["Course Code"] = filtered_data["Course Code"].str.strip()
+
+    # Delete unnecessary columns
+    cols_to_delete = ["D.I.C.E"]
+    filtered_data.drop(columns=cols_to_delete, inplace=True)
+    return filtered_data
+
+
+def distinct_values(rows):
+    """Distinct values of each text column of cleaned rows, in order of first appearance"""
+    return {col: list(rows[col].dropna().unique()) for col in CATEGORICAL_COLUMNS if col in rows.columns}
+
+
+def category_dtypes(distinct):
+    """Categorical dtype of each text column from its distinct values: categories sorted like astype("category") sorts them,
+    Term and Bidding Window ordered by term_sort_key and bidding_window_sort_key (unknown window strings last)"""
+    dtypes = {col: pd.CategoricalDtype(pd.Categorical(values).categories) for col, values in distinct.items()}
+    dtypes["Term"] = pd.CategoricalDtype(sorted(distinct["Term"], key=Analytics.term_sort_key), ordered=True)
+    dtypes["Bidding Window"] = pd.CategoricalDtype(sorted(distinct["Bidding Window"], key=Analytics.bidding_window_sort_key), ordered=True)
+    return dtypes
+
+
+def encode_rows(rows, dtypes):
+    """Codes cleaned rows like the fact table: numeric columns as numbers, text columns with the dtypes of category_dtypes,
+    plus the round_successful_bids column"""
+    for col in NUMERIC_COLUMNS:
+        # columns typed at ingest (see excel_merge.column_types) are used as they are
+        if col in rows.columns and not is_numeric_dtype(rows[col]):
+            rows[col] = pd.to_numeric(rows[col], errors="coerce")
+    for col, dtype in dtypes.items():
+        rows[col] = pd.Categorical(rows[col], dtype=dtype)
+    rows["round_successful_bids"] = rows["Before Process Vacancy"] - rows["After Process Vacancy"]
+    return rows
+
+
+def aggregate_cube(rows, levels, aggregates=CUBE_AGGREGATES):
+    """aggregates of the rows of the fact table by levels, groups in order of first appearance (rows missing a level are left out)"""
+    columns = list(dict.fromkeys(column for column, _ in aggregates.values()))
+    cube = rows[levels + columns].groupby(levels, sort=False, observed=True).agg(**aggregates).reset_index()
+    cube["median_median_bid"] = cube["median_median_bid"].round(2)
+    cube["mean_median_bid"] = cube["mean_median_bid"].round(2)
+    return cube
+
+
+def chronological_order(cube):
+    """Positions of the rows of cube sorted by term then bidding window, ties staying in cube order"""
+    # the categorical codes of Term and Bidding Window are their ranks
+    return np.lexsort((cube["Bidding Window"].cat.codes.to_numpy(), cube["Term"].cat.codes.to_numpy()))
+
+
 class Analytics:
     def __init__(self, data_frame) -> None:
         ### preprocess data in initialisation of class ###
-
-        # Handling missing data: Remove rows with "Median Bid" equal to 0 or empty "Instructor" column
-        filtered_data = data_frame.drop(data_frame[(data_frame["Median Bid"] == 0) | (data_frame["Median Bid"] == "-") | (data_frame["Instructor"].fillna("") == "") | (data_frame["Session"] != "Regular Academic Session")].index)
-        filtered_data["round_successful_bids"] = filtered_data["Before Process Vacancy"] - filtered_data["After Process Vacancy"]
-
-        # Strip the 'Instructor' and 'Course' values for better data integrity
-        filtered_data["Instructor"] = filtered_data["Instructor"].str.strip()
-        filtered_data["Course Code"] = filtered_data["Course Code"].str.strip()
-
-        # Delete unnecessary columns
-        cols_to_delete = ["D.I.C.E"]
-        filtered_data.drop(columns=cols_to_delete, inplace=True)
-
-        self.filtered_data = filtered_data
-
-        course_codes = self.filtered_data["Course Code"].to_list()
-        course_names = self.filtered_data["Description"].to_list()
-        course_code_and_name_str_array = []
-        unique_course_code_to_course_name_map = {}
-        for i in range(len(course_codes)):
-            if course_codes[i] not in unique_course_code_to_course_name_map:
-                if course_codes[i] == "COR3001":
-                    unique_course_code_to_course_name_map[course_codes[i]] = "Big Questions"
-                else:
-                    unique_course_code_to_course_name_map[course_codes[i]] = course_names[i]
-                course_code_and_name_str_array.append(course_codes[i] + ": " + course_names[i])
-        self.unique_course_code_to_course_name_map = unique_course_code_to_course_name_map
-        self.course_code_and_name_str_array = course_code_and_name_str_array
+        self.filtered_data = clean_rows(data_frame)
+        self.encode_dimensions()
+        self.build_catalog()
+        self.build_aggregate_cube()
+        self.build_indexes()
+
+    @classmethod
+    def from_tables(cls, filtered_data, bid_cube, section_bid_cube, index_arrays=None):
+        """Analytics over the tables (and optionally the index arrays, see index_arrays) of an already built instance,
+        which are used as they are (see shared_dataset.py). Only the small dictionaries and lists on top of them are rebuilt"""
+        analytics = cls.__new__(cls)
+        analytics.filtered_data = filtered_data
+        analytics.bid_cube = bid_cube
+        analytics.section_bid_cube = section_bid_cube
+        analytics.describe_dimensions()
+        analytics.build_catalog()
+        if index_arrays is None:
+            analytics.build_indexes()
+        else:
+            analytics.attach_indexes(index_arrays)
+        return analytics
+
+    def build_catalog(self):
+        # course dimension in order of first appearance, COR3001 is listed under its common name
+        courses = self.dimensions["course"]
+        self.unique_course_code_to_course_name_map = dict(zip(courses["Course Code"], courses["Description"].astype(object).where(courses["Course Code"] != "COR3001", "Big Questions")))
+        self.course_code_and_name_str_array = (courses["Course Code"].astype(str) + ": " + courses["Description"].astype(str)).tolist()
+
+        self.unique_professors = list(self.dimensions["instructor"]["Instructor"])
+        self.unique_faculties = list(self.dimensions["school"]["School/Department"])
+        self.unique_course_codes = list(courses["Course Code"])
+
+        courses_by_instructor = {}
+        for instructor, course_code in self.distinct_rows(["Instructor", "Course Code"]).itertuples(index=False):
+            courses_by_instructor.setdefault(instructor, []).append(course_code)
+        self.courses_by_instructor = courses_by_instructor
+
+    def encode_dimensions(self):
+        """Turns filtered_data into an integer coded fact table: text columns become categoricals (small integer codes plus one
+        copy of each distinct string) and numeric columns become numeric arrays. Term and Bidding Window are ordered by
+        term_sort_key and bidding_window_sort_key (unknown window strings last) so sorting them is an integer comparison.
+        Adds round_successful_bids. The distinct values of the main dimensions are kept as small tables in self.dimensions"""
+        rows = self.filtered_data
+        self.filtered_data = encode_rows(rows, category_dtypes(distinct_values(rows)))
+        self.describe_dimensions()
+
+    def describe_dimensions(self):
+        """Ranks of the terms and windows (their categorical codes) and the dimension tables of the encoded fact table"""
+        dtypes = self.column_dtypes()
+        self.term_rank = {term: rank for rank, term in enumerate(dtypes["Term"].categories)}
+        self.window_rank = {window: rank for rank, window in enumerate(dtypes["Bidding Window"].categories)}
+
+        self.encoders = {level: LevelEncoder(dtypes[level].categories) for level in INDEX_LEVELS}
+
+        # rows of a dimension table are in order of first appearance in the fact table
+        self.dimensions = {"course": self.distinct_rows(["Course Code", "Description"], subset=["Course Code"])}
+        for name, col in DIMENSION_COLUMNS.items():
+            self.dimensions[name] = self.distinct_rows([col])
+
+    def column_dtypes(self):
+        """dtype of each column of the fact table"""
+        return self.filtered_data.dtypes
+
+    def distinct_rows(self, columns, subset=None):
+        """Rows of the fact table's columns with distinct values of subset (all of columns by default), in order of first appearance"""
+        return self.filtered_data[columns].drop_duplicates(subset).reset_index(drop=True)
+
+    def memory_footprint(self):
+        """Bytes held by the fact table and the dimension tables, see benchmarks/memory_benchmark.py"""
+        return {
+            "fact_table": int(self.filtered_data.memory_usage(deep=True).sum()),
+            "dimension_tables": {name: int(table.memory_usage(deep=True).sum()) for name, table in self.dimensions.items()},
+        }
+
+    def build_indexes(self):
+        """Builds the lookup index of filtered_data (course -> instructor -> term -> window -> section) and the group
+        indexes, so that the filters and getters are index lookups instead of full column scans"""
+        self.row_index = LookupIndex.build(self.filtered_data, INDEX_LEVELS, self.encoders)
+        self.lookup_index = self.row_index.root()
+        for name, (table, levels) in GROUP_INDEXES.items():
+            # cube group positions ascend in cube order, so each group comes out sorted by term (or by window within a term)
+            setattr(self, name, GroupIndex.build(getattr(self, table), levels, self.encoders))
+
+    def index_arrays(self):
+        """The numpy arrays of every index, by index"""
+        return {"row_index": self.row_index.arrays(), **{name: getattr(self, name).arrays() for name in GROUP_INDEXES}}
+
+    def attach_indexes(self, index_arrays):
+        self.row_index = LookupIndex(index_arrays["row_index"], [self.encoders[level] for level in INDEX_LEVELS])
+        self.lookup_index = self.row_index.root()
+        for name, (_, levels) in GROUP_INDEXES.items():
+            setattr(self, name, GroupIndex(index_arrays[name], [self.encoders[level] for level in levels]))
+
+    def build_aggregate_cube(self):
+        """Materializes the per (course, instructor, term, window) aggregates read by the bid price trend and vacancy charts,
+        plus the same aggregates at section grain. Both cubes are sorted by term then bidding window"""
+        def materialize(levels):
+            cube = aggregate_cube(self.filtered_data, levels)
+            return cube.iloc[chronological_order(cube)].reset_index(drop=True)
+
+        self.bid_cube = materialize(INDEX_LEVELS[:4])
+        self.section_bid_cube = materialize(INDEX_LEVELS)
+
+    def cube_rows(self, cube_index, key):
+        return self.bid_cube.iloc[cube_index.get(key, _NO_ROWS)]
+
+    def section_cube_rows(self, cube_index, key):
+        return self.section_bid_cube.iloc[cube_index.get(key, _NO_ROWS)]
+
+    def lookup(self, *keys):
+        """Returns the index node at the specified path (course code, instructor, term, window, section), None if there are no rows"""
+        node = self.lookup_index
+        for key in keys:
+            node = node.children.get(key)
+            if node is None:
+                return None
+        return node
+
+    def rows_at(self, positions):
+        return self.filtered_data.iloc[positions]
+
+    def row_count(self):
+        return len(self.filtered_data)
 
     # key used to sort bidding window string
-    def bidding_window_sort_key(self, window):
+    @staticmethod
+    def bidding_window_sort_key(window):
         if 'Incoming Freshmen' in window:
             return (-1, window)
         if 'Incoming Exchange' in window:
@@ -58,19 +259,20 @@ class Analytics:
             return (float('inf'),)
 
     # key used to sort Bidding Window string
-    def term_sort_key(self, term):
+    @staticmethod
+    def term_sort_key(term):
         year, term_num = term.split(" Term ")
         return int(year.split("-")[0]), int(term_num)
 
     ### Getters Start ###
     def get_unique_professors(self):
-        return list(self.filtered_data["Instructor"].unique())
+        return list(self.unique_professors)
     
     def get_unique_faculties(self):
-        return list(self.filtered_data["School/Department"].unique())
+        return list(self.unique_faculties)
     
     def get_unique_course_codes(self):
-        return list(self.filtered_data["Course Code"].unique())
+        return list(self.unique_course_codes)
     
     def get_course_name(self, course_code):
         course_code = course_code.upper()
@@ -82,7 +284,8 @@ class Analytics:
     def filter_by_course_code(self, course_code):
         """Returns df filtered by specified course_code"""
         course_code = course_code.upper()
-        return self.filtered_data[self.filtered_data["Course Code"] == course_code]
+        node = self.lookup(course_code)
+        return self.rows_at(node.positions if node else _NO_ROWS)
     
     def filter_by_faculty(self, faculty):
         """Returns df filtered by specified faculty"""
@@ -90,51 +293,92 @@ class Analytics:
 
     def filter_by_window(self, window):
         """Returns df filtered by specified window"""
-        return self.filtered_data[self.filtered_data["Bidding Window"] == window]
+        return self.rows_at(self.window_positions.get(window, _NO_ROWS))
 
     def filter_by_term(self, term):
         """Returns df filtered by specified term"""
-        return self.filtered_data[self.filtered_data["Term"] == term]
+        return self.rows_at(self.term_positions.get(term, _NO_ROWS))
 
     def filter_by_course_code_and_instructor(self, course_code, instructor_name):
         """Returns df filtered by specified course_code and instructor name"""
         course_code = course_code.upper()
-        filtered_by_course_code = self.filter_by_course_code(course_code)
-        return filtered_by_course_code[filtered_by_course_code["Instructor"].str.strip() == instructor_name.strip()]
+        node = self.lookup(course_code, instructor_name.strip())
+        return self.rows_at(node.positions if node else _NO_ROWS)
     
     def filter_by_course_code_instructor_and_window(self, course_code, instructor_name, window):
         """Returns df filtered by specified course_code, instructor name and window"""
         course_code = course_code.upper()
-        filtered_by_course_code = self.filter_by_course_code(course_code)
-        filtered_by_instructor = filtered_by_course_code[filtered_by_course_code["Instructor"] == instructor_name.strip()]
-        return filtered_by_instructor[filtered_by_instructor["Bidding Window"] == window]
+        return self.rows_at(self.window_positions_across_terms(course_code, instructor_name.strip(), window))
 
     def filter_by_course_code_instructor_and_term(self, course_code, instructor_name, term):
         course_code = course_code.upper()
-        filtered_by_course_code = self.filter_by_course_code(course_code)
-        filtered_by_instructor = filtered_by_course_code[filtered_by_course_code["Instructor"] == instructor_name.strip()]
-        return filtered_by_instructor[filtered_by_instructor["Term"] == term]
-        
+        node = self.lookup(course_code, instructor_name.strip(), term)
+        return self.rows_at(node.positions if node else _NO_ROWS)
+
+    def window_positions_across_terms(self, course_code, instructor_name, window):
+        """window sits below term in the index, so gather the window's rows from every term"""
+        node = self.lookup(course_code, instructor_name)
+        if node is None:
+            return _NO_ROWS
+        positions = [term_node.children[window].positions for term_node in node.children.values() if window in term_node.children]
+        return np.sort(np.concatenate(positions)) if positions else _NO_ROWS
+
+    def matching_positions(self, course_code=None, instructor_name=None, term=None, window=None, section=None):
+        """Sorted positions of the rows matching every filter given, every row when none is given (see row_export.py and query.py)"""
+        filters = {
+            "Course Code": course_code.upper() if course_code is not None else None,
+            "Instructor": instructor_name.strip() if instructor_name is not None else None,
+            "Term": term,
+            "Bidding Window": window,
+            "Section": section,
+        }
+        filters = {level: value for level, value in filters.items() if value is not None}
+        # the lookup index (or the term or window group index when no course is given) narrows down the rows, the other
+        # filters compare the codes of the remaining rows
+        keys = []
+        for level in INDEX_LEVELS:
+            if level not in filters:
+                break
+            keys.append(filters.pop(level))
+        if keys:
+            node = self.lookup(*keys)
+            if node is None:
+                return _NO_ROWS
+            positions = node.positions
+        elif "Term" in filters:
+            positions = self.term_positions.get(filters.pop("Term"), _NO_ROWS)
+        elif "Bidding Window" in filters:
+            positions = self.window_positions.get(filters.pop("Bidding Window"), _NO_ROWS)
+        else:
+            positions = self.lookup_index.positions
+        for level, value in filters.items():
+            code = self.encoders[level].code(value)
+            if code is None:
+                return _NO_ROWS
+            positions = positions[self.filtered_data[level].cat.codes.to_numpy()[positions] + 1 == code]
+        return positions
+
+    def query(self, filters, group_by, aggregates, max_rows):
+        """Aggregates of the rows matching filters by value of group_by, see query.py"""
+        return run_query(self, filters, group_by, aggregates, max_rows)
+
     ### Filter Functions End###
 
     ### Get Instructors By Functions Start###  
     def get_terms_by_course_code_and_instructor(self, course_code, instructor_name):
-        filtered_by_course_code = self.filter_by_course_code(course_code)
-        filtered_by_instructor = filtered_by_course_code[filtered_by_course_code["Instructor"] == instructor_name.strip()]
-        return sorted(filtered_by_instructor["Term"].unique(), key=self.term_sort_key, reverse=True)
+        return self.terms_of(self.lookup(course_code.upper(), instructor_name.strip()))
 
     def get_instructors_by_course_code(self, course_code):
         """Input: Course Code\nOutput: array of distinct instructors"""
         course_code = course_code.upper()
-        course_df = self.filter_by_course_code(course_code)
-        return list(course_df["Instructor"].unique())
+        node = self.lookup(course_code)
+        return list(node.children) if node else []
     
     def get_instructors_by_faculty(self, faculty):
         return self.filtered_data[faculty].unique()
     
     def get_courses_by_professor(self, instructor_name):
-        filtered_by_instructor = self.filtered_data[self.filtered_data["Instructor"] == instructor_name.upper().strip()]
-        unique_courses = filtered_by_instructor["Course Code"].unique()
+        unique_courses = self.courses_by_instructor.get(instructor_name.upper().strip(), [])
 
         res = []
         for course_code in unique_courses:
@@ -146,15 +390,29 @@ class Analytics:
     ### Get Bidding Window By Functions Start ###  
     def get_bidding_windows_of_instructor_who_teach_course(self, course_code, instructor_name):
         course_code = course_code.upper()
-        df = self.filter_by_course_code_and_instructor(course_code, instructor_name)
-        return sorted(df["Bidding Window"].unique(), key=self.bidding_window_sort_key)
+        return self.windows_of(self.lookup(course_code, instructor_name.strip()))
     ### Get Bidding Window By Functions End ###  
 
     def get_sections_for_specific_course_instructor_term(self, course_code, instructor_name, term):
         course_code = course_code.upper()
-        df = self.filter_by_course_code_and_instructor(course_code, instructor_name)
-        df = df[df["Term"] == term]
-        return sorted(df["Section"].unique())
+        return self.sections_of(self.lookup(course_code, instructor_name.strip(), term))
+
+    ### Index Node Helpers Start ###
+    def terms_of(self, instructor_node):
+        """Terms under a (course, instructor) index node, latest first"""
+        terms = instructor_node.children if instructor_node else {}
+        return sorted(terms, key=lambda term: self.term_rank.get(term, -1), reverse=True)
+
+    def windows_of(self, instructor_node):
+        """Bidding windows under a (course, instructor) index node, across all terms"""
+        windows = {window for term_node in instructor_node.children.values() for window in term_node.children} if instructor_node else set()
+        return sorted(windows, key=lambda window: self.window_rank.get(window, len(self.window_rank)))
+
+    def sections_of(self, term_node):
+        """Sections under a (course, instructor, term) index node, across all windows"""
+        sections = {section for window_node in term_node.children.values() for section in window_node.children} if term_node else set()
+        return sorted(sections)
+    ### Index Node Helpers End ###
 
 
     ### Get Course Overview Start ###
@@ -167,151 +425,119 @@ class Analytics:
             course_df = self.filter_by_course_code(course_code)
         # filter course df to show round 1 window 1 only
         course_df = course_df[course_df["Bidding Window"] == "Round 1 Window 1"]
-        min_median_value = course_df["Median Bid"].min()
-        max_median_value = course_df["Median Bid"].max()
-        median_median_value = round(course_df["Median Bid"].median(), 2)
-        mean_median_value = round(course_df["Median Bid"].mean(), 2)
-        return [min_median_value, median_median_value, mean_median_value, max_median_value]
+        return self.median_bid_summary(course_df)
     
     def get_all_instructor_median_and_mean_median_bid_by_course_code(self, course_code):
         """returns 2d array containing x_axis_data array and y_axis_data array"""
         course_code = course_code.upper()
         course_df = self.filter_by_course_code(course_code)
         course_df = course_df[course_df["Bidding Window"] == "Round 1 Window 1"]
+        return self.instructor_median_bid_chart(course_df, self.get_instructors_by_course_code(course_code))
+
+    def median_bid_summary(self, r1w1_df):
+        """[min, median, mean, max] of the Median Bid of Round 1 Window 1 rows"""
+        min_median_value = r1w1_df["Median Bid"].min()
+        max_median_value = r1w1_df["Median Bid"].max()
+        median_median_value = round(r1w1_df["Median Bid"].median(), 2)
+        mean_median_value = round(r1w1_df["Median Bid"].mean(), 2)
+        return [min_median_value, median_median_value, mean_median_value, max_median_value]
+
+    def instructor_median_bid_chart(self, r1w1_df, teaching_instructors):
+        """Median and mean Median Bid of each instructor with Round 1 Window 1 rows, in teaching_instructors order"""
         title="Median and Mean 'Median Bid' Price against Instructors (across all sections and windows for Round 1 Window 1 from AY 2019/20 onwards)"
         x_axis_data = []
         median_median_bid_y_axis_data = []
         mean_median_bid_y_axis_data = []
 
-        instructors_teaching_in_r1w1 = list(course_df["Instructor"])
-
-        teaching_instructors = self.get_instructors_by_course_code(course_code)
+        bids_by_instructor = r1w1_df["Median Bid"].groupby(r1w1_df["Instructor"], sort=False, observed=True)
+        medians = bids_by_instructor.median().round(2)
+        means = bids_by_instructor.mean().round(2)
         for instructor in teaching_instructors:
-            if instructor in instructors_teaching_in_r1w1:
-                series = course_df[course_df["Instructor"] == instructor]["Median Bid"]
-                median = round(series.median(), 2)
-                median_median_bid_y_axis_data.append(median)
-
-                mean = round(series.mean(), 2)
-                mean_median_bid_y_axis_data.append(mean)
+            if instructor in medians.index:
+                median_median_bid_y_axis_data.append(medians[instructor])
+                mean_median_bid_y_axis_data.append(means[instructor])
                 x_axis_data.append(instructor)
         return [title, x_axis_data, median_median_bid_y_axis_data, mean_median_bid_y_axis_data]
     ### Get Course Overview End ###
 
 
+    ### Get Course Page Start ###
+    def get_course_page_data(self, course_code, instructor_name=None, term=None, window=None, section=None):
+        """Returns the data of every chart on a course page, keyed by chart, from a single lookup of the course's rows.
+        Charts needing an argument that was not passed are left out"""
+        course_code = course_code.upper()
+        course_node = self.lookup(course_code)
+        course_df = self.rows_at(course_node.positions if course_node else _NO_ROWS)
+        r1w1_df = course_df[course_df["Bidding Window"] == "Round 1 Window 1"]
+        instructors = list(course_node.children) if course_node else []
+        page = {
+            "overview": self.median_bid_summary(r1w1_df),
+            "instructor_median_bid_chart": self.instructor_median_bid_chart(r1w1_df, instructors),
+            "instructors": instructors,
+        }
+        if not instructor_name:
+            return page
+
+        # the remaining charts are lookups on the index and the aggregate cubes
+        instructor_name = instructor_name.strip()
+        instructor_node = course_node.children.get(instructor_name) if course_node else None
+        page["terms_available"] = self.terms_of(instructor_node)
+        page["bidding_windows_available"] = self.windows_of(instructor_node)
+        if window:
+            page["bidpriceacrossterms"] = self.get_bid_price_data_by_course_code_and_window_across_terms(course_code, window, instructor_name)
+            page["bidpriceacrossterms_vacancies"] = self.get_before_after_vacancies_by_course_code_and_window_across_terms(course_code, window, instructor_name)
+        if term:
+            page["sections_available"] = self.sections_of(instructor_node.children.get(term) if instructor_node else None)
+            page["bidpriceacrosswindows"] = self.get_bid_price_data_by_course_code_and_term_across_windows(course_code, term, instructor_name)
+            page["bidpriceacrosswindows_vacancies"] = self.get_before_after_vacancies_by_course_code_and_term_across_windows(course_code, term, instructor_name)
+            if section:
+                page["sectionbidpriceacrosswindows"] = self.get_bid_price_data_by_course_code_term_and_section_across_windows(course_code, term, instructor_name, section)
+                page["sectionbidpriceacrosswindows_vacancies"] = self.get_before_after_vacancies_by_course_code_term_and_section_across_windows(course_code, term, instructor_name, section)
+        return page
+    ### Get Course Page End ###
+
+
     ### Get Line chart Data for Bid Price Trends Start ###
     def get_bid_price_data_by_course_code_and_window_across_terms(self, course_code, window, instructor):
         course_code = course_code.upper()
-        df = self.filter_by_course_code_instructor_and_window(course_code, instructor, window)
+        # cube rows are already sorted by term
+        rows = self.cube_rows(self.cube_by_window, (course_code, instructor.strip(), window))
         title = "Median and Mean 'Median Bid' Price (across all sections and windows) against Term"
-        x_axis_data = []
-        y_axis_data_median_bid = []
-        y_axis_data_mean_bid = []
-        
-        # IMPT to sort the terms
-        terms_taught_for_specified_window = sorted(df["Term"].unique(), key=self.term_sort_key)
-        
-        for term in terms_taught_for_specified_window:
-            term_median_median_bid = round(df[df["Term"] == term]["Median Bid"].median(), 2)
-            term_mean_median_bid = round(df[df["Term"] == term]["Median Bid"].mean(), 2)
-            x_axis_data.append(term)
-            y_axis_data_median_bid.append(term_median_median_bid)
-            y_axis_data_mean_bid.append(term_mean_median_bid)
-
-        return [title, x_axis_data, y_axis_data_median_bid, y_axis_data_mean_bid]
+        return [title, rows["Term"].tolist(), float_values(rows["median_median_bid"]), float_values(rows["mean_median_bid"])]
     
     def get_bid_price_data_by_course_code_and_term_across_windows(self, course_code, term, instructor):
         course_code = course_code.upper()
-        df = self.filter_by_course_code_instructor_and_term(course_code, instructor, term)
+        # cube rows are already sorted by bidding window
+        rows = self.cube_rows(self.cube_by_term, (course_code, instructor.strip(), term))
         title = f"Median and Mean 'Median Bid' Price (across all sections and windows) against Bidding Window for {term}"
-        x_axis_data = []
-        y_axis_data_median_bid = []
-        y_axis_data_mean_bid = []
-        # IMPT to sort the terms
-        windows_for_specified_term = sorted(df["Bidding Window"].unique(), key=self.bidding_window_sort_key)
-        
-        for window in windows_for_specified_term:
-            window_median_median_bid = round(df[df["Bidding Window"] == window]["Median Bid"].median(), 2)
-            window_mean_median_bid = round(df[df["Bidding Window"] == window]["Median Bid"].mean(), 2)
-            x_axis_data.append(window)
-            y_axis_data_median_bid.append(window_median_median_bid)
-            y_axis_data_mean_bid.append(window_mean_median_bid)
-
-        return [title, x_axis_data, y_axis_data_median_bid, y_axis_data_mean_bid]
+        return [title, rows["Bidding Window"].tolist(), float_values(rows["median_median_bid"]), float_values(rows["mean_median_bid"])]
     
     def get_bid_price_data_by_course_code_term_and_section_across_windows(self, course_code, term, instructor, section):
         course_code = course_code.upper()
-        df = self.filter_by_course_code_instructor_and_term(course_code, instructor, term)
-        df = df[df["Section"] == section]
+        rows = self.section_cube_rows(self.section_cube_by_term, (course_code, instructor.strip(), term, section))
         title = f"Median, Min Bid Price against Bidding Window for {term}, Section {section}"
-        x_axis_data = []
-        y_axis_data_median_bid = []
-        y_axis_data_min_bid = []
-        
-        # IMPT to sort the terms
-        windows_for_specified_term = sorted(df["Bidding Window"].unique(), key=self.bidding_window_sort_key)
-        
-        for window in windows_for_specified_term:
-            median_bid = df[df["Bidding Window"] == window]["Median Bid"]
-            min_bid = df[df["Bidding Window"] == window]["Min Bid"]
-            x_axis_data.append(window)
-            y_axis_data_median_bid.append(median_bid)
-            y_axis_data_min_bid.append(min_bid)
-
-        return [title, x_axis_data, y_axis_data_median_bid, y_axis_data_min_bid]
+        return [title, rows["Bidding Window"].tolist(), float_values(rows["median_bid"]), float_values(rows["min_bid"])]
     ### Get Line chart Data for Bid Price Trends End ###
 
 
     ### Get MultitypeChart Extra DataArr Start ### 
     def get_before_after_vacancies_by_course_code_and_window_across_terms(self, course_code, window, instructor, filter_by_section=""):
         course_code = course_code.upper()
-        df = self.filter_by_course_code_instructor_and_window(course_code, instructor, window)
         if filter_by_section != "":
-            df = df[df["Section"] == filter_by_section]
-        terms_taught = sorted(df["Term"].unique(), key=self.term_sort_key)
-        
-        y_axis_data_before_vacancies = []
-        y_axis_data_after_vacancies = []
-        for term in terms_taught:
-            term_df = df[df["Term"] == term]
-            term_before_process_vacancies = term_df["Before Process Vacancy"].sum()
-            term_after_process_vacancies = term_df["After Process Vacancy"].sum()
-            y_axis_data_before_vacancies.append(term_before_process_vacancies)
-            y_axis_data_after_vacancies.append(term_after_process_vacancies)
-        return [y_axis_data_before_vacancies, y_axis_data_after_vacancies]
+            rows = self.section_cube_rows(self.section_cube_by_window, (course_code, instructor.strip(), window, filter_by_section))
+        else:
+            rows = self.cube_rows(self.cube_by_window, (course_code, instructor.strip(), window))
+        return [float_values(rows["before_vacancies"]), float_values(rows["after_vacancies"])]
 
 
     def get_before_after_vacancies_by_course_code_and_term_across_windows(self, course_code, term, instructor):
         course_code = course_code.upper()
-        df = self.filter_by_course_code_instructor_and_term(course_code, instructor, term)
-
-        windows = sorted(df["Bidding Window"].unique(), key=self.bidding_window_sort_key)
-        
-        y_axis_data_before_vacancies = []
-        y_axis_data_after_vacancies = []
-        for window in windows:
-            window_df = df[df["Bidding Window"] == window]
-            window_before_process_vacancies = window_df["Before Process Vacancy"].sum()
-            window_after_process_vacancies = window_df["After Process Vacancy"].sum()
-            y_axis_data_before_vacancies.append(window_before_process_vacancies)
-            y_axis_data_after_vacancies.append(window_after_process_vacancies)
-        return [y_axis_data_before_vacancies, y_axis_data_after_vacancies]
+        rows = self.cube_rows(self.cube_by_term, (course_code, instructor.strip(), term))
+        return [float_values(rows["before_vacancies"]), float_values(rows["after_vacancies"])]
 
     def get_before_after_vacancies_by_course_code_term_and_section_across_windows(self, course_code, term, instructor, section):
         course_code = course_code.upper()
-        df = self.filter_by_course_code_instructor_and_term(course_code, instructor, term)
-        df = df[df["Section"] == section]
-
-        windows = sorted(df["Bidding Window"].unique(), key=self.bidding_window_sort_key)
-        
-        y_axis_data_before_vacancies = []
-        y_axis_data_after_vacancies = []
-        for window in windows:
-            window_df = df[df["Bidding Window"] == window]
-            window_before_process_vacancies = window_df["Before Process Vacancy"].sum()
-            window_after_process_vacancies = window_df["After Process Vacancy"].sum()
-            y_axis_data_before_vacancies.append(window_before_process_vacancies)
-            y_axis_data_after_vacancies.append(window_after_process_vacancies)
-        return [y_axis_data_before_vacancies, y_axis_data_after_vacancies]
+        rows = self.section_cube_rows(self.section_cube_by_term, (course_code, instructor.strip(), term, section))
+        return [float_values(rows["before_vacancies"]), float_values(rows["after_vacancies"])]
     ### Get MultitypeChart Extra DataArr End ### 
   
\ No newline at end of file
@@ -0,0 +1,100 @@
+### Runs Analytics methods off the event loop so heavy chart requests do not stall cheap ones ###
+import asyncio
+import functools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from analytics import Analytics
+from dataset import load_dataframe
+from metrics import POOL_CALL_LATENCY
+from shared_dataset import attach
+from sqlite_store import SqliteAnalytics
+
+# Analytics instance of a process pool worker, built once by _init_worker
+_worker_analytics = None
+
+
+def _init_worker(xlsx_path, shared_path, store_path):
+    global _worker_analytics
+    if store_path:
+        _worker_analytics = SqliteAnalytics(store_path)
+    elif shared_path:
+        _worker_analytics = attach(shared_path)
+    else:
+        _worker_analytics = Analytics(load_dataframe(xlsx_path))
+
+
+def _call_in_worker(method_name, args):
+    return getattr(_worker_analytics, method_name)(*args)
+
+
+def _worker_ready():
+    # keeps the worker busy for a moment so that every warm up call lands on a different worker
+    time.sleep(0.05)
+    return os.getpid()
+
+
+class AnalyticsPool:
+    """Dispatches Analytics method calls to a thread or process pool.
+    In process mode every worker loads its own copy of the dataset from xlsx_path, maps the shared copy in shared_path
+    or queries the SQLite store in store_path.
+    pending counts admitted requests (running or waiting for a worker); once it reaches max_pending
+    new requests should be shed instead of queued"""
+
+    def __init__(self, analytics, mode="thread", max_workers=4, max_pending=32, xlsx_path=None, shared_path=None, store_path=None):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown analytics pool mode: {mode}")
+        self.analytics = analytics
+        self.mode = mode
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.shed = 0
+        if mode == "process":
+            self.executor = ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(xlsx_path, shared_path, store_path))
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analytics")
+
+    def warm_up(self):
+        """Starts every process worker (which loads the dataset) now rather than on the first requests"""
+        if self.mode == "process":
+            futures = [self.executor.submit(_worker_ready) for _ in range(self.max_workers)]
+            for future in futures:
+                future.result()
+
+    def try_admit(self):
+        """Admits a request if the queue is not full, the caller must call release() once done"""
+        if self.pending >= self.max_pending:
+            self.shed += 1
+            return False
+        self.pending += 1
+        return True
+
+    def release(self):
+        self.pending -= 1
+
+    async def run(self, method_name, *args):
+        """Runs analytics.method_name(*args) on the pool and returns its result"""
+        loop = asyncio.get_running_loop()
+        if self.mode == "process":
+            call = functools.partial(_call_in_worker, method_name, args)
+        else:
+            call = functools.partial(getattr(self.analytics, method_name), *args)
+        start = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self.executor, call)
+        finally:
+            POOL_CALL_LATENCY.observe(time.perf_counter() - start, method_name)
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "shed": self.shed,
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
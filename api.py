@@ -1,16 +1,290 @@
-import pandas as pd
-from fastapi import FastAPI, HTTPException
+import asyncio
+import os
+import secrets
+import time
+from contextvars import ContextVar
+from urllib.parse import quote
+from fastapi import FastAPI, Header, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from starlette.routing import Match
 from typing import List, Dict, Optional
-from analytics import Analytics
+from cache_warmup import AccessLog, CacheWarmup, url_scope
+from dataset_state import DatasetLoader, DatasetReloader, load_dataset_state
+from metrics import COALESCED_REQUESTS, IN_FLIGHT, PROFILER, REGISTRY, REQUEST_LATENCY, RESPONSE_BYTES, RESPONSES, timed
+from query import QueryError, parse_aggregates, query_row_limit, validate_filters, validate_group_by
+from response_cache import CachedResponse, choose_encoding, compressed_variants, etag_matches, make_etag, normalize_params
+from row_export import EXPORT_MEDIA_TYPES, export_chunks, released_after
+from shared_dataset import default_shared_dir
+import numpy as np
+import orjson
 import uvicorn
 
-dataframe = pd.read_excel("data/merged_file.xlsx")
-analytics = Analytics(dataframe)
-valid_course_codes = analytics.get_unique_course_codes()
+# DATA_PATH points the API at another dataset (eg. the synthetic one used by the benchmarks)
+DATA_PATH = os.environ.get("DATA_PATH", "data/merged_file.xlsx")
+
+# chart computations run on a pool instead of the event loop (ANALYTICS_POOL_MODE is "thread" or "process")
+POOL_OPTIONS = dict(
+    mode=os.environ.get("ANALYTICS_POOL_MODE", "thread"),
+    max_workers=int(os.environ.get("ANALYTICS_POOL_WORKERS", 4)),
+    max_pending=int(os.environ.get("ANALYTICS_MAX_PENDING", 32)),
+)
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", 4096))
+# bytes the cached bodies (compressed variants included) of a worker may take, the least recently used are evicted past it
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+# cached bodies of at least this many bytes also get gzip (and brotli if installed) variants, served by Accept-Encoding
+COMPRESSION_MIN_BYTES = int(os.environ.get("COMPRESSION_MIN_BYTES", 256))
+# output directory of materialize.py, its responses are served instead of computing them when built from the current dataset
+MATERIALIZED_DIR = os.environ.get("MATERIALIZED_DIR")
+
+# API_WORKERS > 1 serves from several uvicorn worker processes, which map one shared copy of the dataset from
+# SHARED_DATASET_DIR instead of each building their own (set SHARED_DATASET_DIR to share it with a single worker too)
+API_WORKERS = int(os.environ.get("API_WORKERS", 1))
+SHARED_DATASET_DIR = os.environ.get("SHARED_DATASET_DIR") or (default_shared_dir() if API_WORKERS > 1 else None)
+
+# STORAGE_BACKEND=sqlite queries data/merged_file.sqlite (written by excel_merge.py, or on startup when missing or stale)
+# instead of holding the dataset in memory
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "pandas")
+
+# DISK_CACHE_DIR also caches responses on disk per dataset version, so they survive restarts and are shared by the workers
+DISK_CACHE_DIR = os.environ.get("DISK_CACHE_DIR")
+# bytes the disk cache of a dataset version may take, the least recently used responses are removed past it
+DISK_CACHE_MAX_BYTES = int(os.environ.get("DISK_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+# ACCESS_LOG_PATH records the url of every data route request. At startup the WARMUP_TOP most requested urls among the last
+# WARMUP_LOG_LINES lines of WARMUP_LOG_PATH (defaults to ACCESS_LOG_PATH, nginx/uvicorn access logs work too) are replayed
+# once the dataset is loaded, and /readyz waits for them
+ACCESS_LOG_PATH = os.environ.get("ACCESS_LOG_PATH")
+WARMUP_LOG_PATH = os.environ.get("WARMUP_LOG_PATH", ACCESS_LOG_PATH)
+WARMUP_TOP = int(os.environ.get("WARMUP_TOP", 500))
+WARMUP_LOG_LINES = int(os.environ.get("WARMUP_LOG_LINES", 200000))
+# the access log is written off the event loop and moved to <ACCESS_LOG_PATH>.1 once it reaches ACCESS_LOG_MAX_BYTES,
+# the warmup reads both
+ACCESS_LOG_MAX_BYTES = int(os.environ.get("ACCESS_LOG_MAX_BYTES", 50 * 1024 * 1024))
+
+# None until dataset_loader has built the first state, the data routes answer 503 until then
+dataset_state = None
+# the state a request started with, so it finishes on the same dataset version even if a reload swaps dataset_state
+pinned_dataset = ContextVar("pinned_dataset", default=None)
+
+
+def current_dataset():
+    return pinned_dataset.get() or dataset_state
+
+
+def swap_dataset(state):
+    global dataset_state
+    old_state = dataset_state
+    dataset_state = state
+    old_state.retire()
+
+
+def load_state():
+    """DatasetState of the current data files, only reads the data if the storage needs a frame (see load_dataset_state)"""
+    return load_dataset_state(DATA_PATH, POOL_OPTIONS, RESPONSE_CACHE_SIZE, MATERIALIZED_DIR, SHARED_DATASET_DIR, STORAGE_BACKEND, DISK_CACHE_DIR, DISK_CACHE_MAX_BYTES, RESPONSE_CACHE_MAX_BYTES)
+
+
+dataset_reloader = DatasetReloader(
+    DATA_PATH,
+    load_state=load_state,
+    # None until the first dataset is loaded, a reload does nothing until then
+    current_version=lambda: dataset_state.version if dataset_state is not None else None,
+    on_swap=swap_dataset,
+)
+# DATA_WATCH_INTERVAL (seconds) turns on polling of the data files for changes, once the first load is done
+DATA_WATCH_INTERVAL = float(os.environ.get("DATA_WATCH_INTERVAL", 0))
+
+
+def set_first_dataset(state):
+    global dataset_state
+    dataset_state = state
+    if DATA_WATCH_INTERVAL > 0:
+        dataset_reloader.watch(DATA_WATCH_INTERVAL)
+
+
+# loads data/merged_file.parquet (only parses the xlsx if the snapshot is missing or stale) in the background once the
+# app starts, so the server accepts connections right away. Scripts using the app in process call dataset_loader.wait()
+dataset_loader = DatasetLoader(load_state, on_ready=set_first_dataset)
+access_log = AccessLog(ACCESS_LOG_PATH, ACCESS_LOG_MAX_BYTES) if ACCESS_LOG_PATH else None
+# replays run through the whole app, as many at once as the pool has workers
+cache_warmup = CacheWarmup(WARMUP_LOG_PATH, WARMUP_TOP, WARMUP_LOG_LINES, POOL_OPTIONS["max_workers"])
+
 app = FastAPI()
 
+# routes whose Analytics calls go through the pool, shed with a 503 once too many are pending
+POOLED_PATH_PREFIXES = ("/coursedata/", "/instructordata/", "/query", "/export/")
+
+# the dataset only changes on deploy or reload, so responses of the data routes are cached per dataset version
+CACHED_PATH_PREFIXES = ("/coursedata/", "/instructordata/", "/coursename/", "/coursestaughtbyprofessor/", "/uniqueprofessors", "/uniquecourses", "/search", "/query")
+# routes that do not read the dataset, served while it is still loading
+NO_DATASET_PATH_PREFIXES = ("/healthz", "/readyz", "/metrics", "/admin/profiler/", "/docs", "/redoc", "/openapi.json")
+# seconds clients are told to wait before retrying while the dataset loads
+LOADING_RETRY_AFTER = 5
+# most rows a /query may aggregate, as a fraction of the rows of the dataset (QUERY_MAX_ROWS sets a number of rows instead).
+# Bigger queries are rejected with a 400, as are queries without a course_code, term or window filter
+QUERY_MAX_ROWS_FRACTION = float(os.environ.get("QUERY_MAX_ROWS_FRACTION", 0.25))
+QUERY_MAX_ROWS = int(os.environ["QUERY_MAX_ROWS"]) if os.environ.get("QUERY_MAX_ROWS") else None
+# most results /search returns
+MAX_SEARCH_LIMIT = 50
+
+
+def matched_route(request):
+    """Returns (route, path params) of the route handling the request, (None, None) if no route matches"""
+    for route in request.app.router.routes:
+        match, child_scope = route.matches(request.scope)
+        if match == Match.FULL:
+            return route, child_scope.get("path_params", {})
+    return None, None
+
+
+def route_cache_key(request):
+    """Returns (route path, normalized path and query params) of the route handling the request, None if no route matches"""
+    route, path_params = matched_route(request)
+    if route is None:
+        return None
+    # only the params the route reads, so urls with extra params share the entry of the url without them
+    declared = {param.alias for param in route.dependant.query_params}
+    query_params = {name: value for name, value in request.query_params.items() if name in declared}
+    return (route.path, normalize_params({**query_params, **path_params}))
+
+
+def url_cache_key(url):
+    """Cache key of a url (as recorded in the access log), None if it is not a cached route"""
+    scope = url_scope(app, url)
+    if not scope["path"].startswith(CACHED_PATH_PREFIXES):
+        return None
+    return route_cache_key(Request(scope))
+
+
+def record_access(request):
+    """Queues the url of a request answered from the cache for the access log (if any), replays of the warmup excluded"""
+    if access_log is None or request.scope.get("warmup"):
+        return
+    raw_path = request.scope.get("raw_path")
+    path = raw_path.decode("latin-1") if raw_path else quote(request.url.path)
+    access_log.record(f"{path}?{request.url.query}" if request.url.query else path)
+
+
+# registered first so it sits inside the response cache: cache hits are never shed
+@app.middleware("http")
+async def load_shedding_middleware(request: Request, call_next):
+    if not request.url.path.startswith(POOLED_PATH_PREFIXES):
+        return await call_next(request)
+    pool = current_dataset().pool
+    if not pool.try_admit():
+        return JSONResponse(status_code=503, content={"detail": "Server busy, try again shortly"}, headers={"Retry-After": "1"})
+    try:
+        return await call_next(request)
+    finally:
+        pool.release()
+
+
+@app.middleware("http")
+async def response_cache_middleware(request: Request, call_next):
+    if request.method != "GET" or not request.url.path.startswith(CACHED_PATH_PREFIXES):
+        return await call_next(request)
+    key = route_cache_key(request)
+    if key is None:
+        return await call_next(request)
+
+    state = current_dataset()
+    etag = make_etag(state.version, key)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        record_access(request)
+        return Response(status_code=304, headers={"ETag": etag, "Vary": "Accept-Encoding"})
+
+    entry = state.response_cache.get(key)
+    if entry is None and state.materialized is not None and not request.url.query:
+        body = state.materialized.get(request.url.path)
+        if body is not None:
+            entry = CachedResponse(body, "application/json", compressed_variants(body, COMPRESSION_MIN_BYTES))
+            state.response_cache.put(key, entry)
+    if entry is None and state.disk_cache is not None:
+        entry = await run_in_threadpool(state.disk_cache.get, key)
+        if entry is not None:
+            state.response_cache.put(key, entry)
+    if entry is None:
+        leader, flight = state.in_flight.join(key)
+        if not leader:
+            COALESCED_REQUESTS.inc(key[0])
+            # shielded so a client disconnecting while it waits does not cancel the leader's result for the others
+            entry = await asyncio.shield(flight)
+            if entry is None:
+                # the leader failed or answered an error, which is not shared: compute our own response
+                return await call_next(request)
+    if entry is None:
+        try:
+            response = await call_next(request)
+            # errors are not cached
+            if response.status_code != 200:
+                return response
+            body = b"".join([chunk async for chunk in response.body_iterator])
+            entry = CachedResponse(body, response.media_type or response.headers.get("content-type"), compressed_variants(body, COMPRESSION_MIN_BYTES))
+            state.response_cache.put(key, entry)
+            if state.disk_cache is not None:
+                state.disk_cache.put_later(key, entry)
+        finally:
+            # also on errors and cancellation, so waiters never hang
+            state.in_flight.finish(key, entry)
+
+    # entries only hold 200 responses, so If-None-Match: * can match from here on
+    if etag_matches(request.headers.get("if-none-match"), etag, exists=True):
+        record_access(request)
+        return Response(status_code=304, headers={"ETag": etag, "Vary": "Accept-Encoding"})
+
+    # the body depends on Accept-Encoding even when it goes out uncompressed
+    headers = {"ETag": etag, "Vary": "Accept-Encoding"}
+    encoding = choose_encoding(request.headers.get("accept-encoding"), entry.variants)
+    body = entry.body
+    if encoding is not None:
+        body = entry.variants[encoding]
+        # a different byte sequence than the plain body, so only a weak ETag (matched by If-None-Match all the same)
+        headers["ETag"] = "W/" + etag
+        headers["Content-Encoding"] = encoding
+    RESPONSE_BYTES.inc(encoding or "identity", amount=len(body))
+    record_access(request)
+    return Response(content=body, media_type=entry.media_type, headers=headers)
+
+
+@app.middleware("http")
+async def pin_dataset_middleware(request: Request, call_next):
+    if request.url.path.startswith(NO_DATASET_PATH_PREFIXES):
+        return await call_next(request)
+    state = dataset_state
+    if state is None:
+        return JSONResponse(status_code=503, content={"detail": "Dataset is loading, try again shortly"}, headers={"Retry-After": str(LOADING_RETRY_AFTER)})
+    # a reload may swap and retire the state between reading and pinning it
+    while not state.acquire():
+        state = dataset_state
+    token = pinned_dataset.set(state)
+    try:
+        return await call_next(request)
+    finally:
+        pinned_dataset.reset(token)
+        state.release()
+
+
+# registered last among ours so the latency covers the other middlewares too (CORS is added after it and stays the outer middleware)
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    route, _ = matched_route(request)
+    # unmatched paths share one label so random urls cannot blow up the number of series
+    route_path = route.path if route is not None else "unmatched"
+    IN_FLIGHT.inc(route_path)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        REQUEST_LATENCY.observe(time.perf_counter() - start, request.method, route_path)
+        RESPONSES.inc(request.method, route_path, str(status))
+        IN_FLIGHT.dec(route_path)
+
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -75,12 +349,276 @@ class CourseDataResponse(BaseModel):
     chartData: ChartData
 
 
+class SearchResult(BaseModel):
+    type: str
+    value: str
+    label: str
+
+class SearchResponse(BaseModel):
+    data: List[SearchResult]
+
+
+class QueryResponse(BaseModel):
+    group_by: str
+    rows: int
+    groups: List[str]
+    aggregates: Dict[str, List[Optional[float]]]
+
+
+class CoursePageResponse(BaseModel):
+    overview: CourseDataResponse
+    instructor_median_bid_chart: CourseDataResponse
+    instructors: ReturnStringArr
+    terms_available: Optional[ReturnStringArr] = None
+    bidding_windows_available: Optional[ReturnStringArr] = None
+    sections_available: Optional[ReturnStringArr] = None
+    bidpriceacrossterms: Optional[CourseDataResponse] = None
+    bidpriceacrossterms_vacancies: Optional[ReturnMultichartDatasetArr] = None
+    bidpriceacrosswindows: Optional[CourseDataResponse] = None
+    bidpriceacrosswindows_vacancies: Optional[ReturnMultichartDatasetArr] = None
+    sectionbidpriceacrosswindows: Optional[CourseDataResponse] = None
+    sectionbidpriceacrosswindows_vacancies: Optional[ReturnMultichartDatasetArr] = None
+
+
+### Response Builders Start ###
+# the builders return plain dicts in the shape of the models above (the wire schema), numbers as float64 numpy arrays.
+# FastJSONResponse encodes them with orjson, skipping pydantic validation of every point and jsonable_encoder.
+# tests/test_wire_schema.py checks the output against the models, benchmarks/serialization_benchmark.py times both
+class FastJSONResponse(JSONResponse):
+    def render(self, content):
+        # NaN (eg. no bids in a window) is written as null
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+
+def float_array(values):
+    """Numbers as float64, as List[float] in the models gives floats on the wire even for whole numbers"""
+    return np.asarray(values, dtype=np.float64)
+
+@timed("response.course_overview_response")
+def course_overview_response(course_code, y_axisDataArr):
+    return {
+        "title": f"{course_code.upper()} Overview (across all sections and windows for Round 1 Window 1 from AY 2019/20 onwards)",
+        "chartData": {
+            "responsive": True,
+            "labels": ["Min 'median bid'", "Median 'median bid'", "Mean 'median bid'", "Max 'median bid'"],
+            "datasets": [{
+                "label": "Median Bid",
+                "data": float_array(y_axisDataArr),
+                "borderColor": "",
+                "backgroundColor": "rgba(41, 128, 185, 1)"
+            }]
+        }
+    }
+
+@timed("response.instructor_median_bid_chart_response")
+def instructor_median_bid_chart_response(chart):
+    [title, x_axis_data, median_median_bid_y_axis_data, mean_median_bid_y_axis_data] = chart
+    return {
+        "title": title,
+        "chartData": {
+            "responsive": True,
+            "labels": list(x_axis_data),
+            "datasets": [{
+                "label": "Median 'Median Bid' price",
+                "data": float_array(median_median_bid_y_axis_data),
+                "borderColor": "",
+                "backgroundColor": "rgba(41, 128, 185, 1)"
+            },
+            {
+                "label": "Mean 'Median Bid' price",
+                "data": float_array(mean_median_bid_y_axis_data),
+                "borderColor": "",
+                "backgroundColor": "rgba(75, 192, 192, 1)"
+            }]
+        }
+    }
+
+@timed("response.bid_price_chart_response")
+def bid_price_chart_response(chart):
+    """Median and mean 'median bid' across terms or across windows"""
+    [title, x_axis_data, y_axis_data_median_bid, y_axis_data_mean_bid] = chart
+    return {
+        "title": title,
+        "chartData": {
+            "responsive": True,
+            "labels": list(x_axis_data),
+            "datasets": [{
+                "label": "Median 'median bid'",
+                "data": float_array(y_axis_data_median_bid),
+                "borderColor": "rgba(75, 192, 192, 1)",
+                "backgroundColor": "rgba(41, 128, 185, 1)",
+            },
+            {
+                "label": "Mean 'median bid'",
+                "data": float_array(y_axis_data_mean_bid),
+                "borderColor": "rgba(75, 50, 192, 1)",
+                "backgroundColor": "rgba(41, 128, 185, 1)",
+            }]
+        }
+    }
+
+@timed("response.section_bid_price_chart_response")
+def section_bid_price_chart_response(chart):
+    [title, x_axis_data, y_axis_data_median_bid, y_axis_data_min_bid] = chart
+    return {
+        "title": title,
+        "chartData": {
+            "responsive": True,
+            "labels": list(x_axis_data),
+            "datasets": [{
+                "label": "Median Bid",
+                "data": float_array(y_axis_data_median_bid),
+                "borderColor": "rgba(75, 192, 192, 1)",
+                "backgroundColor": "rgba(41, 128, 185, 1)",
+            },
+            {
+                "label": "Min Bid",
+                "data": float_array(y_axis_data_min_bid),
+                "borderColor": "rgba(75, 50, 192, 1)",
+                "backgroundColor": "rgba(41, 128, 185, 1)",
+            }]
+        }
+    }
+
+@timed("response.vacancies_response")
+def vacancies_response(vacancies):
+    [y_axis_data_before_vacancies, y_axis_data_after_vacancies] = vacancies
+    return {"data": [
+        {
+            # type is lowercase
+            "type": "bar",
+            "label": "Before Process Vacancies",
+            "data": float_array(y_axis_data_before_vacancies),
+            "borderColor": "rgb(255, 99, 132)",
+            "backgroundColor": "rgba(255, 99, 132, 0.2)",
+            "yAxisID": 'y1'
+        },
+        {
+            "type": "bar",
+            "label": "After Process Vacancies",
+            "data": float_array(y_axis_data_after_vacancies),
+            "borderColor": "rgb(53, 162, 235)",
+            "backgroundColor": "rgba(53, 162, 235, 0.2)",
+            "yAxisID": 'y1',
+        }
+    ]}
+
+def string_array_response(data):
+    return {"data": list(data)}
+
+# builders for each part of the batched course page, keyed like Analytics.get_course_page_data, in CoursePageResponse order
+COURSE_PAGE_BUILDERS = {
+    "instructor_median_bid_chart": instructor_median_bid_chart_response,
+    "instructors": string_array_response,
+    "terms_available": string_array_response,
+    "bidding_windows_available": string_array_response,
+    "sections_available": string_array_response,
+    "bidpriceacrossterms": bid_price_chart_response,
+    "bidpriceacrossterms_vacancies": vacancies_response,
+    "bidpriceacrosswindows": bid_price_chart_response,
+    "bidpriceacrosswindows_vacancies": vacancies_response,
+    "sectionbidpriceacrosswindows": section_bid_price_chart_response,
+    "sectionbidpriceacrosswindows_vacancies": vacancies_response,
+}
+
+def course_page_response(course_code, page):
+    # parts the query params did not ask for are null, like the unset Optional fields of CoursePageResponse
+    response = {"overview": course_overview_response(course_code, page["overview"])}
+    for name, build in COURSE_PAGE_BUILDERS.items():
+        response[name] = build(page[name]) if name in page else None
+    return response
+### Response Builders End ###
+
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process serves requests. Fails once loading the dataset has failed, as only a restart can fix that"""
+    if dataset_loader.last_error is not None:
+        return JSONResponse(status_code=503, content={"status": "failed", "detail": "Dataset load failed"})
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: the dataset is loaded, the data routes answer and the cache warmup is done"""
+    state = dataset_state
+    status = {"version": state.version if state is not None else None, **dataset_loader.status(), "warmup": cache_warmup.status()}
+    if state is None or not cache_warmup.done:
+        return JSONResponse(status_code=503, content=status, headers={"Retry-After": str(LOADING_RETRY_AFTER)})
+    return status
+
+@app.get("/cachestats")
+async def get_cache_stats():
+    # hit/miss/eviction counters of the response cache, used to size RESPONSE_CACHE_SIZE
+    state = current_dataset()
+    return {
+        "dataset_version": state.version,
+        **state.response_cache.stats(),
+        **state.in_flight.stats(),
+        "disk": state.disk_cache.stats() if state.disk_cache is not None else None,
+        "access_log": access_log.stats() if access_log is not None else None,
+    }
+
+@app.get("/poolstats")
+async def get_pool_stats():
+    return current_dataset().pool.stats()
+
+@app.get("/metrics")
+async def get_metrics():
+    # request latency, status counts and in flight requests by route, spans and dataset load times in the Prometheus text format
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+def require_admin_token(x_admin_token):
+    """Admin routes need the X-Admin-Token header to match the ADMIN_TOKEN env var, they are disabled when it is not set"""
+    admin_token = os.environ.get("ADMIN_TOKEN")
+    if not admin_token or not x_admin_token or not secrets.compare_digest(x_admin_token, admin_token):
+        raise HTTPException(
+            status_code=403,
+            detail="Forbidden"
+        )
+
+@app.post("/admin/reload")
+async def reloadDataset(x_admin_token: Optional[str] = Header(None)):
+    """Rebuilds the dataset in the background and swaps it in once ready"""
+    require_admin_token(x_admin_token)
+    started = dataset_reloader.trigger()
+    return {"started": started, **dataset_reloader.status()}
+
+@app.post("/admin/profiler/start")
+async def startProfiler(interval: float = 0.01, x_admin_token: Optional[str] = Header(None)):
+    """Starts sampling the stacks of every thread every interval seconds"""
+    require_admin_token(x_admin_token)
+    started = PROFILER.start(max(interval, 0.001))
+    return {"started": started, **PROFILER.status()}
+
+@app.post("/admin/profiler/stop")
+async def stopProfiler(x_admin_token: Optional[str] = Header(None)):
+    """Stops the profiler and returns the sampled stacks in the folded format (flamegraph.pl, speedscope)"""
+    require_admin_token(x_admin_token)
+    return PlainTextResponse(PROFILER.stop())
+
+@app.on_event("startup")
+async def start_dataset_load():
+    dataset_loader.start()
+    if not cache_warmup.done:
+        app.state.warmup_task = asyncio.create_task(warm_up_cache())
+
+async def warm_up_cache():
+    await asyncio.get_running_loop().run_in_executor(None, dataset_loader.done.wait)
+    if dataset_loader.ready:
+        await cache_warmup.run(app, url_cache_key)
+
+@app.on_event("shutdown")
+def shutdown_analytics_pool():
+    if dataset_state is not None:
+        dataset_state.pool.shutdown()
+    if access_log is not None:
+        access_log.close()
+
 @app.get("/uniqueprofessors")
 async def get_unique_professors():
     # returns string of course_code : course_name
     try:
         response = ReturnStringArr (
-            data = analytics.get_unique_professors()
+            data = current_dataset().analytics.get_unique_professors()
         )
         return response
     except Exception as e:
@@ -94,7 +632,7 @@ async def get_unique_course_codes():
     # returns string of course_code : course_name
     try:
         response = ReturnStringArr (
-            data = analytics.course_code_and_name_str_array
+            data = current_dataset().analytics.course_code_and_name_str_array
         )
         return response
     except Exception as e:
@@ -103,10 +641,21 @@ async def get_unique_course_codes():
             detail="Server Error"
         ) 
     
+@app.get("/search")
+async def searchCoursesAndProfessors(q: str, limit: int = 10, type: Optional[str] = None):
+    """Autocomplete for the course and professor pickers: best matches of q, type is "course" or "instructor" to only get one kind"""
+    if type not in (None, "course", "instructor"):
+        raise HTTPException(
+            status_code=400,
+            detail="type must be course or instructor"
+        )
+    entries = current_dataset().search_index.search(q, limit=max(0, min(limit, MAX_SEARCH_LIMIT)), type=type)
+    return SearchResponse(data=[SearchResult(type=entry.type, value=entry.value, label=entry.label) for entry in entries])
+    
 @app.get("/coursename/{course_code}")
 async def returnCourseNameByCourseCode(course_code):
     try:
-        return analytics.get_course_name(course_code)
+        return current_dataset().analytics.get_course_name(course_code)
     except Exception as e:
             raise HTTPException(
             status_code=404,
@@ -117,7 +666,7 @@ async def returnCourseNameByCourseCode(course_code):
 async def returnCourseTaughtByProfessor(instructor_name):
     try:
         response = ReturnStringArr (
-            data = analytics.get_courses_by_professor(instructor_name)
+            data = current_dataset().analytics.get_courses_by_professor(instructor_name)
         )
         return response
     except Exception as e:
@@ -131,7 +680,7 @@ async def returnInstructorsWhoTeachCourse(course_code):
     try:
         # pass in upper case!
         response = ReturnStringArr(
-            data=analytics.get_instructors_by_course_code(course_code.upper())
+            data=await current_dataset().pool.run("get_instructors_by_course_code", course_code.upper())
         )
         return response
         
@@ -146,7 +695,7 @@ async def returnAvailableBiddingWindowsOfInstructorWhoTeachCourse(course_code, i
     try:
         # pass in upper case!
         response = ReturnStringArr(
-            data=analytics.get_bidding_windows_of_instructor_who_teach_course(course_code.upper(), instructor_name)
+            data=await current_dataset().pool.run("get_bidding_windows_of_instructor_who_teach_course", course_code.upper(), instructor_name)
         )
         return response
         
@@ -161,7 +710,7 @@ async def returnAvailableSections(course_code, instructor_name, selectedTerm):
     try:
         # pass in upper case!
         response = ReturnStringArr(
-            data=analytics.get_sections_for_specific_course_instructor_term(course_code.upper(), instructor_name, selectedTerm)
+            data=await current_dataset().pool.run("get_sections_for_specific_course_instructor_term", course_code.upper(), instructor_name, selectedTerm)
         )
         return response
         
@@ -176,7 +725,7 @@ async def returnAvailableTermsOfInstructorWhoTeachCourse(course_code, instructor
     try:
         # pass in upper case!
         response = ReturnStringArr(
-            data=analytics.get_terms_by_course_code_and_instructor(course_code.upper(), instructor_name)
+            data=await current_dataset().pool.run("get_terms_by_course_code_and_instructor", course_code.upper(), instructor_name)
         )
         return response
         
@@ -186,184 +735,75 @@ async def returnAvailableTermsOfInstructorWhoTeachCourse(course_code, instructor
             detail=str(e)
         )
 
-@app.get("/coursedata/overview/{course_code}")
+@app.get("/coursedata/overview/{course_code}", response_model=CourseDataResponse)
 async def returnCourseOverviewData(course_code):
     """"Returns [Min, Max, Median, Mean] Median Bid Price"""
     # ALWAYS PASS IN UPPER CASE COURSE CODE!
-    if course_code.upper() not in valid_course_codes:
+    if course_code.upper() not in current_dataset().valid_course_codes:
         raise HTTPException(
             status_code=404,
             detail="Course Code Not Found"
         )
     try :
-        y_axisDataArr = analytics.get_min_max_median_mean_median_bid_values_by_course_code_and_instructor(course_code.upper())
-        response = CourseDataResponse(
-            title=f"{course_code.upper()} Overview (across all sections and windows for Round 1 Window 1 from AY 2019/20 onwards)",
-            chartData= ChartData(
-                responsive=True,
-                labels=["Min 'median bid'", "Median 'median bid'", "Mean 'median bid'", "Max 'median bid'"],
-                datasets=[{
-                    "label": "Median Bid",
-                    "data": y_axisDataArr,
-                    "borderColor": "",
-                    "backgroundColor": "rgba(41, 128, 185, 1)"
-                }]
-            )
-        )
-        return response
+        y_axisDataArr = await current_dataset().pool.run("get_min_max_median_mean_median_bid_values_by_course_code_and_instructor", course_code.upper())
+        return FastJSONResponse(course_overview_response(course_code, y_axisDataArr))
     except Exception as e:
         raise HTTPException(
             status_code=404,
             detail=str(e)
         ) 
 
-@app.get("/coursedata/overview/instructor_median_bid_chart/{course_code}")
+@app.get("/coursedata/overview/instructor_median_bid_chart/{course_code}", response_model=CourseDataResponse)
 async def returnCourseInstructorOverviewData(course_code):
     """"Returns charting data in form of 2d array: [x_axis_data, y_axis_data]"""
     # ALWAYS PASS IN UPPER CASE COURSE CODE!
     try :
-        [title, x_axis_data, median_median_bid_y_axis_data, mean_median_bid_y_axis_data] = analytics.get_all_instructor_median_and_mean_median_bid_by_course_code(course_code.upper())
-        response = CourseDataResponse(
-            title=title,
-            chartData= ChartData(
-                responsive=True,
-                labels=x_axis_data,
-                datasets=[{
-                    "label": "Median 'Median Bid' price",
-                    "data": median_median_bid_y_axis_data,
-                    "borderColor": "",
-                    "backgroundColor": "rgba(41, 128, 185, 1)"
-                },
-                {
-                    "label": "Mean 'Median Bid' price",
-                    "data": mean_median_bid_y_axis_data,
-                    "borderColor": "",
-                    "backgroundColor": "rgba(75, 192, 192, 1)"
-                }]
-            )
-        )
-        return response
+        chart = await current_dataset().pool.run("get_all_instructor_median_and_mean_median_bid_by_course_code", course_code.upper())
+        return FastJSONResponse(instructor_median_bid_chart_response(chart))
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=str(e)
         ) 
     
-@app.get("/coursedata/bidpriceacrossterms/{course_code}/{window}/{instructor_name}")
+@app.get("/coursedata/bidpriceacrossterms/{course_code}/{window}/{instructor_name}", response_model=CourseDataResponse)
 async def returnBidPriceDataAcrossTermsForSpecifiedCourseAndWindow(course_code, window, instructor_name):
     try:
-        [title, x_axis_data, y_axis_data_median_bid, y_axis_data_mean_bid] = analytics.get_bid_price_data_by_course_code_and_window_across_terms(course_code.upper(), window, instructor_name)
-        response = CourseDataResponse(
-            title=title,
-            chartData= ChartData(
-                responsive=True,
-                labels=x_axis_data,
-                datasets=[{
-                    "label": "Median 'median bid'",
-                    "data": y_axis_data_median_bid,
-                    "borderColor": "rgba(75, 192, 192, 1)",
-                    "backgroundColor": "rgba(41, 128, 185, 1)",
-                },
-                {
-                    "label": "Mean 'median bid'",
-                    "data": y_axis_data_mean_bid,
-                    "borderColor": "rgba(75, 50, 192, 1)",
-                    "backgroundColor": "rgba(41, 128, 185, 1)",
-                }]
-            )
-        )
-        return response
+        chart = await current_dataset().pool.run("get_bid_price_data_by_course_code_and_window_across_terms", course_code.upper(), window, instructor_name)
+        return FastJSONResponse(bid_price_chart_response(chart))
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=str(e)
         ) 
     
-@app.get("/coursedata/bidpriceacrosswindows/{course_code}/{term}/{instructor_name}")
+@app.get("/coursedata/bidpriceacrosswindows/{course_code}/{term}/{instructor_name}", response_model=CourseDataResponse)
 async def returnBidPriceDataAcrossWindowsForSpecifiedCourseAndTerm(course_code, term, instructor_name):
     try:
-        [title, x_axis_data, y_axis_data_median_bid, y_axis_data_mean_bid] = analytics.get_bid_price_data_by_course_code_and_term_across_windows(course_code, term, instructor_name)
-        response = CourseDataResponse(
-            title=title,
-            chartData= ChartData(
-                responsive=True,
-                labels=x_axis_data,
-                datasets=[{
-                    "label": "Median 'median bid'",
-                    "data": y_axis_data_median_bid,
-                    "borderColor": "rgba(75, 192, 192, 1)",
-                    "backgroundColor": "rgba(41, 128, 185, 1)",
-                },
-                {
-                    "label": "Mean 'median bid'",
-                    "data": y_axis_data_mean_bid,
-                    "borderColor": "rgba(75, 50, 192, 1)",
-                    "backgroundColor": "rgba(41, 128, 185, 1)",
-                }]
-            )
-        )
-        return response
+        chart = await current_dataset().pool.run("get_bid_price_data_by_course_code_and_term_across_windows", course_code, term, instructor_name)
+        return FastJSONResponse(bid_price_chart_response(chart))
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=str(e)
         )
     
-@app.get("/coursedata/sectionbidpriceacrosswindows/{course_code}/{term}/{instructor_name}/{section}")
+@app.get("/coursedata/sectionbidpriceacrosswindows/{course_code}/{term}/{instructor_name}/{section}", response_model=CourseDataResponse)
 async def returnBidPriceDataAcrossWindowsForSpecifiedCourseAndTerm(course_code, term, instructor_name, section):
     try:
-        [title, x_axis_data, y_axis_data_median_bid, y_axis_data_min_bid] = analytics.get_bid_price_data_by_course_code_term_and_section_across_windows(course_code, term, instructor_name, section)
-        response = CourseDataResponse(
-            title=title,
-            chartData= ChartData(
-                responsive=True,
-                labels=x_axis_data,
-                datasets=[{
-                    "label": "Median Bid",
-                    "data": y_axis_data_median_bid,
-                    "borderColor": "rgba(75, 192, 192, 1)",
-                    "backgroundColor": "rgba(41, 128, 185, 1)",
-                },
-                {
-                    "label": "Min Bid",
-                    "data": y_axis_data_min_bid,
-                    "borderColor": "rgba(75, 50, 192, 1)",
-                    "backgroundColor": "rgba(41, 128, 185, 1)",
-                }]
-            )
-        )
-        return response
+        chart = await current_dataset().pool.run("get_bid_price_data_by_course_code_term_and_section_across_windows", course_code, term, instructor_name, section)
+        return FastJSONResponse(section_bid_price_chart_response(chart))
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=str(e)
         )
 
-@app.get("/coursedata/bidpriceacrossterms/vacancies/{course_code}/{window}/{instructor_name}")
+@app.get("/coursedata/bidpriceacrossterms/vacancies/{course_code}/{window}/{instructor_name}", response_model=ReturnMultichartDatasetArr)
 async def returnBeforeAfterVacanciesForCourseAndWindowOverTerm(course_code, window, instructor_name):
     try:
-        [y_axis_data_before_vacancies, y_axis_data_after_vacancies] = analytics.get_before_after_vacancies_by_course_code_and_window_across_terms(course_code, window, instructor_name)
-        response = ReturnMultichartDatasetArr(data = [
-            MultitypeDataset(
-                # type is lowercase
-                type = "bar",
-                label = "Before Process Vacancies",
-                data = y_axis_data_before_vacancies,
-                borderColor = "rgb(255, 99, 132)",
-                backgroundColor = "rgba(255, 99, 132, 0.2)",
-                fill = False,
-                yAxisID = 'y1'
-            ),
-            MultitypeDataset(
-                type = "bar",
-                label = "After Process Vacancies",
-                data = y_axis_data_after_vacancies,
-                borderColor = "rgb(53, 162, 235)",
-                backgroundColor = "rgba(53, 162, 235, 0.2)",
-                yAxisID = 'y1',
-            )
-        ])
-        return response
+        vacancies = await current_dataset().pool.run("get_before_after_vacancies_by_course_code_and_window_across_terms", course_code, window, instructor_name)
+        return FastJSONResponse(vacancies_response(vacancies))
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -371,67 +811,97 @@ async def returnBeforeAfterVacanciesForCourseAndWindowOverTerm(course_code, wind
         )
     
 
-@app.get("/coursedata/bidpriceacrosswindows/vacancies/{course_code}/{term}/{instructor_name}")
+@app.get("/coursedata/bidpriceacrosswindows/vacancies/{course_code}/{term}/{instructor_name}", response_model=ReturnMultichartDatasetArr)
 async def returnBeforeAfterVacanciesForCourseAndTermOverWindow(course_code, term, instructor_name):
     try:
-        [y_axis_data_before_vacancies, y_axis_data_after_vacancies] = analytics.get_before_after_vacancies_by_course_code_and_term_across_windows(course_code, term, instructor_name)
-        response = ReturnMultichartDatasetArr(data = [
-            MultitypeDataset(
-                # type is lowercase
-                type = "bar",
-                label = "Before Process Vacancies",
-                data = y_axis_data_before_vacancies,
-                borderColor = "rgb(255, 99, 132)",
-                backgroundColor = "rgba(255, 99, 132, 0.2)",
-                fill = False,
-                yAxisID = 'y1'
-            ),
-            MultitypeDataset(
-                type = "bar",
-                label = "After Process Vacancies",
-                data = y_axis_data_after_vacancies,
-                borderColor = "rgb(53, 162, 235)",
-                backgroundColor = "rgba(53, 162, 235, 0.2)",
-                yAxisID = 'y1',
-            )
-        ])
-        return response
+        vacancies = await current_dataset().pool.run("get_before_after_vacancies_by_course_code_and_term_across_windows", course_code, term, instructor_name)
+        return FastJSONResponse(vacancies_response(vacancies))
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=str(e)
         )
     
-@app.get("/coursedata/sectionbidpriceacrosswindows/vacancies/{course_code}/{term}/{instructor_name}/{section}")
+@app.get("/coursedata/sectionbidpriceacrosswindows/vacancies/{course_code}/{term}/{instructor_name}/{section}", response_model=ReturnMultichartDatasetArr)
 async def returnBeforeAfterVacanciesForCourseTermAndSectionOverWindow(course_code, term, instructor_name, section):
     try:
-        [y_axis_data_before_vacancies, y_axis_data_after_vacancies] = analytics.get_before_after_vacancies_by_course_code_term_and_section_across_windows(course_code, term, instructor_name, section)
-        response = ReturnMultichartDatasetArr(data = [
-            MultitypeDataset(
-                # type is lowercase
-                type = "bar",
-                label = "Before Process Vacancies",
-                data = y_axis_data_before_vacancies,
-                borderColor = "rgb(255, 99, 132)",
-                backgroundColor = "rgba(255, 99, 132, 0.2)",
-                fill = False,
-                yAxisID = 'y1'
-            ),
-            MultitypeDataset(
-                type = "bar",
-                label = "After Process Vacancies",
-                data = y_axis_data_after_vacancies,
-                borderColor = "rgb(53, 162, 235)",
-                backgroundColor = "rgba(53, 162, 235, 0.2)",
-                yAxisID = 'y1',
-            )
-        ])
-        return response
+        vacancies = await current_dataset().pool.run("get_before_after_vacancies_by_course_code_term_and_section_across_windows", course_code, term, instructor_name, section)
+        return FastJSONResponse(vacancies_response(vacancies))
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=str(e)
+        )
+
+@app.get("/coursedata/coursepage/{course_code}", response_model=CoursePageResponse)
+async def returnCoursePageData(course_code, instructor_name: Optional[str] = None, term: Optional[str] = None, window: Optional[str] = None, section: Optional[str] = None):
+    """Returns every chart of a course page in one response, computed from a single lookup of the course.
+    The instructor charts need instructor_name, the across terms charts window, the across windows charts term, and the section charts term and section"""
+    if course_code.upper() not in current_dataset().valid_course_codes:
+        raise HTTPException(
+            status_code=404,
+            detail="Course Code Not Found"
+        )
+    try:
+        page = await current_dataset().pool.run("get_course_page_data", course_code.upper(), instructor_name, term, window, section)
+        return FastJSONResponse(course_page_response(course_code, page))
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=str(e)
         )
     
+@app.get("/query", response_model=QueryResponse)
+async def queryRows(group_by: str, aggregates: str, course_code: Optional[str] = None, instructor_name: Optional[str] = None, term: Optional[str] = None, window: Optional[str] = None, section: Optional[str] = None):
+    """Aggregates of the rows matching the filters given by value of group_by, eg. group_by=term&aggregates=median_bid:median,min_bid:min.
+    Queries need a course_code, term or window filter, and queries matching too many rows (see QUERY_MAX_ROWS_FRACTION) are rejected,
+    add filters to narrow them down"""
+    filters = dict(course_code=course_code, instructor_name=instructor_name, term=term, window=window, section=section)
+    filters = {name: value for name, value in filters.items() if value is not None}
+    try:
+        filters = validate_filters(filters)
+        group_by = validate_group_by(group_by)
+        parsed_aggregates = parse_aggregates(aggregates)
+        state = current_dataset()
+        max_rows = query_row_limit(state.row_count, QUERY_MAX_ROWS_FRACTION, QUERY_MAX_ROWS)
+        result = await state.pool.run("query", filters, group_by, parsed_aggregates, max_rows)
+        return FastJSONResponse(result)
+    except QueryError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=str(e)
+        )
+
+@app.get("/export/rows")
+async def exportRows(course_code: Optional[str] = None, instructor_name: Optional[str] = None, term: Optional[str] = None, window: Optional[str] = None, section: Optional[str] = None, format: str = "ndjson"):
+    """Streams the rows behind the charts matching the filters given (every row without filters) as NDJSON or CSV.
+    Rows are converted a chunk at a time while the response is sent, the export is never held in memory as a whole"""
+    if format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail="format must be ndjson or csv"
+        )
+    state = current_dataset()
+    positions = await state.pool.run("matching_positions", course_code, instructor_name, term, window, section)
+    # pin_dataset_middleware releases the state once this returns, before the body is streamed: keep it pinned until the
+    # export is over so a reload cannot shut it down mid export. Released by the generator, or by the background task
+    # if the stream never got to run it
+    release = state.hold()
+    return StreamingResponse(
+        released_after(export_chunks(state.analytics, positions, format), release),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f"attachment; filename=bossanalytics-export.{format}"},
+        background=BackgroundTask(release),
+    )
+    
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8080)
\ No newline at end of file
+    if API_WORKERS > 1:
+        # every worker starts loading, the first one publishes the dataset to SHARED_DATASET_DIR and the others map it
+        uvicorn.run("api:app", host="0.0.0.0", port=8080, workers=API_WORKERS)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8080)
\ No newline at end of file
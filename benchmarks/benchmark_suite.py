@@ -0,0 +1,249 @@
+### Times Analytics and every API route on synthetic BOSS data and compares the results with a saved baseline ###
+# usage: python benchmarks/benchmark_suite.py [--scale 1] [--save-baseline benchmarks/baseline.json] [--baseline benchmarks/baseline.json]
+import argparse
+import inspect
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from urllib.parse import quote, urlencode
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from analytics import Analytics
+from dataset import read_snapshot
+from synthetic_data import generate_boss_data, write_snapshot_file
+
+# values of the Analytics method args and route params, by name, for one sampled row
+SAMPLE_ARGS = {
+    "course_code": "course_code",
+    "instructor_name": "instructor",
+    "instructor": "instructor",
+    "term": "term",
+    "selectedTerm": "term",
+    "window": "window",
+    "section": "section",
+    "filter_by_section": "section",
+    "faculty": "school",
+    "q": "search",
+    "group_by": "group_by",
+    "aggregates": "aggregates",
+}
+# the same /query shape for every sample, with the filters of the sampled row
+QUERY_SAMPLE = {"group_by": "term", "aggregates": "median_bid:median,min_bid:min"}
+# differences below this many ms are noise, not regressions
+NOISE_FLOOR_MS = 0.05
+
+
+def sample_rows(analytics, count, seed):
+    """Returns count argument sets taken from random rows of the dataset, so every lookup hits existing data"""
+    df = analytics.filtered_data
+    positions = np.random.RandomState(seed).randint(len(df), size=count)
+    rows = df.iloc[positions]
+    return [
+        {
+            "course_code": course_code, "instructor": instructor, "term": term, "window": window,
+            "section": section, "school": school, "search": course_code[:4].lower(), **QUERY_SAMPLE,
+        }
+        for course_code, instructor, term, window, section, school in zip(
+            rows["Course Code"], rows["Instructor"], rows["Term"], rows["Bidding Window"], rows["Section"], rows["School/Department"]
+        )
+    ]
+
+
+def summarize(latencies_ms):
+    latencies = np.array(latencies_ms)
+    return {
+        "calls": len(latencies),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 4),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 4),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 4),
+        "mean_ms": round(float(latencies.mean()), 4),
+    }
+
+
+def time_calls(call, samples, repeats):
+    """Latency in ms of call(sample) for every sample, repeats times. Calls that raise are counted as errors,
+    returns None if every call did"""
+    latencies = []
+    errors = 0
+    for _ in range(repeats):
+        for sample in samples:
+            start = time.perf_counter()
+            try:
+                call(sample)
+            except Exception as e:
+                if not errors:
+                    print(f"  error: {type(e).__name__}: {e}")
+                errors += 1
+                continue
+            latencies.append((time.perf_counter() - start) * 1000)
+    if not latencies:
+        return None
+    return {**summarize(latencies), "errors": errors}
+
+
+def benchmark_init(df, repeats):
+    """Analytics.__init__ latency, plus its peak allocations (measured separately as tracing slows it down)"""
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        analytics = Analytics(df)
+        latencies.append((time.perf_counter() - start) * 1000)
+    tracemalloc.start()
+    Analytics(df)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return analytics, summarize(latencies), peak
+
+
+def analytics_methods():
+    """Every filter_* and get_* method of Analytics with the names of its parameters"""
+    for name, method in inspect.getmembers(Analytics, inspect.isfunction):
+        if name.startswith(("filter_", "get_")):
+            yield name, [param for param in inspect.signature(method).parameters if param != "self"]
+
+
+def benchmark_analytics(analytics, samples, repeats):
+    results = {}
+    for name, params in analytics_methods():
+        print(f"Analytics.{name}")
+        method = getattr(analytics, name)
+        result = time_calls(lambda sample: method(*[sample[SAMPLE_ARGS[param]] for param in params]), samples, repeats)
+        if result:
+            results[f"Analytics.{name}"] = result
+    return results
+
+
+def route_url(route, sample):
+    """Url of route filled in from sample, None if it needs a param we have no value for"""
+    path_params = {param.name for param in route.dependant.path_params}
+    if not all(param in SAMPLE_ARGS for param in path_params):
+        return None
+    # query params we have no value for are left out, a route requiring one answers 422 and is skipped
+    query = {param.name: sample[SAMPLE_ARGS[param.name]] for param in route.dependant.query_params if param.name in SAMPLE_ARGS}
+    url = route.path.format(**{param: quote(str(sample[SAMPLE_ARGS[param]]), safe="") for param in path_params})
+    return url + ("?" + urlencode(query) if query else "")
+
+
+def benchmark_routes(data_path, samples, repeats, cached):
+    """Times every GET route of the API through an in process client, loading the app on data_path"""
+    os.environ["DATA_PATH"] = data_path
+    if not cached:
+        # every request computes its response instead of measuring cache hits
+        os.environ["RESPONSE_CACHE_SIZE"] = "0"
+    from fastapi.testclient import TestClient
+
+    start = time.perf_counter()
+    import api
+    api.dataset_loader.wait()
+    results = {"api startup": summarize([(time.perf_counter() - start) * 1000])}
+
+    with TestClient(api.app) as client:
+        for route in api.app.routes:
+            if "GET" not in getattr(route, "methods", ()) or not hasattr(route, "dependant"):
+                continue
+            urls = [route_url(route, sample) for sample in samples]
+            if None in urls:
+                print(f"GET {route.path} skipped: no value for one of its params")
+                continue
+            print(f"GET {route.path}")
+
+            def call(url):
+                response = client.get(url)
+                if response.status_code >= 500 or response.status_code == 422:
+                    raise RuntimeError(f"{url} returned {response.status_code}")
+
+            result = time_calls(call, urls, repeats)
+            if result:
+                results[f"GET {route.path}"] = result
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """Prints the change in p50 and p95 of every case and returns the cases whose p95 got slower than tolerance allows"""
+    regressions = []
+    print(f"\n{'case':<90}{'p50 ms':>10}{'base':>10}{'p95 ms':>10}{'base':>10}")
+    for case, result in results["cases"].items():
+        base = baseline["cases"].get(case)
+        if base is None:
+            print(f"{case:<90}{result['p50_ms']:>10.3f}{'new':>10}{result['p95_ms']:>10.3f}{'new':>10}")
+            continue
+        regressed = result["p95_ms"] > base["p95_ms"] * (1 + tolerance) and result["p95_ms"] - base["p95_ms"] > NOISE_FLOOR_MS
+        if regressed:
+            regressions.append(case)
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{case:<90}{result['p50_ms']:>10.3f}{base['p50_ms']:>10.3f}{result['p95_ms']:>10.3f}{base['p95_ms']:>10.3f}{flag}")
+    for key in ("analytics_init_peak_bytes", "max_rss_bytes"):
+        print(f"{key}: {results['memory'][key]} (baseline {baseline['memory'].get(key)})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks Analytics and the API on synthetic data")
+    parser.add_argument("--scale", type=float, default=1.0, help="dataset size as a multiple of the current one (eg. 10 or 100)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--samples", type=int, default=30, help="distinct argument sets per method and route")
+    parser.add_argument("--repeats", type=int, default=3, help="times every argument set is run")
+    parser.add_argument("--skip-api", action="store_true", help="only benchmark Analytics")
+    parser.add_argument("--cached", action="store_true", help="leave the response cache on when timing the routes")
+    parser.add_argument("--baseline", help="results json to compare with, exits with status 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p95 slowdown before a case counts as a regression")
+    parser.add_argument("--save-baseline", help="writes the results json here")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        # only the snapshot is written, load_dataset uses it when there is no xlsx next to it
+        data_path = os.path.join(data_dir, "merged_file.xlsx")
+        snapshot_path = os.path.join(data_dir, "merged_file.parquet")
+        write_snapshot_file(generate_boss_data(args.scale, args.seed), snapshot_path)
+        df = read_snapshot(snapshot_path)
+        print(f"{len(df)} synthetic rows (scale {args.scale}, seed {args.seed})")
+
+        analytics, init_result, init_peak = benchmark_init(df, args.repeats)
+        samples = sample_rows(analytics, args.samples, args.seed)
+        cases = {"Analytics.__init__": init_result}
+        cases.update(benchmark_analytics(analytics, samples, args.repeats))
+        if not args.skip_api:
+            cases.update(benchmark_routes(data_path, samples, args.repeats, args.cached))
+
+    results = {
+        "scale": args.scale,
+        "rows": len(df),
+        "cases": cases,
+        "memory": {
+            "analytics_init_peak_bytes": init_peak,
+            **analytics.memory_footprint(),
+            # ru_maxrss is in KiB on linux
+            "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        },
+    }
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Saved results to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("scale") != args.scale:
+            print(f"Warning: baseline was run at scale {baseline.get('scale')}, not {args.scale}")
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regressions: {', '.join(regressions)}")
+            sys.exit(1)
+    else:
+        print(f"\n{'case':<90}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+        for case, result in cases.items():
+            print(f"{case:<90}{result['p50_ms']:>10.3f}{result['p95_ms']:>10.3f}{result['p99_ms']:>10.3f}{result.get('errors', 0):>8}")
+        print(f"memory: {json.dumps(results['memory'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+### Cold start of the API server: time until it accepts a connection, answers /healthz and is ready (/readyz) ###
+# usage: python benchmarks/cold_start_benchmark.py [--scale 1] [--repeats 3]
+# Before the dataset was loaded in the background the server only accepted connections once ready
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO_DIR)
+
+from synthetic_data import generate_boss_data, write_snapshot_file
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def accepts_connection(port):
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=0.1):
+            return True
+    except OSError:
+        return False
+
+
+def status_of(port, path):
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=1) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return None
+
+
+def cold_start(data_path, timeout):
+    """Seconds from spawning the server until (first accepted connection, /healthz 200, first 503 of a data route, /readyz 200)"""
+    port = free_port()
+    env = {**os.environ, "DATA_PATH": data_path}
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=REPO_DIR, env=env,
+    )
+    times = {}
+    try:
+        while "ready" not in times:
+            if time.perf_counter() - start > timeout or server.poll() is not None:
+                raise RuntimeError("server did not become ready")
+            if "accept" not in times:
+                if accepts_connection(port):
+                    times["accept"] = time.perf_counter() - start
+                else:
+                    time.sleep(0.005)
+                continue
+            if "healthz" not in times and status_of(port, "/healthz") == 200:
+                times["healthz"] = time.perf_counter() - start
+            if "loading 503" not in times and status_of(port, "/uniquecourses") == 503:
+                times["loading 503"] = time.perf_counter() - start
+            if status_of(port, "/readyz") == 200:
+                times["ready"] = time.perf_counter() - start
+            else:
+                time.sleep(0.01)
+    finally:
+        server.terminate()
+        server.wait()
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the cold start of the API server on synthetic data")
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=600)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        write_snapshot_file(generate_boss_data(args.scale, args.seed), os.path.join(data_dir, "merged_file.parquet"))
+        data_path = os.path.join(data_dir, "merged_file.xlsx")
+        runs = [cold_start(data_path, args.timeout) for _ in range(args.repeats)]
+
+    print(f"cold start, scale {args.scale}, best of {args.repeats}")
+    for stage in ("accept", "healthz", "loading 503", "ready"):
+        values = [run[stage] for run in runs if stage in run]
+        if values:
+            print(f"{stage:<14}{min(values):>10.3f}s")
+    print("a data route only answers 503 if it was requested before the dataset was ready")
+
+
+if __name__ == "__main__":
+    main()
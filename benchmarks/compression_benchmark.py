@@ -0,0 +1,72 @@
+### Size of the cached responses of every GET route as is and compressed, and the one off cost of compressing them ###
+# usage: python benchmarks/compression_benchmark.py [--scale 1] [--samples 20]
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from analytics import Analytics
+from benchmark_suite import route_url, sample_rows
+from dataset import read_snapshot
+from response_cache import ENCODINGS, compressed_variants
+from synthetic_data import generate_boss_data, write_snapshot_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compression of the API responses on synthetic data")
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--samples", type=int, default=20, help="urls per route")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        snapshot_path = os.path.join(data_dir, "merged_file.parquet")
+        write_snapshot_file(generate_boss_data(args.scale, args.seed), snapshot_path)
+        samples = sample_rows(Analytics(read_snapshot(snapshot_path)), args.samples, args.seed)
+        os.environ["DATA_PATH"] = os.path.join(data_dir, "merged_file.xlsx")
+        os.environ["RESPONSE_CACHE_SIZE"] = "0"
+        from fastapi.testclient import TestClient
+        import api
+
+        print(f"{'route':<90}{'bytes':>10}" + "".join(f"{encoding + ' bytes':>12}{encoding + ' ms':>10}" for encoding in ENCODINGS))
+        totals = {"identity": 0, **{encoding: 0 for encoding in ENCODINGS}}
+        with TestClient(api.app) as client:
+            api.dataset_loader.wait()
+            for route in api.app.routes:
+                if "GET" not in getattr(route, "methods", ()) or not route.path.startswith(api.CACHED_PATH_PREFIXES):
+                    continue
+                urls = [route_url(route, sample) for sample in samples]
+                if None in urls:
+                    continue
+                sizes = {"identity": [], **{encoding: [] for encoding in ENCODINGS}}
+                seconds = []
+                for url in urls:
+                    response = client.get(url, headers={"Accept-Encoding": "identity"})
+                    if response.status_code != 200:
+                        continue
+                    start = time.perf_counter()
+                    # threshold 0 to see what compressing every body would give
+                    variants = compressed_variants(response.content, 0)
+                    seconds.append(time.perf_counter() - start)
+                    sizes["identity"].append(len(response.content))
+                    for encoding in ENCODINGS:
+                        sizes[encoding].append(len(variants.get(encoding, response.content)))
+                if not seconds:
+                    continue
+                for encoding, values in sizes.items():
+                    totals[encoding] += sum(values)
+                # compression time covers every coding, it is only paid once per cache entry
+                per_encoding_ms = np.mean(seconds) * 1000 / len(ENCODINGS)
+                print(f"{route.path:<90}{np.mean(sizes['identity']):>10.0f}" + "".join(
+                    f"{np.mean(sizes[encoding]):>12.0f}{per_encoding_ms:>10.3f}" for encoding in ENCODINGS))
+
+    print("\ntotal bytes: " + ", ".join(f"{encoding} {size} ({size / totals['identity']:.1%})" for encoding, size in totals.items()))
+
+
+if __name__ == "__main__":
+    main()
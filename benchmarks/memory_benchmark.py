@@ -0,0 +1,39 @@
+### Reports the memory held by Analytics.filtered_data with plain string columns vs the integer coded fact table ###
+# usage: python benchmarks/memory_benchmark.py [path/to/merged_file.xlsx]
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from analytics import Analytics
+from dataset import load_dataframe
+
+
+def mib(n_bytes):
+    return n_bytes / (1 << 20)
+
+
+def main():
+    xlsx_path = sys.argv[1] if len(sys.argv) > 1 else "data/merged_file.xlsx"
+    analytics = Analytics(load_dataframe(xlsx_path))
+
+    compact = analytics.filtered_data
+    # the same rows with every categorical decoded back into one python string per row, as filtered_data used to hold them
+    plain = compact.astype({col: object for col in compact.columns if compact[col].dtype.name == "category"})
+
+    before = plain.memory_usage(index=False, deep=True)
+    after = compact.memory_usage(index=False, deep=True)
+    footprint = analytics.memory_footprint()
+    dimensions_total = sum(footprint["dimension_tables"].values())
+
+    print(f"{len(compact)} rows")
+    print(f"{'column':<24}{'before MiB':>12}{'after MiB':>12}")
+    for col in compact.columns:
+        print(f"{col:<24}{mib(before[col]):>12.2f}{mib(after[col]):>12.2f}")
+    print(f"{'dimension tables':<24}{'':>12}{mib(dimensions_total):>12.2f}")
+    print(f"{'total':<24}{mib(before.sum()):>12.2f}{mib(after.sum() + dimensions_total):>12.2f}")
+    print(f"fact table is {before.sum() / (after.sum() + dimensions_total):.1f}x smaller")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+### Compares the orjson response path of the chart routes with pydantic model validation + jsonable_encoder ###
+# usage: python benchmarks/serialization_benchmark.py [--scale 1] [--samples 200]
+# exits with status 1 if the two paths give different json for any response
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from fastapi.encoders import jsonable_encoder
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from synthetic_data import generate_boss_data, write_snapshot_file
+
+
+def as_lists(value):
+    """payload with its numpy arrays as lists, the input the models were built from before"""
+    if isinstance(value, dict):
+        return {key: as_lists(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [as_lists(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return value
+
+
+def nan_as_null(value):
+    """json of the pydantic path with NaN as null, as the orjson path writes it"""
+    if isinstance(value, dict):
+        return {key: nan_as_null(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [nan_as_null(item) for item in value]
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+def pydantic_body(model, payload):
+    """Body of the pydantic path, rendered like JSONResponse but with NaN allowed (JSONResponse refused it, the routes answered 500)"""
+    content = jsonable_encoder(model.parse_obj(payload))
+    return json.dumps(content, ensure_ascii=False, allow_nan=True, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def same_json(a, b):
+    """Equal values of the same json types, so 1 and 1.0 differ"""
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, dict):
+        return list(a) == list(b) and all(same_json(a[key], b[key]) for key in a)
+    if isinstance(a, list):
+        return len(a) == len(b) and all(same_json(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def chart_payloads(api, analytics, samples, seed):
+    """(model, payload) of every chart response for samples random rows, by response kind"""
+    df = analytics.filtered_data
+    rows = df.iloc[np.random.RandomState(seed).randint(len(df), size=samples)]
+    cases = {name: [] for name in ("overview", "instructor chart", "bid price chart", "section chart", "vacancies", "course page")}
+    for course_code, instructor, term, window, section in zip(rows["Course Code"], rows["Instructor"], rows["Term"], rows["Bidding Window"], rows["Section"]):
+        cases["overview"].append((api.CourseDataResponse, api.course_overview_response(course_code, analytics.get_min_max_median_mean_median_bid_values_by_course_code_and_instructor(course_code))))
+        cases["instructor chart"].append((api.CourseDataResponse, api.instructor_median_bid_chart_response(analytics.get_all_instructor_median_and_mean_median_bid_by_course_code(course_code))))
+        cases["bid price chart"].append((api.CourseDataResponse, api.bid_price_chart_response(analytics.get_bid_price_data_by_course_code_and_term_across_windows(course_code, term, instructor))))
+        cases["section chart"].append((api.CourseDataResponse, api.section_bid_price_chart_response(analytics.get_bid_price_data_by_course_code_term_and_section_across_windows(course_code, term, instructor, section))))
+        cases["vacancies"].append((api.ReturnMultichartDatasetArr, api.vacancies_response(analytics.get_before_after_vacancies_by_course_code_and_term_across_windows(course_code, term, instructor))))
+        page = analytics.get_course_page_data(course_code, instructor, term, window, section)
+        cases["course page"].append((api.CoursePageResponse, api.course_page_response(course_code, page)))
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the serialization of the chart responses")
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--samples", type=int, default=200, help="responses of each kind")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        write_snapshot_file(generate_boss_data(args.scale, args.seed), os.path.join(data_dir, "merged_file.parquet"))
+        os.environ["DATA_PATH"] = os.path.join(data_dir, "merged_file.xlsx")
+        import api
+        api.dataset_loader.wait()
+
+    analytics = api.dataset_state.analytics
+    mismatches = 0
+    print(f"{'response':<20}{'pydantic ms':>14}{'orjson ms':>12}{'speedup':>10}{'with NaN':>10}")
+    for name, payloads in chart_payloads(api, analytics, args.samples, args.seed).items():
+        old_ms, new_ms = [], []
+        with_nan = 0
+        for model, payload in payloads:
+            start = time.perf_counter()
+            new_body = api.FastJSONResponse(payload).body
+            new_ms.append((time.perf_counter() - start) * 1000)
+
+            listed = as_lists(payload)
+            start = time.perf_counter()
+            old_body = pydantic_body(model, listed)
+            old_ms.append((time.perf_counter() - start) * 1000)
+            old_json = json.loads(old_body)
+            with_nan += old_json != nan_as_null(old_json)
+            if not same_json(nan_as_null(old_json), json.loads(new_body)):
+                mismatches += 1
+                if mismatches <= 5:
+                    print(f"  mismatch in {name}:\n    pydantic {old_body[:300]}\n    orjson   {new_body[:300]}")
+        old_p50 = np.percentile(old_ms, 50)
+        new_p50 = np.percentile(new_ms, 50)
+        print(f"{name:<20}{old_p50:>14.4f}{new_p50:>12.4f}{old_p50 / new_p50:>9.1f}x{with_nan:>10}")
+
+    if mismatches:
+        print(f"\n{mismatches} responses differ between the two paths")
+        sys.exit(1)
+    print("\nBoth paths give the same json for every compared response")
+
+
+if __name__ == "__main__":
+    main()
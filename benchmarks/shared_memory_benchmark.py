@@ -0,0 +1,83 @@
+### Memory of N worker processes each building Analytics vs mapping the shared copy of shared_dataset.py ###
+# usage: python benchmarks/shared_memory_benchmark.py [--scale 1] [--workers 4]
+# linux only, reads /proc/<pid>/smaps_rollup
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from dataset import read_snapshot
+from synthetic_data import generate_boss_data, write_snapshot_file
+
+
+def memory_of(pid):
+    """(rss, pss, private) bytes of a process. pss splits shared pages between the processes mapping them"""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    return fields["Rss"], fields["Pss"], fields["Private_Clean"] + fields["Private_Dirty"]
+
+
+def worker(mode, snapshot_path, shared_dir, version, ready, done):
+    from analytics import Analytics
+    from shared_dataset import open_shared_analytics
+
+    start = time.perf_counter()
+    if mode == "shared":
+        analytics = open_shared_analytics(shared_dir, version, lambda: Analytics(read_snapshot(snapshot_path)))
+    else:
+        analytics = Analytics(read_snapshot(snapshot_path))
+    # touch every row like serving requests would
+    course_codes = analytics.get_unique_course_codes()
+    for course_code in course_codes[:200]:
+        analytics.get_course_page_data(course_code)
+    analytics.filtered_data.memory_usage(deep=True)
+    ready.put(time.perf_counter() - start)
+    done.wait()
+
+
+def run(mode, workers, snapshot_path, shared_dir):
+    context = multiprocessing.get_context("spawn")
+    ready = context.Queue()
+    done = context.Event()
+    processes = [context.Process(target=worker, args=(mode, snapshot_path, shared_dir, "benchmark", ready, done)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    startup = [ready.get() for _ in processes]
+    memory = [memory_of(process.pid) for process in processes]
+    done.set()
+    for process in processes:
+        process.join()
+    return startup, memory
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares the memory of workers building Analytics with workers sharing one copy")
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        snapshot_path = os.path.join(data_dir, "merged_file.parquet")
+        write_snapshot_file(generate_boss_data(args.scale, args.seed), snapshot_path)
+        print(f"{args.workers} workers, scale {args.scale}\n")
+        print(f"{'mode':<10}{'startup s':>24}{'rss MiB':>12}{'pss MiB':>12}{'private MiB':>14}{'per worker':>12}")
+        for mode in ("private", "shared"):
+            startup, memory = run(mode, args.workers, snapshot_path, os.path.join(data_dir, "shared"))
+            rss, pss, private = (sum(values) / 2 ** 20 for values in zip(*memory))
+            # the first shared worker builds and publishes, the others only map
+            print(f"{mode:<10}{' / '.join(f'{seconds:.2f}' for seconds in startup):>24}{rss:>12.1f}{pss:>12.1f}{private:>14.1f}{private / args.workers:>12.1f}")
+        print("\nrss, pss and private are summed over the workers, pss is the memory they really take together.")
+        print("Private memory includes about 100 MiB per process for python, numpy and pandas themselves")
+
+
+if __name__ == "__main__":
+    main()
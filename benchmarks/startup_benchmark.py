@@ -0,0 +1,49 @@
+### Compares API startup time when loading the merged xlsx vs the parquet snapshot ###
+# usage: python benchmarks/startup_benchmark.py [path/to/merged_file.xlsx] [repeats]
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from analytics import Analytics
+from dataset import is_snapshot_fresh, read_snapshot, snapshot_path_for
+from excel_merge import build_snapshot
+
+
+def time_startup(load):
+    """Returns (load seconds, Analytics init seconds)"""
+    start = time.perf_counter()
+    df = load()
+    loaded = time.perf_counter()
+    Analytics(df)
+    return loaded - start, time.perf_counter() - loaded
+
+
+def main():
+    xlsx_path = sys.argv[1] if len(sys.argv) > 1 else "data/merged_file.xlsx"
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    snapshot_path = snapshot_path_for(xlsx_path)
+
+    if not is_snapshot_fresh(xlsx_path, snapshot_path):
+        print(f"Building snapshot {snapshot_path}")
+        build_snapshot(xlsx_path)
+
+    loaders = {
+        "xlsx": lambda: pd.read_excel(xlsx_path),
+        "snapshot": lambda: read_snapshot(snapshot_path),
+    }
+    best = {}
+    for name, load in loaders.items():
+        runs = [time_startup(load) for _ in range(repeats)]
+        best[name] = min(runs, key=sum)
+        load_s, init_s = best[name]
+        print(f"{name:>8}: load {load_s:.3f}s + Analytics init {init_s:.3f}s = {load_s + init_s:.3f}s (best of {repeats})")
+
+    print(f"snapshot startup speedup: {sum(best['xlsx']) / sum(best['snapshot']):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
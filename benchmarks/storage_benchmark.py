@@ -0,0 +1,116 @@
+### Compares the pandas and SQLite storage backends of Analytics: same results for every method, latency and memory ###
+# usage: python benchmarks/storage_benchmark.py [--scale 1] [--samples 200]
+# exits with status 1 if the backends disagree on a result
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from analytics import Analytics
+from benchmark_suite import SAMPLE_ARGS, analytics_methods, sample_rows, summarize
+from dataset import read_snapshot, read_snapshot_chunks
+from sqlite_store import SqliteAnalytics, write_store
+from synthetic_data import generate_boss_data, write_snapshot_file
+
+
+def same(a, b):
+    """Deep equality of two results, NaN equal to NaN and frames compared by values and dtypes (not by index)"""
+    if isinstance(a, pd.DataFrame) or isinstance(b, pd.DataFrame):
+        return (
+            isinstance(a, pd.DataFrame) and isinstance(b, pd.DataFrame) and list(a.columns) == list(b.columns)
+            and list(a.dtypes) == list(b.dtypes) and a.reset_index(drop=True).equals(b.reset_index(drop=True))
+        )
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        return np.array_equal(np.asarray(a), np.asarray(b), equal_nan=np.asarray(a).dtype.kind == "f")
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return len(a) == len(b) and all(same(x, y) for x, y in zip(a, b))
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(same(a[key], b[key]) for key in a)
+    if isinstance(a, float) and isinstance(b, float) and a != a and b != b:
+        return True
+    return type(a) == type(b) and a == b
+
+
+def call(method, args):
+    """(result, None) or (None, exception type name) of method(*args)"""
+    try:
+        return method(*args), None
+    except Exception as e:
+        return None, type(e).__name__
+
+
+def calls(samples):
+    """(name, args) of every filter_*/get_* method for every sample, plus the course page, matching rows and query"""
+    for name, params in analytics_methods():
+        for sample in samples:
+            yield name, [sample[SAMPLE_ARGS[param]] for param in params]
+    for sample in samples:
+        yield "get_course_page_data", [sample["course_code"], sample["instructor"], sample["term"], sample["window"], sample["section"]]
+        yield "matching_positions", [None, sample["instructor"], None, sample["window"]]
+        yield "query", [{"course_code": sample["course_code"]}, "term", (("median_bid", "median"), ("min_bid", "min"), ("vacancy", "sum")), 10 ** 9]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks and times the SQLite storage backend against the pandas one")
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--samples", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        snapshot_path = os.path.join(data_dir, "merged_file.parquet")
+        store_path = os.path.join(data_dir, "merged_file.benchmark.sqlite")
+        write_snapshot_file(generate_boss_data(args.scale, args.seed), snapshot_path)
+        df = read_snapshot(snapshot_path)
+
+        start = time.perf_counter()
+        # small chunks, so the store is assembled from many of them like a real merge
+        write_store(lambda: read_snapshot_chunks(snapshot_path, chunk_rows=5000), store_path, "benchmark")
+        print(f"store written in {time.perf_counter() - start:.2f}s, {os.path.getsize(store_path) / 2 ** 20:.1f} MiB\n")
+
+        backends = {}
+        print(f"{'backend':<10}{'init s':>10}{'held MiB':>12}")
+        for name, build in (("pandas", lambda: Analytics(df)), ("sqlite", lambda: SqliteAnalytics(store_path))):
+            tracemalloc.start()
+            start = time.perf_counter()
+            backends[name] = build()
+            seconds = time.perf_counter() - start
+            held = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            print(f"{name:<10}{seconds:>10.3f}{held / 2 ** 20:>12.1f}")
+        del df
+
+        pandas_analytics, sqlite_analytics = backends["pandas"], backends["sqlite"]
+        samples = sample_rows(pandas_analytics, args.samples, args.seed)
+        # lookups of values that do not exist
+        samples += [dict(sample, instructor="NOBODY", term="2099-00 Term 9", window="Nope") for sample in samples[:10]]
+        latencies = {}
+        mismatches = 0
+        for name, call_args in calls(samples):
+            results = []
+            for backend, analytics in backends.items():
+                start = time.perf_counter()
+                results.append(call(getattr(analytics, name), call_args))
+                latencies.setdefault(name, {}).setdefault(backend, []).append((time.perf_counter() - start) * 1000)
+            (expected, expected_error), (actual, actual_error) = results
+            if expected_error != actual_error or (expected_error is None and not same(expected, actual)):
+                mismatches += 1
+                if mismatches <= 10:
+                    print(f"MISMATCH {name}{tuple(call_args)}: {expected_error or expected!r} != {actual_error or actual!r}")
+
+    print(f"\n{'method':<75}{'pandas p50 ms':>15}{'sqlite p50 ms':>15}")
+    for name, by_backend in latencies.items():
+        print(f"{name:<75}" + "".join(f"{summarize(by_backend[backend])['p50_ms']:>15.3f}" for backend in ("pandas", "sqlite")))
+    print(f"\n{mismatches} mismatching results")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
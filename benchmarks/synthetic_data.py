@@ -0,0 +1,119 @@
+### Deterministic generator of BOSS shaped data for the benchmarks ###
+# usage: python benchmarks/synthetic_data.py [scale] [path/to/merged_file.parquet] [seed]
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from excel_merge import reference_columns, to_snapshot_frame
+
+# scale 1 is roughly the size of the current merged dataset, the larger scales stand in for years of future exports
+BASE_ROWS = 20000
+BASE_COURSES = 900
+BASE_INSTRUCTORS = 1200
+
+SCHOOLS = {
+    "ACCT": "School of Accountancy",
+    "COR": "Core Curriculum",
+    "ECON": "School of Economics",
+    "FNCE": "Lee Kong Chian School of Business",
+    "IS": "School of Computing and Information Systems",
+    "LAW": "Yong Pung How School of Law",
+    "MGMT": "Lee Kong Chian School of Business",
+    "PSYC": "School of Social Sciences",
+}
+FIRST_TERM_YEAR = 2019
+TERMS_PER_YEAR = 2
+WINDOWS = [
+    "Incoming Freshmen Rnd 1 Win 1", "Incoming Freshmen Rnd 1 Win 2", "Incoming Freshmen Rnd 1 Win 3", "Incoming Freshmen Rnd 1 Win 4",
+    "Round 1 Window 1", "Round 1 Window 2", "Round 1 Window 3",
+    "Round 1A Window 1", "Round 1A Window 2", "Round 1A Window 3",
+    "Round 1B Window 1", "Round 1B Window 2",
+    "Round 2 Window 1", "Round 2 Window 2", "Round 2 Window 3",
+    "Round 2A Window 1", "Round 2A Window 2", "Round 2A Window 3",
+    "Incoming Exchange Rnd 1C Win 1", "Incoming Exchange Rnd 1C Win 2", "Incoming Exchange Rnd 1C Win 3",
+]
+# most bidding happens in the first windows of each round
+WINDOW_WEIGHTS = np.array([1, 1, 1, 1, 8, 6, 4, 5, 4, 3, 3, 2, 5, 4, 3, 3, 2, 2, 1, 1, 1], dtype=float)
+
+
+def generate_boss_data(scale=1.0, seed=0):
+    """Returns a merged dataset frame (typed like the parquet snapshot) with BASE_ROWS * scale rows.
+    More data mostly means more terms of the same courses, so courses and instructors grow with the square root of
+    scale and the number of academic years by one per doubling"""
+    rng = np.random.RandomState(seed)
+    rows = int(BASE_ROWS * scale)
+    n_courses = max(1, int(BASE_COURSES * np.sqrt(scale)))
+    n_instructors = max(1, int(BASE_INSTRUCTORS * np.sqrt(scale)))
+    n_years = 5 + max(0, int(np.log2(max(scale, 1))))
+
+    terms = np.array([f"{year}-{str(year + 1)[2:]} Term {term}" for year in range(FIRST_TERM_YEAR, FIRST_TERM_YEAR + n_years) for term in range(1, TERMS_PER_YEAR + 1)])
+    prefixes = np.array(list(SCHOOLS))
+    course_prefix = prefixes[rng.randint(len(prefixes), size=n_courses)]
+    course_codes = np.array([f"{prefix}{100 + i}" for i, prefix in enumerate(course_prefix)])
+    course_names = np.array([f"{prefix} Topics {i}" for i, prefix in enumerate(course_prefix)])
+    course_schools = np.array([SCHOOLS[prefix] for prefix in course_prefix])
+    # popular courses get both more rows and higher bids
+    popularity = rng.zipf(1.6, size=n_courses).clip(max=50).astype(float)
+    base_bid = 10 + 8 * np.log1p(popularity) + rng.uniform(0, 20, size=n_courses)
+
+    instructors = np.array([f"PROF {i:05d}" for i in range(n_instructors)])
+    # every course is taught by 1 to 4 instructors
+    instructors_per_course = rng.randint(1, 5, size=n_courses)
+    course_instructor_start = np.concatenate([[0], np.cumsum(instructors_per_course)[:-1]])
+    course_instructors = rng.randint(n_instructors, size=instructors_per_course.sum())
+
+    course = rng.choice(n_courses, size=rows, p=popularity / popularity.sum())
+    instructor = instructors[course_instructors[course_instructor_start[course] + rng.randint(0, 4, size=rows) % instructors_per_course[course]]]
+    window = rng.choice(len(WINDOWS), size=rows, p=WINDOW_WEIGHTS / WINDOW_WEIGHTS.sum())
+
+    vacancy = rng.choice([10, 20, 30, 40, 45], size=rows)
+    before = rng.binomial(vacancy, 0.5)
+    after = rng.binomial(before, 0.3)
+    median_bid = np.round(base_bid[course] * rng.uniform(0.6, 1.4, size=rows) * np.where(window == WINDOWS.index("Round 1 Window 1"), 1.3, 1.0), 2)
+    min_bid = np.round(median_bid * rng.uniform(0.5, 1.0, size=rows), 2)
+    # windows where nobody bid, exported as "-" (stored as missing)
+    no_bids = rng.uniform(size=rows) < 0.08
+    median_bid[no_bids] = np.nan
+    min_bid[no_bids] = np.nan
+    median_bid[rng.uniform(size=rows) < 0.02] = 0
+
+    df = pd.DataFrame({
+        "Term": terms[rng.randint(len(terms), size=rows)],
+        "Session": np.where(rng.uniform(size=rows) < 0.93, "Regular Academic Session", "Summer"),
+        "Bidding Window": np.array(WINDOWS)[window],
+        "Course Code": course_codes[course],
+        "Description": course_names[course],
+        "Section": np.char.add("G", (rng.geometric(0.4, size=rows).clip(max=15)).astype(str)),
+        "Vacancy": vacancy,
+        "Opening Vacancy": vacancy,
+        "Before Process Vacancy": before,
+        "D.I.C.E": 0,
+        "After Process Vacancy": after,
+        "Enrolled Students": vacancy - after,
+        "Median Bid": median_bid,
+        "Min Bid": min_bid,
+        # raw exports pad instructor names with spaces, Analytics strips them
+        "Instructor": np.char.add(instructor, " "),
+        "School/Department": course_schools[course],
+    })
+    # a few rows without an instructor, which Analytics drops
+    df.loc[rng.uniform(size=rows) < 0.01, "Instructor"] = None
+    return to_snapshot_frame(df[reference_columns])
+
+
+def write_snapshot_file(df, snapshot_path):
+    """Writes df as a parquet snapshot without an xlsx next to it, which load_dataset reads as is"""
+    df.to_parquet(snapshot_path, index=False)
+
+
+if __name__ == "__main__":
+    scale = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    snapshot_path = sys.argv[2] if len(sys.argv) > 2 else "data/synthetic_merged_file.parquet"
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    df = generate_boss_data(scale, seed)
+    write_snapshot_file(df, snapshot_path)
+    print(f"Wrote {len(df)} rows to {snapshot_path}")
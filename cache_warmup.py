@@ -0,0 +1,203 @@
+### Records the urls of the data routes in an access log, and replays the most requested ones at startup ###
+# so the responses of the hot set are cached (in memory, and on disk with DISK_CACHE_DIR) before traffic arrives
+import asyncio
+import fcntl
+import os
+import queue
+import re
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from urllib.parse import unquote, urlsplit
+
+# request line of the common/combined log format of nginx and uvicorn, eg. "GET /coursedata/overview/IS111 HTTP/1.1"
+REQUEST_LINE = re.compile(r'"GET (\S+) HTTP/[\d.]+"')
+# most urls AccessLog writes at once
+LOG_BATCH_LINES = 1000
+
+
+class AccessLog:
+    """Appends the url of each request to a file, one per line. record only queues the url, a background thread writes them,
+    so the event loop never waits on the disk (urls are dropped while queue_size of them are waiting).
+    Once the file reaches max_bytes it is moved to <path>.1, replacing the previous one. Each write is whole lines in one call,
+    so workers can append to the same file"""
+
+    def __init__(self, path, max_bytes, queue_size=10000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.file = open(path, "ab", buffering=0)
+        self.written = 0
+        self.dropped = 0
+        self.rotations = 0
+        self.thread = threading.Thread(target=self.write_loop, name="access-log", daemon=True)
+        self.thread.start()
+
+    def record(self, url):
+        try:
+            self.queue.put_nowait(url)
+        except queue.Full:
+            self.dropped += 1
+
+    def write_loop(self):
+        closed = False
+        while not closed:
+            urls = [self.queue.get()]
+            # whatever else is waiting goes out in the same write
+            while len(urls) < LOG_BATCH_LINES:
+                try:
+                    urls.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            # None is queued by close, after the last url
+            closed = None in urls
+            urls = [url for url in urls if url is not None]
+            if not urls:
+                continue
+            try:
+                self.reopen_if_rotated()
+                self.file.write("".join(url + "\n" for url in urls).encode("utf-8", "replace"))
+                self.written += len(urls)
+            except OSError:
+                # a full disk only costs the warmup these urls
+                self.dropped += len(urls)
+        self.file.close()
+
+    def reopen_if_rotated(self):
+        """Moves the file to <path>.1 once it is full, and reopens the path if this or another worker moved it"""
+        stat = os.fstat(self.file.fileno())
+        if not self.is_current(stat) or stat.st_size >= self.max_bytes:
+            # workers sharing the file rotate it once: the lock is on the full file, the first to get it moves it
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+            try:
+                if self.is_current(stat):
+                    os.replace(self.path, self.path + ".1")
+                    self.rotations += 1
+            finally:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+            new_file = open(self.path, "ab", buffering=0)
+            self.file.close()
+            self.file = new_file
+
+    def is_current(self, stat):
+        """The open file is still the one at path"""
+        try:
+            return os.stat(self.path).st_ino == stat.st_ino
+        except FileNotFoundError:
+            return False
+
+    def close(self, timeout=5):
+        """Writes the queued urls and stops the thread"""
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self.thread.join(timeout)
+
+    def stats(self):
+        return {"path": self.path, "written": self.written, "dropped": self.dropped, "rotations": self.rotations, "queued": self.queue.qsize()}
+
+
+def read_log_urls(path, max_lines):
+    """Urls of the GET requests in the last max_lines lines of an access log, either one url per line (as written by AccessLog)
+    or common/combined log format lines. The rotated <path>.1 is read first when there is one. A missing log has no urls"""
+    lines = deque(maxlen=max_lines)
+    for log_path in (path + ".1", path):
+        try:
+            with open(log_path, errors="replace") as f:
+                lines.extend(f)
+        except FileNotFoundError:
+            pass
+    urls = []
+    for line in lines:
+        match = REQUEST_LINE.search(line)
+        if match:
+            urls.append(match.group(1))
+        elif line.startswith("/"):
+            urls.append(line.split()[0])
+    return urls
+
+
+def url_scope(app, url):
+    """ASGI scope of a GET request of url (path percent encoded, as in the log), marked so it is not recorded again"""
+    parts = urlsplit(url)
+    return {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": unquote(parts.path), "raw_path": parts.path.encode(), "root_path": "", "query_string": parts.query.encode(),
+        "headers": [(b"host", b"warmup")], "client": ("127.0.0.1", 0), "server": ("warmup", 80), "app": app, "warmup": True,
+    }
+
+
+async def request_status(app, url):
+    """Requests url from app in process, returns the status code (the body is dropped, the point is caching it)"""
+    status = None
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(url_scope(app, url), receive, send)
+    return status
+
+
+def hot_urls(urls, key_of, top):
+    """One url for each of the top most frequent cache keys of urls, key_of(url) is None for urls that are not cached"""
+    counts = Counter()
+    url_of_key = {}
+    for url in urls:
+        key = key_of(url)
+        if key is None:
+            continue
+        counts[key] += 1
+        url_of_key.setdefault(key, url)
+    return [url_of_key[key] for key, _ in counts.most_common(top)]
+
+
+class CacheWarmup:
+    """Replays the top most requested urls of the access log at log_path once the dataset is loaded,
+    concurrency at a time. Done right away without a log_path"""
+
+    def __init__(self, log_path, top, max_lines, concurrency):
+        self.log_path = log_path
+        self.top = top
+        self.max_lines = max_lines
+        self.concurrency = concurrency
+        self.done = not log_path or top <= 0
+        self.urls = 0
+        self.statuses = Counter()
+        self.seconds = None
+        self.last_error = None
+
+    async def run(self, app, key_of):
+        start = time.perf_counter()
+        try:
+            urls = hot_urls(read_log_urls(self.log_path, self.max_lines), key_of, self.top)
+            self.urls = len(urls)
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def replay(url):
+                async with semaphore:
+                    self.statuses[await request_status(app, url)] += 1
+
+            await asyncio.gather(*[replay(url) for url in urls])
+        except Exception:
+            # a failed warmup only leaves the cache cold
+            self.last_error = traceback.format_exc()
+            print(f"Cache warmup failed\n{self.last_error}")
+        finally:
+            self.seconds = time.perf_counter() - start
+            self.done = True
+
+    def status(self):
+        return {
+            "done": self.done,
+            "urls": self.urls,
+            "statuses": {str(status): count for status, count in self.statuses.items()},
+            "seconds": self.seconds,
+            "failed": self.last_error is not None,
+        }
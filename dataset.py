@@ -0,0 +1,127 @@
+### Loading of the merged BOSS dataset used by the API ###
+import hashlib
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+SNAPSHOT_EXTENSION = ".parquet"
+# key in the parquet schema metadata holding the fingerprint of the xlsx the snapshot was built from
+SOURCE_FINGERPRINT_KEY = b"bossanalytics.source_fingerprint"
+# rows per frame of read_snapshot_chunks
+SNAPSHOT_CHUNK_ROWS = 50000
+
+
+def snapshot_path_for(xlsx_path):
+    """Returns the path of the columnar snapshot stored next to the specified xlsx"""
+    return os.path.splitext(xlsx_path)[0] + SNAPSHOT_EXTENSION
+
+
+def file_fingerprint(path):
+    """Returns a sha256 hex digest of the file contents"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_snapshot(data_frame, snapshot_path, source_path):
+    """Writes data_frame as a parquet snapshot tagged with the fingerprint of source_path.
+    data_frame must already have parquet friendly (non mixed) column types"""
+    table = pa.Table.from_pandas(data_frame, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[SOURCE_FINGERPRINT_KEY] = file_fingerprint(source_path).encode()
+    table = table.replace_schema_metadata(metadata)
+
+    # write to a temp file first so readers never see a half written snapshot
+    tmp_path = snapshot_path + ".tmp"
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, snapshot_path)
+
+
+def write_snapshot_chunks(chunks, schema, snapshot_path, source_path):
+    """Streams an iterable of data frame chunks into a parquet snapshot with the given pyarrow schema,
+    so only one chunk is held in memory at a time"""
+    schema = schema.with_metadata({SOURCE_FINGERPRINT_KEY: file_fingerprint(source_path).encode()})
+    tmp_path = snapshot_path + ".tmp"
+    writer = pq.ParquetWriter(tmp_path, schema)
+    try:
+        for chunk in chunks:
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+    finally:
+        writer.close()
+    os.replace(tmp_path, snapshot_path)
+
+
+def snapshot_source_fingerprint(snapshot_path):
+    """Returns the source fingerprint recorded in the snapshot, None if there is none"""
+    metadata = pq.read_schema(snapshot_path).metadata or {}
+    fingerprint = metadata.get(SOURCE_FINGERPRINT_KEY)
+    return fingerprint.decode() if fingerprint else None
+
+
+def is_snapshot_fresh(xlsx_path, snapshot_path=None):
+    """A snapshot is fresh if it exists and was built from the current contents of the xlsx"""
+    snapshot_path = snapshot_path or snapshot_path_for(xlsx_path)
+    if not os.path.exists(snapshot_path):
+        return False
+    if not os.path.exists(xlsx_path):
+        # snapshot shipped on its own, nothing to be stale against
+        return True
+    return snapshot_source_fingerprint(snapshot_path) == file_fingerprint(xlsx_path)
+
+
+def read_snapshot(snapshot_path):
+    # integer columns with missing values stay integers (pandas would turn them into floats)
+    return pq.read_table(snapshot_path).to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+
+
+def read_snapshot_chunks(snapshot_path, chunk_rows=SNAPSHOT_CHUNK_ROWS):
+    """Frames of up to chunk_rows rows of the snapshot, typed like read_snapshot, only one of them read at a time"""
+    for batch in pq.ParquetFile(snapshot_path).iter_batches(batch_size=chunk_rows):
+        yield pa.Table.from_batches([batch]).to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+
+
+def dataset_chunks(xlsx_path):
+    """Function returning the dataset load_dataset would load as an iterable of frames, read from the snapshot a chunk
+    at a time. Without a fresh snapshot the xlsx is parsed on the first call and kept for the next ones"""
+    parsed = []
+
+    def chunks():
+        if not parsed and is_snapshot_fresh(xlsx_path):
+            return read_snapshot_chunks(snapshot_path_for(xlsx_path))
+        if not parsed:
+            print(f"Snapshot {snapshot_path_for(xlsx_path)} missing or stale, reading {xlsx_path} (run excel_merge.py to rebuild it)")
+            parsed.append(pd.read_excel(xlsx_path))
+        return iter(parsed)
+    return chunks
+
+
+def dataset_version(xlsx_path):
+    """Returns the version load_dataset would return, without reading the data"""
+    snapshot_path = snapshot_path_for(xlsx_path)
+    if os.path.exists(snapshot_path):
+        version = snapshot_source_fingerprint(snapshot_path)
+        if not os.path.exists(xlsx_path) or version == file_fingerprint(xlsx_path):
+            return version or file_fingerprint(snapshot_path)
+    return file_fingerprint(xlsx_path)
+
+
+def load_dataset(xlsx_path):
+    """Loads the merged dataset from its parquet snapshot,
+    falling back to parsing the xlsx when the snapshot is missing or stale.
+    Returns (data_frame, version) where version is the fingerprint of the xlsx the data came from"""
+    snapshot_path = snapshot_path_for(xlsx_path)
+    if os.path.exists(snapshot_path):
+        version = snapshot_source_fingerprint(snapshot_path)
+        if not os.path.exists(xlsx_path) or version == file_fingerprint(xlsx_path):
+            return read_snapshot(snapshot_path), version or file_fingerprint(snapshot_path)
+
+    print(f"Snapshot {snapshot_path} missing or stale, reading {xlsx_path} (run excel_merge.py to rebuild it)")
+    return pd.read_excel(xlsx_path), file_fingerprint(xlsx_path)
+
+
+def load_dataframe(xlsx_path):
+    return load_dataset(xlsx_path)[0]
@@ -0,0 +1,265 @@
+### Everything the API builds from one version of the dataset, and the hot reload that swaps it ###
+import os
+import threading
+import time
+import traceback
+
+from analytics import Analytics
+from analytics_pool import AnalyticsPool
+from dataset import dataset_chunks, dataset_version, load_dataframe, load_dataset, snapshot_path_for
+from disk_cache import DiskResponseCache
+from materialize import MaterializedCharts
+from metrics import DATASET_LOAD_SECONDS, instrument_methods
+from response_cache import ResponseCache, SingleFlight
+from search_index import SearchIndex
+from shared_dataset import open_shared_analytics, shared_dataset_path
+from sqlite_store import open_sqlite_analytics
+
+# where Analytics keeps the dataset: "pandas" holds it in memory, "sqlite" queries the store written next to the xlsx
+STORAGE_BACKENDS = ("pandas", "sqlite")
+
+
+class DatasetState:
+    """Analytics, indexes, caches and pool built from one dataset version.
+    It is replaced as a whole on reload so a request only ever sees one version.
+    With a shared_dir the Analytics tables are mapped from the copy shared with the other workers (see shared_dataset.py),
+    with the sqlite storage they are queried from the SQLite store (see sqlite_store.py). data_frame may then be None
+    when that copy already exists. With a disk_cache_dir responses are also cached on disk, in at most about disk_cache_max_bytes (see disk_cache.py)"""
+
+    def __init__(self, data_frame, version, xlsx_path, pool_options, cache_size, materialized_dir=None, shared_dir=None, storage="pandas", disk_cache_dir=None, disk_cache_max_bytes=None, cache_max_bytes=None):
+        if storage not in STORAGE_BACKENDS:
+            raise ValueError(f"Unknown storage backend: {storage}")
+        self.version = version
+        self.loaded_at = time.time()
+        start = time.perf_counter()
+        self.shared_path = None
+        self.store_path = None
+        if storage == "sqlite":
+            # the store is written a chunk of rows at a time if missing, without building an in memory Analytics
+            chunks = (lambda: [data_frame]) if data_frame is not None else dataset_chunks(xlsx_path)
+            self.analytics = open_sqlite_analytics(xlsx_path, version, chunks)
+            self.store_path = self.analytics.path
+        elif shared_dir:
+            self.shared_path = shared_dataset_path(shared_dir, version)
+            self.analytics = open_shared_analytics(shared_dir, version, lambda: Analytics(data_frame if data_frame is not None else load_dataframe(xlsx_path)))
+        else:
+            self.analytics = Analytics(data_frame)
+        DATASET_LOAD_SECONDS.set(time.perf_counter() - start, "analytics")
+        instrument_methods(self.analytics, "analytics.", ("filter_", "get_"))
+        self.valid_course_codes = set(self.analytics.get_unique_course_codes())
+        self.row_count = self.analytics.row_count()
+        self.search_index = SearchIndex.from_analytics(self.analytics)
+        self.response_cache = ResponseCache(max_entries=cache_size, max_bytes=cache_max_bytes)
+        # None without a disk_cache_dir
+        self.disk_cache = DiskResponseCache.open(disk_cache_dir, version, disk_cache_max_bytes)
+        # responses being computed, so identical concurrent requests compute them once
+        self.in_flight = SingleFlight()
+        # prebuilt responses of materialize.py, None unless built from this version
+        self.materialized = MaterializedCharts.open(materialized_dir, version)
+        self.pool = AnalyticsPool(self.analytics, xlsx_path=xlsx_path, shared_path=self.shared_path, store_path=self.store_path, **pool_options)
+        self.pool.warm_up()
+        DATASET_LOAD_SECONDS.set(time.perf_counter() - start, "build")
+        # requests pinned to this state, the pool is only shut down once the last one is done
+        self.active_requests = 0
+        self.retired = False
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Pins a request to this state, returns False if it has already been retired"""
+        with self.lock:
+            if self.retired:
+                return False
+            self.active_requests += 1
+            return True
+
+    def hold(self):
+        """Pins the state once more for a response streamed after its request returned, the caller having it pinned already
+        (so it cannot have been shut down). Returns the function releasing it, which only releases on its first call"""
+        with self.lock:
+            self.active_requests += 1
+        once = threading.Lock()
+
+        def release():
+            if once.acquire(blocking=False):
+                self.release()
+        return release
+
+    def release(self):
+        with self.lock:
+            self.active_requests -= 1
+            shutdown = self.retired and self.active_requests == 0
+        if shutdown:
+            self.close()
+
+    def retire(self):
+        """Called once swapped out, in-flight requests keep using this state until they finish"""
+        with self.lock:
+            self.retired = True
+            shutdown = self.active_requests == 0
+        if shutdown:
+            self.close()
+
+    def close(self):
+        self.pool.shutdown()
+        if self.disk_cache is not None:
+            self.disk_cache.close()
+        if self.store_path is not None:
+            # the SQLite store of this version is removed unless another process still serves it
+            self.analytics.close()
+
+
+def timed_load_dataset(xlsx_path):
+    start = time.perf_counter()
+    data_frame, version = load_dataset(xlsx_path)
+    DATASET_LOAD_SECONDS.set(time.perf_counter() - start, "read")
+    return data_frame, version
+
+
+def load_dataset_state(xlsx_path, pool_options, cache_size, materialized_dir=None, shared_dir=None, storage="pandas", disk_cache_dir=None, disk_cache_max_bytes=None, cache_max_bytes=None):
+    if storage == "sqlite":
+        # the store is written from the snapshot a chunk at a time if missing (see DatasetState), the frame is never needed
+        return DatasetState(None, dataset_version(xlsx_path), xlsx_path, pool_options, cache_size, materialized_dir, shared_dir, storage, disk_cache_dir, disk_cache_max_bytes, cache_max_bytes)
+    if shared_dir:
+        version = dataset_version(xlsx_path)
+        if os.path.exists(shared_dataset_path(shared_dir, version)):
+            # another worker already published this version, there is nothing to read
+            return DatasetState(None, version, xlsx_path, pool_options, cache_size, materialized_dir, shared_dir, storage, disk_cache_dir, disk_cache_max_bytes, cache_max_bytes)
+    data_frame, version = timed_load_dataset(xlsx_path)
+    return DatasetState(data_frame, version, xlsx_path, pool_options, cache_size, materialized_dir, shared_dir, storage, disk_cache_dir, disk_cache_max_bytes, cache_max_bytes)
+
+
+class DatasetLoader:
+    """Builds the first DatasetState in a background thread, so the server accepts connections (and answers its health
+    checks) while the dataset is read and indexed. on_ready gets the state once fully built"""
+
+    def __init__(self, load_state, on_ready):
+        self.load_state = load_state
+        self.on_ready = on_ready
+        self.lock = threading.Lock()
+        self.thread = None
+        self.done = threading.Event()
+        self.ready = False
+        self.started_at = None
+        self.load_seconds = None
+        self.last_error = None
+
+    def start(self):
+        """Starts the load, returns False if it was already started"""
+        with self.lock:
+            if self.thread is not None:
+                return False
+            self.started_at = time.time()
+            self.thread = threading.Thread(target=self._load, name="dataset-load", daemon=True)
+        self.thread.start()
+        return True
+
+    def _load(self):
+        start = time.perf_counter()
+        try:
+            self.on_ready(self.load_state())
+            self.ready = True
+        except Exception:
+            self.last_error = traceback.format_exc()
+            print(f"Dataset load failed\n{self.last_error}")
+        finally:
+            self.load_seconds = time.perf_counter() - start
+            self.done.set()
+
+    def wait(self, timeout=None):
+        """Starts the load if needed and blocks until it is over, for scripts using the app in process"""
+        self.start()
+        if not self.done.wait(timeout):
+            raise TimeoutError("Dataset still loading")
+        if not self.ready:
+            raise RuntimeError(f"Dataset load failed\n{self.last_error}")
+
+    def status(self):
+        return {
+            "ready": self.ready,
+            "loading": self.thread is not None and not self.done.is_set(),
+            "started_at": self.started_at,
+            "load_seconds": self.load_seconds,
+            "failed": self.last_error is not None,
+        }
+
+
+class DatasetReloader:
+    """Rebuilds the DatasetState in a background thread and hands it to on_swap once fully built.
+    Reloads are triggered explicitly (trigger) or by polling the data files (watch). current_version returns None while
+    no dataset is loaded yet"""
+
+    def __init__(self, xlsx_path, load_state, current_version, on_swap):
+        self.xlsx_path = xlsx_path
+        self.load_state = load_state
+        self.current_version = current_version
+        self.on_swap = on_swap
+        self.lock = threading.Lock()
+        self.reloading = False
+        self.last_reload = None
+        self.last_error = None
+
+    def trigger(self):
+        """Starts a background reload, returns False if one is already running"""
+        with self.lock:
+            if self.reloading:
+                return False
+            self.reloading = True
+        threading.Thread(target=self._reload, name="dataset-reload", daemon=True).start()
+        return True
+
+    def _reload(self):
+        try:
+            current_version = self.current_version()
+            if current_version is None:
+                # the first load is still running, it reads the data files as they are now
+                return
+            # fingerprints the data files without reading them, a reload of the same version stops here
+            if dataset_version(self.xlsx_path) == current_version:
+                return
+            # build everything before swapping so requests never wait on the new version
+            state = self.load_state()
+            self.on_swap(state)
+            self.last_reload = {"version": state.version, "at": time.time()}
+            self.last_error = None
+        except Exception:
+            self.last_error = traceback.format_exc()
+            print(f"Dataset reload failed, still serving version {self.current_version()}\n{self.last_error}")
+        finally:
+            with self.lock:
+                self.reloading = False
+
+    def data_files_signature(self):
+        signature = []
+        for path in (self.xlsx_path, snapshot_path_for(self.xlsx_path)):
+            try:
+                stat = os.stat(path)
+                signature.append((path, stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append((path, None, None))
+        return signature
+
+    def watch(self, interval):
+        """Polls the data files every interval seconds and reloads once a change has settled"""
+        def poll():
+            seen = self.data_files_signature()
+            changed = False
+            while True:
+                time.sleep(interval)
+                signature = self.data_files_signature()
+                if signature != seen:
+                    # still being written, wait for the files to stop changing
+                    seen = signature
+                    changed = True
+                elif changed:
+                    changed = False
+                    self.trigger()
+
+        threading.Thread(target=poll, name="dataset-watcher", daemon=True).start()
+
+    def status(self):
+        return {
+            "version": self.current_version(),
+            "reloading": self.reloading,
+            "last_reload": self.last_reload,
+            "last_error": self.last_error,
+        }
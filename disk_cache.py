@@ -0,0 +1,175 @@
+### Responses of the data routes cached on disk per dataset version, so they survive restarts and are shared by the workers ###
+import hashlib
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import orjson
+
+from response_cache import RESPONSE_FORMAT_VERSION, CachedResponse, sources_fingerprint
+
+# an eviction removes files until they take this fraction of max_bytes, so it does not run again on the next write
+EVICT_TO_FRACTION = 0.8
+# budget of a cache opened without one
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+
+def encode_entry(entry):
+    """One header line (media type and size of each compressed variant) followed by the body and the variants"""
+    header = {"media_type": entry.media_type, "variants": {encoding: len(variant) for encoding, variant in entry.variants.items()}}
+    return b"".join([orjson.dumps(header), b"\n", entry.body, *entry.variants.values()])
+
+
+def decode_entry(data):
+    header_bytes, _, payload = data.partition(b"\n")
+    header = orjson.loads(header_bytes)
+    variants = {}
+    end = len(payload)
+    for encoding, size in reversed(list(header["variants"].items())):
+        variants[encoding] = payload[end - size:end]
+        end -= size
+    return CachedResponse(payload[:end], header["media_type"], variants)
+
+
+class DiskResponseCache:
+    """CachedResponses of one dataset version, one file per cache key (route and normalized params) under
+    <cache_dir>/<version>-<sources fingerprint>/. Directories of other versions are removed when a new one is opened.
+    The files take at most about max_bytes: past it the least recently used ones (by mtime, touched on every hit) are removed
+    down to EVICT_TO_FRACTION of it. get blocks on the disk, the middleware calls it from the threadpool, and put_later
+    queues the write on a thread of its own"""
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        # writes and evictions run one at a time, off the event loop
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="disk-cache")
+        self.closed = False
+        self.bytes = sum(size for _, _, size in self.cache_files())
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.errors = 0
+
+    @classmethod
+    def open(cls, root_dir, version, max_bytes=None):
+        """Returns the cache of version in root_dir, None without a root_dir"""
+        if not root_dir:
+            return None
+        if max_bytes is None:
+            max_bytes = DEFAULT_MAX_BYTES
+        name = f"{version}-{sources_fingerprint()[:16]}"
+        if os.path.isdir(root_dir):
+            for other in os.listdir(root_dir):
+                if other != name:
+                    shutil.rmtree(os.path.join(root_dir, other), ignore_errors=True)
+        return cls(os.path.join(root_dir, name), max_bytes)
+
+    def file_for(self, key):
+        digest = hashlib.sha256(f"{RESPONSE_FORMAT_VERSION}:{key!r}".encode()).hexdigest()
+        # sharded by the first byte so no directory gets too many files
+        return os.path.join(self.cache_dir, digest[:2], digest + ".bin")
+
+    def cache_files(self):
+        """(mtime, path, size) of every entry file, also the ones written by other workers"""
+        files = []
+        try:
+            shards = list(os.scandir(self.cache_dir))
+        except OSError:
+            return files
+        for shard in shards:
+            try:
+                with os.scandir(shard.path) as entries:
+                    for entry in entries:
+                        if entry.name.endswith(".bin"):
+                            stat = entry.stat()
+                            files.append((stat.st_mtime, entry.path, stat.st_size))
+            except OSError:
+                # removed meanwhile, or not a shard
+                continue
+        return files
+
+    def get(self, key):
+        path = self.file_for(key)
+        try:
+            with open(path, "rb") as f:
+                entry = decode_entry(f.read())
+            # marks it recently used for the eviction
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (OSError, ValueError):
+            # unreadable or corrupt, it is rewritten once computed again
+            self.errors += 1
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put_later(self, key, entry):
+        """Writes entry in the background, the response does not wait for the disk"""
+        if not self.closed:
+            self.writer.submit(self.put, key, entry)
+
+    def put(self, key, entry):
+        if self.closed:
+            return
+        path = self.file_for(key)
+        # written under a temporary name first, so other workers never read a partial file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        data = encode_entry(entry)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self.writes += 1
+            self.bytes += len(data)
+        except OSError:
+            # a full disk only costs the cache entry
+            self.errors += 1
+            return
+        if self.bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Removes the least recently used files until they take EVICT_TO_FRACTION of max_bytes. The sizes are counted
+        again from the directory, so the files of other workers are part of the budget"""
+        files = sorted(self.cache_files())
+        total = sum(size for _, _, size in files)
+        target = self.max_bytes * EVICT_TO_FRACTION
+        for _, path, size in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except FileNotFoundError:
+                # evicted by another worker
+                pass
+            except OSError:
+                self.errors += 1
+                continue
+            total -= size
+        self.bytes = total
+
+    def close(self):
+        """Drops the queued writes, the directory is about to be removed by the cache of the next version"""
+        self.closed = True
+        self.writer.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "dir": self.cache_dir,
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "errors": self.errors,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
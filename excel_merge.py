@@ -1,87 +1,320 @@
 ### This script merges the excel files in "./data" ###
+# usage: python excel_merge.py [folder_path] [--full-rebuild] [--workers N]
+import argparse
+import json
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pandas as pd
 import openpyxl
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pandas.api.types import is_numeric_dtype
 
+from dataset import dataset_version, file_fingerprint, read_snapshot, read_snapshot_chunks, snapshot_path_for, write_snapshot, write_snapshot_chunks
+from sqlite_store import ensure_store, is_store_file, remove_unused_stores
 
-def merge_excel_files(folder_path):
-    excel_files = [filename for filename in os.listdir(folder_path)]
-    entries = os.listdir(folder_path)
-
-    for entry in entries:
-        print(entry)
-
-    column_mapping = {
-        'Term': 'Term',
-        'Session': 'Session',
-        'Bidding Window': 'Bidding Window',
-        'Course': 'Course Code',
-        'Description': 'Description',  # Add this to retain description if needed
-        'Sect': 'Section',
-        'Median': 'Median Bid',
-        'Min': 'Min Bid',
-        'Vacancy': 'Vacancy',
-        'Open': 'Opening Vacancy',
-        'Bef Proc': 'Before Process Vacancy',
-        'Aft Proc': 'After Process Vacancy',
-        'DICE': 'D.I.C.E',
-        'Enrolled': 'Enrolled Students',
-        'Instructor': 'Instructor',
-        'School': 'School/Department'
-    }
-
-    reference_columns = [
-        'Term', 'Session', 'Bidding Window', 'Course Code', 'Description', 
-        'Section', 'Vacancy', 'Opening Vacancy', 'Before Process Vacancy', 
-        'D.I.C.E', 'After Process Vacancy', 'Enrolled Students', 
-        'Median Bid', 'Min Bid', 'Instructor', 'School/Department'
-    ]
-
-    dfs = []
-
-    for i, filename in enumerate(excel_files):
-        # skip hidden files like .DS_Store
-        if filename.startswith('.'):
+MERGED_FILE_NAME = "merged_file.xlsx"
+# records the content hash of every source file merged so far, see merge_excel_files
+MANIFEST_NAME = "merge_manifest.json"
+# rows dropped at ingest because a numeric column held something that is not a number, see coerce_to_schema
+REJECTED_ROWS_NAME = "merge_rejected_rows.csv"
+# normalized rows of each source file, named by the file's content hash
+PARTS_DIR_NAME = ".merge_parts"
+SUPPORTED_EXTENSIONS = ['.csv', '.xls', '.xlsx']
+
+column_mapping = {
+    'Term': 'Term',
+    'Session': 'Session',
+    'Bidding Window': 'Bidding Window',
+    'Course': 'Course Code',
+    'Description': 'Description',  # Add this to retain description if needed
+    'Sect': 'Section',
+    'Median': 'Median Bid',
+    'Min': 'Min Bid',
+    'Vacancy': 'Vacancy',
+    'Open': 'Opening Vacancy',
+    'Bef Proc': 'Before Process Vacancy',
+    'Aft Proc': 'After Process Vacancy',
+    'DICE': 'D.I.C.E',
+    'Enrolled': 'Enrolled Students',
+    'Instructor': 'Instructor',
+    'School': 'School/Department'
+}
+
+reference_columns = [
+    'Term', 'Session', 'Bidding Window', 'Course Code', 'Description',
+    'Section', 'Vacancy', 'Opening Vacancy', 'Before Process Vacancy',
+    'D.I.C.E', 'After Process Vacancy', 'Enrolled Students',
+    'Median Bid', 'Min Bid', 'Instructor', 'School/Department'
+]
+
+# declared type of every reference column: counts are nullable integers, bids are floats, everything else is text
+column_types = {
+    'Term': 'string',
+    'Session': 'string',
+    'Bidding Window': 'string',
+    'Course Code': 'string',
+    'Description': 'string',
+    'Section': 'string',
+    'Vacancy': 'integer',
+    'Opening Vacancy': 'integer',
+    'Before Process Vacancy': 'integer',
+    'D.I.C.E': 'string',
+    'After Process Vacancy': 'integer',
+    'Enrolled Students': 'integer',
+    'Median Bid': 'float',
+    'Min Bid': 'float',
+    'Instructor': 'string',
+    'School/Department': 'string'
+}
+numeric_columns = [col for col, kind in column_types.items() if kind != 'string']
+
+# values BOSS exports use for "no value", stored as missing
+MISSING_PLACEHOLDERS = ['-', '']
+
+
+def coerce_to_schema(df):
+    """Casts df to column_types. Placeholders become missing values, rows with any other value that is not a valid
+    number for its column are rejected. Returns (typed df, rejected) where rejected maps the position of each
+    rejected row in df to the reason"""
+    df = df.copy()
+    invalid = {}
+    for col, kind in column_types.items():
+        raw = df[col]
+        if kind == 'string':
+            # text columns can contain the odd number (eg. Section 1), store everything as strings
+            df[col] = raw.map(lambda value: None if pd.isna(value) else str(value))
             continue
 
-        file_path = os.path.join(folder_path, filename)
-        ext = os.path.splitext(filename)[1].lower()
-
-        try:
-            if ext == '.csv':
-                df = pd.read_csv(file_path)
-            elif ext in ['.xls', '.xlsx']:
-                # specify engine for xlsx; let pandas choose for xls
-                if ext == '.xlsx':
-                    df = pd.read_excel(file_path, engine='openpyxl')
-                else:
-                    df = pd.read_excel(file_path)
-            else:
-                print(f"Skipping unsupported file type: {filename}")
-                continue
-        except Exception as e:
-            print(f"Failed to read {filename}: {e}")
+        if not is_numeric_dtype(raw):
+            missing = raw.isna() | raw.astype(str).str.strip().isin(MISSING_PLACEHOLDERS)
+        else:
+            missing = raw.isna()
+        values = pd.to_numeric(raw.where(~missing), errors="coerce")
+        bad = values.isna() & ~missing
+        if kind == 'integer':
+            bad |= values.notna() & (values % 1 != 0)
+            values = values.where(~bad).astype("Int64")
+        else:
+            values = values.astype("float64")
+        for position in bad.to_numpy().nonzero()[0]:
+            invalid.setdefault(int(position), []).append(f"{col}={raw.iloc[position]}")
+        df[col] = values
+
+    rejected = {position: ", ".join(reasons) for position, reasons in sorted(invalid.items())}
+    if rejected:
+        df = df.drop(index=df.index[list(rejected)])
+    return df.reset_index(drop=True), rejected
+
+
+def to_snapshot_frame(df):
+    """Returns a copy of df typed by column_types so that it can be stored as parquet, dropping rejected rows"""
+    return coerce_to_schema(df)[0]
+
+
+def snapshot_schema():
+    """Column types of the snapshot and of the per file parts, matching column_types"""
+    arrow_types = {'string': pa.string(), 'integer': pa.int64(), 'float': pa.float64()}
+    return pa.schema([(col, arrow_types[column_types[col]]) for col in reference_columns])
+
+
+def build_snapshot(xlsx_path):
+    """Builds the parquet snapshot for an already merged xlsx"""
+    df = pd.read_excel(xlsx_path, engine="openpyxl")
+    write_snapshot(to_snapshot_frame(df), snapshot_path_for(xlsx_path), xlsx_path)
+
+
+def read_xlsx_streaming(file_path):
+    """Reads the first sheet of an xlsx with openpyxl in read-only mode, keeping only the columns in column_mapping"""
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.active
+        # some exports carry wrong sheet dimensions, let openpyxl find the extent of the data itself
+        sheet.reset_dimensions()
+        rows = sheet.iter_rows(values_only=True)
+        header = next(rows, ())
+        wanted = [i for i, name in enumerate(header) if name in column_mapping]
+        data = [[row[i] if i < len(row) else None for i in wanted] for row in rows]
+    finally:
+        workbook.close()
+
+    # trailing blank rows are dropped like pd.read_excel does
+    while data and all(value is None for value in data[-1]):
+        data.pop()
+    return pd.DataFrame(data, columns=[header[i] for i in wanted])
+
+
+def read_source_file(file_path):
+    """Reads one raw BOSS export and returns (rows renamed, reindexed to reference_columns and typed, rejected rows),
+    see coerce_to_schema"""
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext == '.csv':
+        df = pd.read_csv(file_path)
+    elif ext == '.xlsx':
+        df = read_xlsx_streaming(file_path)
+    else:
+        df = pd.read_excel(file_path)
+
+    df.rename(columns=column_mapping, inplace=True)
+
+    # ensure all reference columns exist
+    for col in reference_columns:
+        if col not in df.columns:
+            df[col] = pd.NA
+
+    return coerce_to_schema(df[reference_columns])
+
+
+def ingest_source_file(file_path, part_path):
+    """Parses one source file into its parquet part, run in a worker process.
+    Returns the number of rows kept and the rejected rows as [spreadsheet row number, reason] pairs"""
+    df, rejected = read_source_file(file_path)
+    pq.write_table(pa.Table.from_pandas(df, schema=snapshot_schema(), preserve_index=False), part_path)
+    # data rows start on the second row of the sheet, below the header
+    return len(df), [[position + 2, reason] for position, reason in rejected.items()]
+
+
+def write_merged_outputs(part_paths, output_path):
+    """Streams the parts into the merged xlsx and its snapshot, one part in memory at a time, then writes the SQLite store"""
+    def chunks():
+        for i, part_path in enumerate(part_paths):
+            df = read_snapshot(part_path)
+            # preserve previous behavior: skip the header row for subsequent files
+            yield df if i == 0 else df[1:]
+
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("Sheet1")
+    sheet.append(reference_columns)
+    for df in chunks():
+        for row in df.astype(object).where(df.notna(), None).itertuples(index=False, name=None):
+            sheet.append(row)
+    workbook.save(output_path)
+
+    # typed snapshot next to the xlsx, loaded by the API instead of parsing the xlsx on startup
+    write_snapshot_chunks(chunks(), snapshot_schema(), snapshot_path_for(output_path), output_path)
+
+    # SQLite store of the preprocessed dataset, queried by the API with STORAGE_BACKEND=sqlite, written from the snapshot
+    # a chunk at a time. Stores of previous versions are removed once no API process serves them
+    store_path = ensure_store(output_path, dataset_version(output_path), lambda: read_snapshot_chunks(snapshot_path_for(output_path)))
+    remove_unused_stores(output_path, keep_path=store_path)
+
+
+def list_source_files(folder_path, output_path):
+    """Returns the sorted names of the raw exports in folder_path, leaving out the merge outputs"""
+    outputs = {os.path.basename(output_path), os.path.basename(snapshot_path_for(output_path)), MANIFEST_NAME, REJECTED_ROWS_NAME}
+    source_files = []
+    for filename in sorted(os.listdir(folder_path)):
+        # skip hidden files like .DS_Store
+        if filename.startswith('.') or filename in outputs or is_store_file(output_path, filename):
+            continue
+        if os.path.splitext(filename)[1].lower() not in SUPPORTED_EXTENSIONS:
+            print(f"Skipping unsupported file type: {filename}")
             continue
+        source_files.append(filename)
+    return source_files
 
-        df.rename(columns=column_mapping, inplace=True)
 
-        # ensure all reference columns exist
-        for col in reference_columns:
-            if col not in df.columns:
-                df[col] = pd.NA
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {"files": {}, "output_fingerprint": None}
+    with open(manifest_path) as f:
+        return json.load(f)
 
-        df = df[reference_columns]
 
-        # preserve previous behavior: skip the header row for subsequent files
-        if len(dfs) == 0:
-            dfs.append(df)
+def save_manifest(manifest, manifest_path):
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def write_rejected_rows_report(manifest, report_path):
+    """Lists the rows left out of the merge by coerce_to_schema, one line per row"""
+    report = pd.DataFrame(
+        [[filename, row, reason] for filename, entry in sorted(manifest["files"].items()) for row, reason in entry.get("rejected", [])],
+        columns=["File", "Row", "Reason"],
+    )
+    if report.empty:
+        if os.path.exists(report_path):
+            os.remove(report_path)
+        return
+    report.to_csv(report_path, index=False)
+    print(f"Rejected {len(report)} rows with invalid numeric values, see {report_path}")
+
+
+def merge_excel_files(folder_path, output_path=None, full_rebuild=False, workers=None):
+    """Merges the raw BOSS exports in folder_path into output_path (and its parquet snapshot and SQLite store).
+    Only files that are new or whose contents changed since the last merge are parsed, rows of files
+    that were removed are dropped. Running it again on unchanged inputs does nothing.
+    full_rebuild ignores the manifest and re-parses every file.
+    Files are parsed in parallel on `workers` processes (default: one per core)"""
+    output_path = output_path or os.path.join(folder_path, MERGED_FILE_NAME)
+    manifest_path = os.path.join(folder_path, MANIFEST_NAME)
+    parts_dir = os.path.join(folder_path, PARTS_DIR_NAME)
+    os.makedirs(parts_dir, exist_ok=True)
+
+    previous = {"files": {}, "output_fingerprint": None} if full_rebuild else load_manifest(manifest_path)
+    manifest = {"files": {}, "output_fingerprint": None}
+    source_files = list_source_files(folder_path, output_path)
+    # additions and removals change the output even when no file needs parsing
+    changed = full_rebuild or set(previous["files"]) != set(source_files)
+
+    to_parse = {}
+    for filename in source_files:
+        fingerprint = file_fingerprint(os.path.join(folder_path, filename))
+        entry = previous["files"].get(filename)
+        if entry and entry["sha256"] == fingerprint and os.path.exists(os.path.join(parts_dir, fingerprint + ".parquet")):
+            manifest["files"][filename] = entry
         else:
-            dfs.append(df[1:])
+            to_parse[filename] = fingerprint
+
+    if to_parse:
+        changed = True
+        # one file per worker, workers write their part to disk so only row counts come back
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(ingest_source_file, os.path.join(folder_path, filename), os.path.join(parts_dir, fingerprint + ".parquet")): filename
+                for filename, fingerprint in to_parse.items()
+            }
+            for future in as_completed(futures):
+                filename = futures[future]
+                try:
+                    rows, rejected = future.result()
+                except Exception as e:
+                    print(f"Failed to read {filename}: {e}")
+                    continue
+                print(f"Parsed {filename} ({rows} rows, {len(rejected)} rejected)")
+                manifest["files"][filename] = {"sha256": to_parse[filename], "rows": rows, "rejected": rejected}
+
+    for filename in set(previous["files"]) - set(manifest["files"]):
+        print(f"Dropping rows of removed file {filename}")
+
+    outputs_intact = (
+        os.path.exists(output_path) and os.path.exists(snapshot_path_for(output_path))
+        and previous["output_fingerprint"] == file_fingerprint(output_path)
+    )
+    if not changed and outputs_intact:
+        print(f"{output_path} is up to date")
+        return
+
+    part_paths = [os.path.join(parts_dir, manifest["files"][filename]["sha256"] + ".parquet") for filename in sorted(manifest["files"])]
+    write_merged_outputs(part_paths, output_path)
+
+    manifest["output_fingerprint"] = file_fingerprint(output_path)
+    save_manifest(manifest, manifest_path)
+    write_rejected_rows_report(manifest, os.path.join(folder_path, REJECTED_ROWS_NAME))
 
-    merged_df = pd.concat(dfs, ignore_index=True)
-    output_path = "/Users/qingyuliu/PycharmProjects/bossanalytics/data/merged_file.xlsx"
-    merged_df.to_excel(output_path, index=False, engine="openpyxl")
+    # parts no longer referenced by the manifest belong to removed or changed files
+    referenced = {entry["sha256"] + ".parquet" for entry in manifest["files"].values()}
+    for part in os.listdir(parts_dir):
+        if part not in referenced:
+            os.remove(os.path.join(parts_dir, part))
 
 
-folder_path = "/Users/qingyuliu/PycharmProjects/bossanalytics/data"
-merge_excel_files(folder_path)
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merges the raw BOSS exports into data/merged_file.xlsx")
+    parser.add_argument("folder_path", nargs="?", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+    parser.add_argument("--full-rebuild", action="store_true", help="re-parse every file instead of only new or changed ones")
+    parser.add_argument("--workers", type=int, default=None, help="number of files parsed in parallel, defaults to the number of cores")
+    args = parser.parse_args()
+    merge_excel_files(args.folder_path, full_rebuild=args.full_rebuild, workers=args.workers)
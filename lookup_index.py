@@ -0,0 +1,198 @@
+### Lookup indexes of Analytics kept in flat numpy arrays, so processes can map one shared copy (see shared_dataset.py) ###
+# Keys are categorical codes: the values of a level column are coded by a LevelEncoder and the codes of all levels of a
+# key are combined into one integer, so that finding a key is a binary search instead of a dictionary of python objects
+from collections.abc import Mapping
+
+import numpy as np
+
+_NO_ROWS = np.array([], dtype=np.intp)
+
+
+class LevelEncoder:
+    """Codes of the values of a categorical column: 0 for missing values (looked up as "") and 1 + their categorical code
+    for the others"""
+
+    def __init__(self, categories):
+        self.values = [""] + list(categories)
+        self.codes = {value: code for code, value in enumerate(self.values)}
+        self.radix = len(self.values)
+
+    def encode(self, column):
+        """Codes of every value of a categorical series"""
+        return column.cat.codes.to_numpy().astype(np.int64) + 1
+
+    def code(self, value):
+        """Code of value, None if the column never has it"""
+        try:
+            return self.codes.get(value)
+        except TypeError:
+            # unhashable values are never keys
+            return None
+
+
+def composite_keys(codes, encoders):
+    """Combines the codes of several levels into one integer per row, the levels being the digits of a mixed radix number"""
+    keys = np.zeros(len(codes[0]), dtype=np.int64)
+    for level_codes, encoder in zip(codes, encoders):
+        keys = keys * encoder.radix + level_codes
+    return keys
+
+
+def composite_key(values, encoders):
+    """Composite key of one tuple of level values, None if one of them never occurs"""
+    key = 0
+    for value, encoder in zip(values, encoders):
+        code = encoder.code(value)
+        if code is None:
+            return None
+        key = key * encoder.radix + code
+    return key
+
+
+class GroupIndex:
+    """Sorted positions of the rows of each key of a frame grouped by levels (categorical columns). get works like
+    dict.get on what frame.groupby(levels).indices returns, keys being tuples of level values (or one value for one level).
+    keys holds the sorted composite key of every group, order the row positions grouped by key and starts[g]:starts[g + 1]
+    the slice of order holding the rows of group g"""
+    ARRAYS = ("keys", "starts", "order")
+
+    def __init__(self, arrays, encoders):
+        self.keys = arrays["keys"]
+        self.starts = arrays["starts"]
+        self.order = arrays["order"]
+        self.encoders = encoders
+
+    @classmethod
+    def build(cls, frame, levels, encoders):
+        encoders = [encoders[level] for level in levels]
+        row_keys = composite_keys([encoder.encode(frame[level]) for level, encoder in zip(levels, encoders)], encoders)
+        # stable so the positions of each group stay ascending
+        order = np.argsort(row_keys, kind="stable")
+        sorted_keys = row_keys[order]
+        bounds = np.flatnonzero(np.diff(sorted_keys)) + 1
+        starts = np.concatenate([[0] if len(order) else [], bounds, [len(order)]]).astype(np.int64)
+        return cls({"keys": sorted_keys[starts[:-1]], "starts": starts, "order": order.astype(np.intp)}, encoders)
+
+    def arrays(self):
+        return {name: getattr(self, name) for name in self.ARRAYS}
+
+    def get(self, key, default=None):
+        values = key if len(self.encoders) > 1 else (key,)
+        if len(values) != len(self.encoders):
+            return default
+        key = composite_key(values, self.encoders)
+        if key is None:
+            return default
+        group = np.searchsorted(self.keys, key)
+        if group == len(self.keys) or self.keys[group] != key:
+            return default
+        return self.order[self.starts[group]:self.starts[group + 1]]
+
+
+class LookupIndex:
+    """Tree of the keys of a frame by levels (eg. course -> instructor -> term -> window -> section), the children of
+    a node in order of first appearance in the frame. Depth d holds the nodes of the first d levels:
+    key_codes{d} is the code of each node's own level value, children of node i of depth d - 1 are the nodes
+    child_starts{d}[i]:child_starts{d}[i + 1] of depth d, and positions{d}[row_starts{d}[i]:row_starts{d}[i + 1]] are the
+    sorted positions of the rows under node i. Depth 0 is the root"""
+
+    def __init__(self, arrays, encoders):
+        self.arrays_by_name = arrays
+        self.encoders = encoders
+        self.depth = len(encoders)
+        self.key_codes = [arrays.get(f"key_codes{depth}") for depth in range(self.depth + 1)]
+        self.child_starts = [arrays.get(f"child_starts{depth}") for depth in range(self.depth + 1)]
+        self.row_starts = [arrays[f"row_starts{depth}"] for depth in range(self.depth + 1)]
+        self.positions = [arrays[f"positions{depth}"] for depth in range(self.depth + 1)]
+
+    @classmethod
+    def build(cls, frame, levels, encoders):
+        encoders = [encoders[level] for level in levels]
+        codes = [encoder.encode(frame[level]) for level, encoder in zip(levels, encoders)]
+        rows = len(frame)
+        arrays = {"row_starts0": np.array([0, rows], dtype=np.int64), "positions0": np.arange(rows, dtype=np.intp)}
+        # node of every row at the previous depth
+        parent_of_row = np.zeros(rows, dtype=np.int64)
+        parent_count = 1
+        for depth in range(1, len(levels) + 1):
+            row_keys = composite_keys(codes[:depth], encoders[:depth])
+            _, first_rows, group_of_row = np.unique(row_keys, return_index=True, return_inverse=True)
+            group_of_row = group_of_row.reshape(-1)
+            # nodes ordered by parent, then by first appearance
+            parents = parent_of_row[first_rows]
+            node_order = np.lexsort((first_rows, parents))
+            node_of_group = np.empty(len(node_order), dtype=np.int64)
+            node_of_group[node_order] = np.arange(len(node_order))
+            node_of_row = node_of_group[group_of_row]
+
+            arrays[f"key_codes{depth}"] = codes[depth - 1][first_rows[node_order]]
+            arrays[f"child_starts{depth}"] = np.searchsorted(parents[node_order], np.arange(parent_count + 1)).astype(np.int64)
+            arrays[f"row_starts{depth}"] = np.concatenate([[0], np.cumsum(np.bincount(node_of_row, minlength=len(node_order)))]).astype(np.int64)
+            arrays[f"positions{depth}"] = np.argsort(node_of_row, kind="stable").astype(np.intp)
+            parent_of_row = node_of_row
+            parent_count = len(node_order)
+        return cls(arrays, encoders)
+
+    def arrays(self):
+        return self.arrays_by_name
+
+    def root(self):
+        return IndexNode(self, 0, 0)
+
+
+class IndexNode:
+    """Node of a LookupIndex. positions are the sorted row positions of every row under this node,
+    children maps the values of the next level to their nodes"""
+    __slots__ = ("index", "depth", "node_id")
+
+    def __init__(self, index, depth, node_id):
+        self.index = index
+        self.depth = depth
+        self.node_id = node_id
+
+    @property
+    def positions(self):
+        row_starts = self.index.row_starts[self.depth]
+        return self.index.positions[self.depth][row_starts[self.node_id]:row_starts[self.node_id + 1]]
+
+    @property
+    def children(self):
+        return IndexChildren(self.index, self.depth + 1, self.node_id)
+
+
+class IndexChildren(Mapping):
+    """Read only mapping of the level values of the children of a node (at depth - 1) to their nodes"""
+    __slots__ = ("index", "depth", "start", "end")
+
+    def __init__(self, index, depth, parent_id):
+        self.index = index
+        self.depth = depth
+        if depth > index.depth:
+            self.start = self.end = 0
+        else:
+            child_starts = index.child_starts[depth]
+            self.start, self.end = int(child_starts[parent_id]), int(child_starts[parent_id + 1])
+
+    def __getitem__(self, value):
+        if self.start == self.end:
+            raise KeyError(value)
+        code = self.index.encoders[self.depth - 1].code(value)
+        matches = np.flatnonzero(self.index.key_codes[self.depth][self.start:self.end] == code) if code is not None else _NO_ROWS
+        if not len(matches):
+            raise KeyError(value)
+        return IndexNode(self.index, self.depth, self.start + int(matches[0]))
+
+    def __iter__(self):
+        if self.start == self.end:
+            return iter(())
+        values = self.index.encoders[self.depth - 1].values
+        return (values[code] for code in self.index.key_codes[self.depth][self.start:self.end].tolist())
+
+    def __len__(self):
+        return self.end - self.start
+
+    def items(self):
+        return [(value, IndexNode(self.index, self.depth, node_id)) for node_id, value in zip(range(self.start, self.end), self)]
+
+    def values(self):
+        return [IndexNode(self.index, self.depth, node_id) for node_id in range(self.start, self.end)]
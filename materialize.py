@@ -0,0 +1,215 @@
+### Renders the response of every /coursedata and /instructordata url into static files, served by a CDN or by the API ###
+# usage: python materialize.py [--data-path data/merged_file.xlsx] [--out data/materialized] [--workers N] [--full-rebuild]
+import argparse
+import hashlib
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from urllib.parse import quote
+
+import pandas as pd
+
+from analytics import Analytics
+from dataset import load_dataset
+from response_cache import sources_fingerprint
+
+MANIFEST_NAME = "manifest.json"
+# courses rendered per worker task
+COURSES_PER_TASK = 16
+
+
+def course_paths(analytics, course_code):
+    """Url paths of every /coursedata and /instructordata response of a course, for every instructor, term, window and section
+    it has rows for. /coursedata/coursepage is only materialized without query params, the other combinations are served live"""
+    course_node = analytics.lookup(course_code)
+    paths = [
+        f"/instructordata/instructor/{course_code}",
+        f"/coursedata/overview/{course_code}",
+        f"/coursedata/overview/instructor_median_bid_chart/{course_code}",
+        f"/coursedata/coursepage/{course_code}",
+    ]
+    for instructor, instructor_node in course_node.children.items():
+        paths.append(f"/instructordata/bidding_windows_available/{course_code}/{instructor}")
+        paths.append(f"/instructordata/terms_available/{course_code}/{instructor}")
+        for window in analytics.windows_of(instructor_node):
+            paths.append(f"/coursedata/bidpriceacrossterms/{course_code}/{window}/{instructor}")
+            paths.append(f"/coursedata/bidpriceacrossterms/vacancies/{course_code}/{window}/{instructor}")
+        for term in analytics.terms_of(instructor_node):
+            paths.append(f"/instructordata/sections_available/{course_code}/{instructor}/{term}")
+            paths.append(f"/coursedata/bidpriceacrosswindows/{course_code}/{term}/{instructor}")
+            paths.append(f"/coursedata/bidpriceacrosswindows/vacancies/{course_code}/{term}/{instructor}")
+            for section in analytics.sections_of(instructor_node.children[term]):
+                paths.append(f"/coursedata/sectionbidpriceacrosswindows/{course_code}/{term}/{instructor}/{section}")
+                paths.append(f"/coursedata/sectionbidpriceacrosswindows/vacancies/{course_code}/{term}/{instructor}/{section}")
+    return paths
+
+
+def materialized_file(out_dir, path):
+    """File holding the response of path, every path segment is percent encoded so names with spaces or slashes stay one file"""
+    segments = [quote(segment, safe="") for segment in path.strip("/").split("/")]
+    return os.path.join(out_dir, *segments) + ".json"
+
+
+def course_fingerprint(analytics, course_code):
+    """Hash of the rows of a course, the responses of a course only depend on its own rows"""
+    rows = analytics.rows_at(analytics.lookup(course_code).positions)
+    return hashlib.sha256(pd.util.hash_pandas_object(rows, index=False).to_numpy().tobytes()).hexdigest()
+
+
+### Worker process Start ###
+_client = None
+
+
+def _init_worker(data_path, version):
+    """Loads the API app on data_path in the worker, responses are rendered by the real routes so they match byte for byte"""
+    global _client
+    os.environ["DATA_PATH"] = data_path
+    # every url is requested once, caching them would only use memory
+    os.environ["RESPONSE_CACHE_SIZE"] = "0"
+    # renders are not client traffic: they stay out of the access log, replay no warmup and skip the disk cache
+    for name in ("ACCESS_LOG_PATH", "WARMUP_LOG_PATH", "DISK_CACHE_DIR"):
+        os.environ.pop(name, None)
+    from fastapi.testclient import TestClient
+    import api
+    api.dataset_loader.wait()
+    if api.dataset_state.version != version:
+        raise RuntimeError(f"{data_path} changed while materializing, run materialize.py again")
+    # entered once so every request reuses the same event loop instead of starting one per request
+    _client = TestClient(api.app).__enter__()
+
+
+def _render_paths(paths, out_dir):
+    """Writes the response of every path that answers 200, returns (rendered paths, {failed path: status})"""
+    rendered = []
+    failed = {}
+    for path in paths:
+        response = _client.get(quote(path))
+        if response.status_code != 200:
+            failed[path] = response.status_code
+            continue
+        file_path = materialized_file(out_dir, path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as f:
+            f.write(response.content)
+        rendered.append(path)
+    return rendered, failed
+### Worker process End ###
+
+
+def load_manifest(out_dir):
+    manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, out_dir):
+    manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def remove_course_files(out_dir, entry):
+    for path in entry["paths"]:
+        file_path = materialized_file(out_dir, path)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+def materialize(data_path, out_dir, workers=None, full_rebuild=False):
+    """Renders every course's responses into out_dir. Only courses whose rows changed since the previous build are rendered again,
+    unless the code rendering them (see response_cache.RESPONSE_SOURCES) changed or full_rebuild is set"""
+    data_frame, version = load_dataset(data_path)
+    analytics = Analytics(data_frame)
+    renderer = sources_fingerprint()
+
+    previous = None if full_rebuild else load_manifest(out_dir)
+    if previous is None or previous["renderer"] != renderer:
+        if os.path.exists(out_dir):
+            shutil.rmtree(out_dir)
+        previous = {"courses": {}}
+    os.makedirs(out_dir, exist_ok=True)
+
+    manifest = {"dataset_version": version, "renderer": renderer, "courses": {}}
+    to_render = {}
+    for course_code in analytics.get_unique_course_codes():
+        fingerprint = course_fingerprint(analytics, course_code)
+        entry = previous["courses"].get(course_code)
+        if entry and entry["fingerprint"] == fingerprint:
+            manifest["courses"][course_code] = entry
+            continue
+        if entry:
+            remove_course_files(out_dir, entry)
+        to_render[course_code] = fingerprint
+    for course_code in set(previous["courses"]) - set(manifest["courses"]) - set(to_render):
+        print(f"Removing {course_code}, it is no longer in the dataset")
+        remove_course_files(out_dir, previous["courses"][course_code])
+
+    print(f"{len(manifest['courses'])} courses unchanged, rendering {len(to_render)}")
+    if to_render:
+        course_codes = list(to_render)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(data_path, version)) as executor:
+            futures = {}
+            for start in range(0, len(course_codes), COURSES_PER_TASK):
+                batch = course_codes[start:start + COURSES_PER_TASK]
+                paths = {course_code: course_paths(analytics, course_code) for course_code in batch}
+                future = executor.submit(_render_paths, [path for course in paths.values() for path in course], out_dir)
+                futures[future] = paths
+            for future in as_completed(futures):
+                rendered, failed = future.result()
+                rendered = set(rendered)
+                for course_code, paths in futures[future].items():
+                    manifest["courses"][course_code] = {
+                        "fingerprint": to_render[course_code],
+                        "paths": [path for path in paths if path in rendered],
+                        # urls that did not answer 200 are left to the live API
+                        "failed": {path: failed[path] for path in paths if path in failed},
+                    }
+                print(f"Rendered {len(rendered)} responses ({len(failed)} failed)")
+
+    save_manifest(manifest, out_dir)
+    print(f"Materialized {sum(len(entry['paths']) for entry in manifest['courses'].values())} responses of dataset {version} into {out_dir}")
+
+
+class MaterializedCharts:
+    """Serves the files of a materialized build, only used when it was built from the dataset version being served"""
+
+    def __init__(self, out_dir, manifest):
+        self.out_dir = out_dir
+        self.paths = {path for entry in manifest["courses"].values() for path in entry["paths"]}
+
+    @classmethod
+    def open(cls, out_dir, version):
+        """Returns the build in out_dir, None if there is none or it was rendered from another dataset version or by other
+        code (RESPONSE_SOURCES, whose fingerprint is also in the ETags)"""
+        manifest = load_manifest(out_dir) if out_dir else None
+        if manifest is None:
+            return None
+        if manifest["dataset_version"] != version:
+            print(f"Materialized charts in {out_dir} were built from another dataset version, run materialize.py to rebuild them")
+            return None
+        if manifest.get("renderer") != sources_fingerprint():
+            print(f"Materialized charts in {out_dir} were rendered by another version of the API, run materialize.py to rebuild them")
+            return None
+        return cls(out_dir, manifest)
+
+    def get(self, path):
+        """Response body of path, None if it was not materialized"""
+        if path not in self.paths:
+            return None
+        with open(materialized_file(self.out_dir, path), "rb") as f:
+            return f.read()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Renders every chart response of the dataset into static files")
+    parser.add_argument("--data-path", default="data/merged_file.xlsx")
+    parser.add_argument("--out", default="data/materialized")
+    parser.add_argument("--workers", type=int, default=None, help="number of render processes, defaults to the number of cores")
+    parser.add_argument("--full-rebuild", action="store_true", help="render every course instead of only the changed ones")
+    args = parser.parse_args()
+    materialize(args.data_path, args.out, workers=args.workers, full_rebuild=args.full_rebuild)
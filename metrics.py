@@ -0,0 +1,220 @@
+### In-process metrics in the Prometheus text format (served on /metrics), timing spans and a sampling profiler ###
+import functools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# same buckets as the Prometheus clients, with a finer end for the sub millisecond lookups
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# METRICS_SPANS=1 times every Analytics method and response builder, off by default as it adds a little to every call
+SPANS_ENABLED = os.environ.get("METRICS_SPANS", "0") == "1"
+
+
+def format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self.lock:
+            for label_values, value in sorted(self.values.items()):
+                lines.extend(self.render_value(label_values, value))
+        return lines
+
+    def render_value(self, label_values, value):
+        return [f"{self.name}{format_labels(self.label_names, label_values)} {value}"]
+
+
+class CounterMetric(Metric):
+    type = "counter"
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+
+class GaugeMetric(Metric):
+    type = "gauge"
+
+    def set(self, value, *label_values):
+        with self.lock:
+            self.values[label_values] = value
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+
+class HistogramMetric(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            # [count per bucket..., sum, count]
+            counts = self.values.get(label_values)
+            if counts is None:
+                counts = self.values[label_values] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-2] += value
+            counts[-1] += 1
+
+    def render_value(self, label_values, counts):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{format_labels(self.label_names, label_values, [('le', bound)])} {cumulative}")
+        lines.append(f"{self.name}_bucket{format_labels(self.label_names, label_values, [('le', '+Inf')])} {counts[-1]}")
+        lines.append(f"{self.name}_sum{format_labels(self.label_names, label_values)} {counts[-2]}")
+        lines.append(f"{self.name}_count{format_labels(self.label_names, label_values)} {counts[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format"""
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+REQUEST_LATENCY = REGISTRY.register(HistogramMetric("http_request_duration_seconds", "Latency of HTTP requests by route", ["method", "route"]))
+RESPONSES = REGISTRY.register(CounterMetric("http_responses_total", "HTTP responses by route and status code", ["method", "route", "status"]))
+RESPONSE_BYTES = REGISTRY.register(CounterMetric("http_cached_response_bytes_total", "Body bytes of responses served from the response cache, by content coding", ["encoding"]))
+COALESCED_REQUESTS = REGISTRY.register(CounterMetric("http_coalesced_requests_total", "Requests answered with the response of an identical request in flight instead of computing their own", ["route"]))
+IN_FLIGHT = REGISTRY.register(GaugeMetric("http_requests_in_flight", "HTTP requests being handled by route", ["route"]))
+SPAN_LATENCY = REGISTRY.register(HistogramMetric("span_duration_seconds", "Time spent in instrumented code (enabled with METRICS_SPANS=1)", ["span"]))
+POOL_CALL_LATENCY = REGISTRY.register(HistogramMetric("analytics_pool_call_seconds", "Analytics calls on the pool by method, including the wait for a worker", ["method"]))
+DATASET_LOAD_SECONDS = REGISTRY.register(GaugeMetric("dataset_load_seconds", "Duration of each stage of the last dataset load", ["stage"]))
+
+
+@contextmanager
+def span(name):
+    """Records the time spent in the block under span_duration_seconds, if spans are enabled"""
+    if not SPANS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        SPAN_LATENCY.observe(time.perf_counter() - start, name)
+
+
+def timed(name):
+    """Decorator recording every call of the function as a span, returns the function untouched when spans are disabled"""
+    def decorate(function):
+        if not SPANS_ENABLED:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def instrument_methods(obj, prefix, method_prefixes):
+    """Replaces the methods of obj whose name starts with one of method_prefixes by timed wrappers (spans named prefix + method name)"""
+    if not SPANS_ENABLED:
+        return
+    for name in dir(type(obj)):
+        if name.startswith(method_prefixes) and callable(getattr(obj, name)):
+            setattr(obj, name, timed(prefix + name)(getattr(obj, name)))
+
+
+class SamplingProfiler:
+    """Samples the stacks of every thread every interval seconds while running.
+    Stacks are counted in the folded format (frames joined by ";" root first, then the count) read by flamegraph.pl and speedscope"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def start(self, interval=0.01):
+        """Starts sampling, returns False if already running"""
+        with self.lock:
+            if self.thread is not None:
+                return False
+            self.stacks = Counter()
+            self.samples = 0
+            self.started_at = time.time()
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self.sample_loop, args=(interval,), name="sampling-profiler", daemon=True)
+            self.thread.start()
+            return True
+
+    def stop(self):
+        """Stops sampling and returns the folded stacks collected since start"""
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is not None:
+            self.stop_event.set()
+            thread.join()
+        return self.folded()
+
+    def sample_loop(self, interval):
+        own_thread = threading.get_ident()
+        while not self.stop_event.wait(interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def status(self):
+        return {"running": self.running, "samples": self.samples, "started_at": self.started_at}
+
+
+PROFILER = SamplingProfiler()
@@ -0,0 +1,83 @@
+### Declarative queries over filtered_data: equality filters, one group by dimension and a set of aggregates ###
+# A query is answered by an index lookup of the filtered rows (Analytics.matching_positions) and one groupby over them,
+# so a new chart needs no new Analytics method. Queries matching too many rows are rejected instead of scanning
+import numpy as np
+
+# query name -> column of filtered_data, the filters are the keyword arguments of Analytics.matching_positions
+QUERY_FILTERS = {"course_code": "Course Code", "instructor_name": "Instructor", "term": "Term", "window": "Bidding Window", "section": "Section"}
+QUERY_DIMENSIONS = {"course_code": "Course Code", "instructor_name": "Instructor", "term": "Term", "window": "Bidding Window", "section": "Section", "school": "School/Department"}
+QUERY_METRICS = {
+    "median_bid": "Median Bid",
+    "min_bid": "Min Bid",
+    "vacancy": "Vacancy",
+    "opening_vacancy": "Opening Vacancy",
+    "before_process_vacancy": "Before Process Vacancy",
+    "after_process_vacancy": "After Process Vacancy",
+    "enrolled_students": "Enrolled Students",
+    "round_successful_bids": "round_successful_bids",
+}
+QUERY_FUNCTIONS = ("min", "max", "median", "mean", "sum", "count")
+MAX_QUERY_AGGREGATES = 12
+# filters Analytics.matching_positions resolves through an index, a query needs one of them so it never scans every row
+INDEXED_FILTERS = ("course_code", "term", "window")
+
+
+class QueryError(ValueError):
+    """A query that is malformed or too expensive, answered with a 400"""
+
+
+def parse_aggregates(text):
+    """Parses "metric:function,..." (eg. "median_bid:median,min_bid:min") into a tuple of (metric, function)"""
+    aggregates = []
+    for part in (text or "").split(","):
+        metric, _, function = part.strip().partition(":")
+        if metric not in QUERY_METRICS or function not in QUERY_FUNCTIONS:
+            raise QueryError(f"aggregate {part.strip()!r} must be metric:function, metric one of {', '.join(QUERY_METRICS)} and function one of {', '.join(QUERY_FUNCTIONS)}")
+        if (metric, function) not in aggregates:
+            aggregates.append((metric, function))
+    if len(aggregates) > MAX_QUERY_AGGREGATES:
+        raise QueryError(f"at most {MAX_QUERY_AGGREGATES} aggregates per query")
+    return tuple(aggregates)
+
+
+def validate_group_by(group_by):
+    if group_by not in QUERY_DIMENSIONS:
+        raise QueryError(f"group_by must be one of {', '.join(QUERY_DIMENSIONS)}")
+    return group_by
+
+
+def validate_filters(filters):
+    if not any(name in filters for name in INDEXED_FILTERS):
+        raise QueryError(f"a query needs at least one of the filters {', '.join(INDEXED_FILTERS)}")
+    return filters
+
+
+def query_row_limit(row_count, fraction, max_rows=None):
+    """Most rows a query may aggregate: max_rows when set, otherwise fraction of the rows of the dataset"""
+    if max_rows is not None:
+        return max_rows
+    return max(1, int(row_count * fraction))
+
+
+def run_query(analytics, filters, group_by, aggregates, max_rows):
+    """Answers a parsed query: the aggregates of the rows matching filters (query filter name -> value) by value of group_by.
+    Groups come in the order of the dimension (terms and windows chronologically), each aggregate as a float64 array"""
+    positions = analytics.matching_positions(**validate_filters(filters))
+    if len(positions) > max_rows:
+        raise QueryError(f"query matches {len(positions)} rows, more than the {max_rows} allowed, add filters to narrow it down")
+    dimension = QUERY_DIMENSIONS[group_by]
+    columns = list(dict.fromkeys(QUERY_METRICS[metric] for metric, _ in aggregates))
+    rows = analytics.rows_at(positions)
+    # grouped by the categorical codes of the dimension, which sort like the dimension, rows without a value are left out
+    categories = rows[dimension].cat.categories
+    codes = rows[dimension].cat.codes.to_numpy()
+    has_value = codes >= 0
+    grouped = rows.loc[has_value, columns].groupby(codes[has_value], sort=True)
+    results = {f"{metric}_{function}": getattr(grouped[QUERY_METRICS[metric]], function)() for metric, function in aggregates}
+    group_codes = next(iter(results.values())).index.to_numpy()
+    return {
+        "group_by": group_by,
+        "rows": len(positions),
+        "groups": categories[group_codes].astype(str).tolist(),
+        "aggregates": {name: result.to_numpy(dtype=np.float64, na_value=np.nan) for name, result in results.items()},
+    }
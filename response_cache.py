@@ -0,0 +1,205 @@
+### In-process cache of serialized API responses, valid for one dataset version ###
+import asyncio
+import functools
+import gzip
+import hashlib
+import os
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:
+    # brotli is optional, without it only gzip variants are stored
+    brotli = None
+
+# ETags also cover the fingerprint of RESPONSE_SOURCES, so a code change revalidates them by itself. Bump this for
+# changes outside of them that change the bodies (eg. an orjson upgrade serializing differently)
+RESPONSE_FORMAT_VERSION = "2"
+# modules of the API, everything on the path from the dataset to a response body. A change to any of them can change the
+# responses, so it re-renders the materialized charts (see materialize.py) and starts a new disk cache (see disk_cache.py)
+RESPONSE_SOURCES = [
+    "analytics.py", "analytics_pool.py", "api.py", "cache_warmup.py", "dataset.py", "dataset_state.py", "disk_cache.py",
+    "lookup_index.py", "materialize.py", "metrics.py", "query.py", "response_cache.py", "row_export.py", "search_index.py",
+    "shared_dataset.py", "sqlite_store.py",
+]
+# byte budget of a ResponseCache created without one
+DEFAULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# content codings we store, in order of preference when the client accepts several equally
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+# compressed once per cache entry rather than per request, so the levels favour size over speed
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9
+
+
+class CachedResponse:
+    """Body of a response plus its compressed variants by content coding"""
+    __slots__ = ("body", "media_type", "variants")
+
+    def __init__(self, body, media_type, variants=None):
+        self.body = body
+        self.media_type = media_type
+        self.variants = variants or {}
+
+
+def compressed_variants(body, min_bytes):
+    """Compressed copies of body by content coding. Bodies smaller than min_bytes, and variants that are not smaller than
+    the body, are left out"""
+    if len(body) < min_bytes:
+        return {}
+    variants = {"gzip": gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(body, quality=BROTLI_QUALITY)
+    return {encoding: variant for encoding, variant in variants.items() if len(variant) < len(body)}
+
+
+def choose_encoding(accept_encoding, available):
+    """Content coding of available to send for an Accept-Encoding header, None to send the body as it is.
+    The coding with the highest q value wins, ties go to the first one in ENCODINGS"""
+    if not accept_encoding or not available:
+        return None
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    best, best_q = None, 0.0
+    for encoding in ENCODINGS:
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if encoding in available and q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def entry_size(entry):
+    """Bytes of a CachedResponse, its body and every compressed variant"""
+    return len(entry.body) + sum(len(variant) for variant in entry.variants.values())
+
+
+class ResponseCache:
+    """Bounded LRU cache of response bodies keyed by (route path, normalized params). The least recently used entries are
+    evicted past max_entries entries or max_bytes bytes (see entry_size), an entry bigger than max_bytes is not cached"""
+
+    def __init__(self, max_entries=4096, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes if max_bytes is not None else DEFAULT_CACHE_MAX_BYTES
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        size = entry_size(entry)
+        if size > self.max_bytes:
+            return
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.bytes -= entry_size(previous)
+        self.entries[key] = entry
+        self.bytes += size
+        while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes -= entry_size(evicted)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "bytes": sum(len(entry.body) for entry in self.entries.values()),
+            "compressed_bytes": sum(len(variant) for entry in self.entries.values() for variant in entry.variants.values()),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+
+class SingleFlight:
+    """Coalesces concurrent computations of the same response: the first request for a key (the leader) computes it,
+    identical requests arriving meanwhile wait for its result instead of computing their own. Used from the event loop only"""
+
+    def __init__(self):
+        self.flights = {}
+        self.coalesced = 0
+
+    def join(self, key):
+        """Returns (True, future) to the leader, which must call finish(key, entry) once done,
+        (False, future) to the others, whose future resolves to the leader's CachedResponse, None if it failed"""
+        future = self.flights.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return False, future
+        future = asyncio.get_running_loop().create_future()
+        self.flights[key] = future
+        return True, future
+
+    def finish(self, key, entry):
+        future = self.flights.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(entry)
+
+    def stats(self):
+        return {"in_flight": len(self.flights), "coalesced": self.coalesced}
+
+
+@functools.lru_cache(maxsize=None)
+def sources_fingerprint():
+    """sha256 hex digest of the contents of RESPONSE_SOURCES, computed once per process"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+    for source in RESPONSE_SOURCES:
+        with open(os.path.join(here, source), "rb") as f:
+            digest.update(hashlib.sha256(f.read()).hexdigest().encode())
+    return digest.hexdigest()
+
+
+def normalize_params(params):
+    """Normalizes path and query params the same way Analytics does, so equivalent urls share a cache entry"""
+    normalized = []
+    for name, value in sorted(params.items()):
+        if name == "course_code":
+            value = value.upper()
+        elif name == "instructor_name":
+            value = value.strip()
+        normalized.append((name, value))
+    return tuple(normalized)
+
+
+def make_etag(dataset_version, key):
+    digest = hashlib.sha256(f"{RESPONSE_FORMAT_VERSION}:{sources_fingerprint()}:{dataset_version}:{key!r}".encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def etag_matches(if_none_match, etag, exists=False):
+    """True if the If-None-Match header value matches etag (weak comparison, as required for If-None-Match).
+    "*" only matches once the response is known to exist (exists), so a url that answers an error never gets a 304"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if (candidate == "*" and exists) or candidate.replace("W/", "", 1) == etag:
+            return True
+    return False
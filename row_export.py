@@ -0,0 +1,64 @@
+### Streams the rows of filtered_data behind the charts as NDJSON or CSV, a chunk of rows at a time ###
+import csv
+import io
+
+import orjson
+
+# columns of an exported row, in order
+EXPORT_COLUMNS = [
+    "Term", "Bidding Window", "Course Code", "Description", "Section", "Instructor", "School/Department",
+    "Vacancy", "Opening Vacancy", "Before Process Vacancy", "After Process Vacancy", "Enrolled Students",
+    "Median Bid", "Min Bid",
+]
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+# rows converted per chunk, which bounds the memory of an export whatever its size
+EXPORT_CHUNK_ROWS = 1000
+
+
+def column_values(column):
+    """Python values of a column with every missing value (NaN, NA) as None"""
+    return column.to_numpy(dtype=object, na_value=None).tolist()
+
+
+def row_chunks(analytics, positions, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Yields the rows at positions in chunks of chunk_rows, each row a tuple of the EXPORT_COLUMNS values"""
+    for start in range(0, len(positions), chunk_rows):
+        chunk = analytics.rows_at(positions[start:start + chunk_rows])
+        yield zip(*[column_values(chunk[col]) for col in EXPORT_COLUMNS])
+
+
+def ndjson_chunks(analytics, positions):
+    for rows in row_chunks(analytics, positions):
+        yield b"".join(orjson.dumps(dict(zip(EXPORT_COLUMNS, row))) + b"\n" for row in rows)
+
+
+def csv_chunks(analytics, positions):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # header once, before the first chunk of rows (an export without rows is only the header)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in row_chunks(analytics, positions):
+        # csv writes None as an empty field
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def export_chunks(analytics, positions, format):
+    """Generator of the encoded chunks of an export of the rows at positions, format is "ndjson" or "csv".
+    Holds a reference to analytics, so a reload swapping the dataset mid export does not change the rows (the state
+    must stay pinned until the export is over, see released_after)"""
+    if format == "csv":
+        return csv_chunks(analytics, positions)
+    return ndjson_chunks(analytics, positions)
+
+
+def released_after(chunks, release):
+    """Yields the chunks, then calls release, also when the export fails or is abandoned by the client"""
+    try:
+        yield from chunks
+    finally:
+        release()
@@ -0,0 +1,112 @@
+### Autocomplete over course codes, course names and instructor names, built once per dataset load ###
+import heapq
+import re
+
+# query tokens of this length or longer also match with one typo
+MIN_TYPO_LENGTH = 3
+# typos are looked for in this many leading characters of a token, which bounds the size of the typo index
+MAX_TYPO_PREFIX_LENGTH = 8
+
+EXACT_MATCH_SCORE = 2.0
+TYPO_MATCH_SCORE = 1.0
+
+
+def normalize(text):
+    """Upper case words made of letters and digits only, so "prof. tan" finds "PROF TAN" """
+    return re.sub(r"[^0-9A-Z]+", " ", str(text).upper()).split()
+
+
+def word_tokens(words):
+    """words plus the letter and digit runs of words mixing both, so "ACCT 101" also finds "ACCT101" """
+    return words + [part for word in words for part in re.findall(r"[A-Z]+|[0-9]+", word) if part != word]
+
+
+def deletions(text):
+    """text and every string made by deleting one of its characters. Two strings sharing one of these are at most
+    one typo (insertion, deletion, substitution or swap of neighbours) apart"""
+    return {text} | {text[:i] + text[i + 1:] for i in range(len(text))}
+
+
+class SearchEntry:
+    __slots__ = ("type", "value", "label", "tokens", "text")
+
+    def __init__(self, type, value, label, search_text):
+        self.type = type
+        self.value = value
+        self.label = label
+        words = normalize(search_text)
+        self.tokens = word_tokens(words)
+        self.text = " ".join(words)
+
+
+class SearchIndex:
+    """by_prefix maps every prefix of every token to the entries having it.
+    by_deletion maps the deletions of token prefixes (see deletions) to those prefixes, to find prefixes one typo away from a query token"""
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.by_prefix = {}
+        self.by_deletion = {}
+        for entry_id, entry in enumerate(entries):
+            for token in entry.tokens:
+                for end in range(1, len(token) + 1):
+                    self.by_prefix.setdefault(token[:end], set()).add(entry_id)
+        for prefix in self.by_prefix:
+            if MIN_TYPO_LENGTH <= len(prefix) <= MAX_TYPO_PREFIX_LENGTH:
+                for variant in deletions(prefix):
+                    self.by_deletion.setdefault(variant, set()).add(prefix)
+
+    @classmethod
+    def from_analytics(cls, analytics):
+        entries = [
+            SearchEntry("course", course_code, f"{course_code}: {course_name}", f"{course_code} {course_name}")
+            for course_code, course_name in analytics.unique_course_code_to_course_name_map.items()
+        ]
+        entries += [SearchEntry("instructor", instructor, instructor, instructor) for instructor in analytics.get_unique_professors()]
+        return cls(entries)
+
+    def typo_matches(self, token):
+        """Entries with a token starting one typo away from token"""
+        if len(token) < MIN_TYPO_LENGTH:
+            return set()
+        token = token[:MAX_TYPO_PREFIX_LENGTH]
+        prefixes = set()
+        for variant in deletions(token):
+            prefixes |= self.by_deletion.get(variant, set())
+        matches = set()
+        for prefix in prefixes:
+            matches |= self.by_prefix[prefix]
+        return matches
+
+    def search(self, query, limit=10, type=None):
+        """Returns up to limit entries (optionally only of the given type) matching every word of query, best first.
+        Words match the start of a word of the entry, words of 3 letters or more may have one typo"""
+        query_tokens = normalize(query)
+        if not query_tokens or limit <= 0:
+            return []
+
+        scores = None
+        for token in query_tokens:
+            exact = self.by_prefix.get(token, set())
+            token_scores = dict.fromkeys(self.typo_matches(token) - exact, TYPO_MATCH_SCORE)
+            token_scores.update(dict.fromkeys(exact, EXACT_MATCH_SCORE))
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {entry_id: score + token_scores[entry_id] for entry_id, score in scores.items() if entry_id in token_scores}
+            if not scores:
+                return []
+
+        query_text = " ".join(query_tokens)
+        ranked = []
+        for entry_id, score in scores.items():
+            entry = self.entries[entry_id]
+            if type and entry.type != type:
+                continue
+            # matches of the whole text rank above matches of single words
+            if entry.text == query_text:
+                score += 2 * EXACT_MATCH_SCORE
+            elif entry.text.startswith(query_text):
+                score += EXACT_MATCH_SCORE
+            ranked.append((-score, len(entry.label), entry.label, entry_id))
+        return [self.entries[entry_id] for _, _, _, entry_id in heapq.nsmallest(limit, ranked)]
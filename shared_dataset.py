@@ -0,0 +1,134 @@
+### Memory mapped copy of the preprocessed dataset, shared by several API worker processes ###
+# The first process to load a dataset version builds Analytics and writes its tables and indexes as .npy files, the other
+# processes map those files read only. Mapped pages of a file are shared between processes, so each extra worker only
+# pays for a few small dictionaries and lists instead of a whole copy of the dataset
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from analytics import Analytics
+
+# tables of Analytics written to the shared copy with the arrays of its indexes, Analytics.from_tables rebuilds the rest
+SHARED_TABLES = ["filtered_data", "bid_cube", "section_bid_cube"]
+TABLE_META_NAME = "columns.json"
+INDEXES_DIR_NAME = "indexes"
+
+
+def default_shared_dir():
+    return os.path.join(tempfile.gettempdir(), "bossanalytics-shared")
+
+
+def shared_dataset_path(shared_dir, version):
+    return os.path.join(shared_dir, version)
+
+
+def write_table(df, table_dir):
+    """Writes the columns of df as .npy files: categoricals as their codes, Int64 columns as values plus missing mask
+    and numpy columns stacked into one 2d array per dtype, so that read_table builds the frame without copying them"""
+    os.makedirs(table_dir)
+    columns = []
+    blocks = {}
+    for position, (name, column) in enumerate(df.items()):
+        dtype = column.dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            np.save(os.path.join(table_dir, f"{position}.codes.npy"), column.cat.codes.to_numpy())
+            columns.append({"name": name, "position": position, "kind": "category", "categories": dtype.categories.tolist(), "ordered": bool(dtype.ordered)})
+        elif isinstance(dtype, pd.Int64Dtype):
+            np.save(os.path.join(table_dir, f"{position}.values.npy"), column.to_numpy(dtype=np.int64, na_value=0))
+            np.save(os.path.join(table_dir, f"{position}.mask.npy"), column.isna().to_numpy())
+            columns.append({"name": name, "position": position, "kind": "Int64"})
+        elif isinstance(dtype, np.dtype) and dtype.kind in "biuf":
+            blocks.setdefault(dtype.str, []).append(name)
+        else:
+            raise ValueError(f"Column {name} of dtype {dtype} cannot be shared")
+    for block_id, (dtype, names) in enumerate(blocks.items()):
+        np.save(os.path.join(table_dir, f"block{block_id}.npy"), np.stack([df[name].to_numpy(dtype=dtype) for name in names]))
+    np.save(os.path.join(table_dir, "index.npy"), df.index.to_numpy(dtype=np.int64))
+    meta = {"columns": columns, "blocks": list(blocks.values())}
+    with open(os.path.join(table_dir, TABLE_META_NAME), "w") as f:
+        json.dump(meta, f)
+
+
+def read_table(table_dir):
+    """Frame over the read only memory maps of a table written by write_table (columns grouped by storage kind)"""
+    def load(name):
+        return np.load(os.path.join(table_dir, name), mmap_mode="r")
+
+    with open(os.path.join(table_dir, TABLE_META_NAME)) as f:
+        meta = json.load(f)
+    frames = [pd.DataFrame(load(f"block{block_id}.npy").T, columns=names, copy=False) for block_id, names in enumerate(meta["blocks"])]
+    arrays = {}
+    for column in meta["columns"]:
+        position = column["position"]
+        if column["kind"] == "category":
+            dtype = pd.CategoricalDtype(column["categories"], ordered=column["ordered"])
+            arrays[column["name"]] = pd.Categorical.from_codes(load(f"{position}.codes.npy"), dtype=dtype)
+        else:
+            arrays[column["name"]] = pd.arrays.IntegerArray(load(f"{position}.values.npy"), load(f"{position}.mask.npy"))
+    frames.append(pd.DataFrame(arrays, copy=False))
+    # extension arrays and 2d blocks are taken as they are instead of being consolidated into new blocks
+    df = pd.concat(frames, axis=1, copy=False)
+    df.index = pd.Index(load("index.npy"), copy=False)
+    return df
+
+
+def write_index_arrays(index_arrays, indexes_dir):
+    for name, arrays in index_arrays.items():
+        os.makedirs(os.path.join(indexes_dir, name))
+        for array_name, array in arrays.items():
+            np.save(os.path.join(indexes_dir, name, f"{array_name}.npy"), array)
+
+
+def read_index_arrays(indexes_dir):
+    return {
+        name: {
+            os.path.splitext(file_name)[0]: np.load(os.path.join(indexes_dir, name, file_name), mmap_mode="r")
+            for file_name in os.listdir(os.path.join(indexes_dir, name))
+        }
+        for name in os.listdir(indexes_dir)
+    }
+
+
+def publish(analytics, path):
+    """Writes the tables of analytics to path, through a temp directory so other processes never see half a copy"""
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    for table in SHARED_TABLES:
+        write_table(getattr(analytics, table), os.path.join(tmp_path, table))
+    write_index_arrays(analytics.index_arrays(), os.path.join(tmp_path, INDEXES_DIR_NAME))
+    os.rename(tmp_path, path)
+
+
+def attach(path):
+    """Analytics over the shared copy in path"""
+    tables = {table: read_table(os.path.join(path, table)) for table in SHARED_TABLES}
+    return Analytics.from_tables(**tables, index_arrays=read_index_arrays(os.path.join(path, INDEXES_DIR_NAME)))
+
+
+def remove_other_versions(shared_dir, version):
+    """Deletes the copies of other dataset versions. Processes still serving one keep their mappings until they reload"""
+    for name in os.listdir(shared_dir):
+        if name != version and "." not in name:
+            shutil.rmtree(os.path.join(shared_dir, name), ignore_errors=True)
+            lock_path = os.path.join(shared_dir, name + ".lock")
+            if os.path.exists(lock_path):
+                os.remove(lock_path)
+
+
+def open_shared_analytics(shared_dir, version, build):
+    """Analytics of version mapped from shared_dir. The first process to get here calls build() and publishes its
+    tables, processes arriving meanwhile wait for it instead of building their own"""
+    os.makedirs(shared_dir, exist_ok=True)
+    path = shared_dataset_path(shared_dir, version)
+    with open(path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not os.path.exists(path):
+            publish(build(), path)
+            remove_other_versions(shared_dir, version)
+    return attach(path)
@@ -0,0 +1,477 @@
+### Embedded SQLite copy of the preprocessed dataset, the storage backend that keeps filtered_data out of memory ###
+# write_store builds the tables of Analytics from the raw dataset a chunk at a time into one file per dataset version
+# (excel_merge.py writes data/merged_file.<version>.sqlite). Columns are stored coded like the fact table: categoricals as
+# their codes (-1 for missing values), with the categories in store_columns. SqliteAnalytics answers the same calls as
+# Analytics with indexed queries and only reads the rows a call selects, the chart code on top of them is shared
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+from collections.abc import Mapping
+
+import numpy as np
+import pandas as pd
+
+from analytics import CUBE_AGGREGATES, GROUP_INDEXES, INDEX_LEVELS, Analytics, aggregate_cube, category_dtypes, clean_rows, distinct_values, encode_rows
+from lookup_index import LevelEncoder
+
+SQLITE_EXTENSION = ".sqlite"
+# characters of the dataset version in the name of its store
+VERSION_NAME_LENGTH = 16
+# composite indexes of the store: (table, levels), the lookup index levels of filtered_data plus every group index
+STORE_INDEXES = [("filtered_data", INDEX_LEVELS)] + list(GROUP_INDEXES.values())
+# cubes of the store: (table, levels), aggregated from the rows of CUBE_BATCH_COURSES courses at a time
+STORE_CUBES = [("bid_cube", INDEX_LEVELS[:4]), ("section_bid_cube", INDEX_LEVELS)]
+CUBE_BATCH_COURSES = 200
+_NO_ROWS = np.array([], dtype=np.intp)
+
+
+def sqlite_path_for(xlsx_path, version):
+    """Returns the path of the SQLite store of a dataset version next to the specified xlsx. Every version has its own
+    file, so writing a new version never touches the file a state still serving the previous one reads"""
+    return f"{os.path.splitext(xlsx_path)[0]}.{version[:VERSION_NAME_LENGTH]}{SQLITE_EXTENSION}"
+
+
+def is_store_file(xlsx_path, filename):
+    """True for the stores of the xlsx, their lock files and the temp files they are written to"""
+    base = os.path.basename(os.path.splitext(xlsx_path)[0]) + "."
+    return filename.startswith(base) and SQLITE_EXTENSION in filename[len(base):]
+
+
+def quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def column_kind(column):
+    """(kind, dtype) a column is stored as: categorical codes (dtype the CategoricalDtype), Int64 with None for missing
+    values, or numbers (dtype the numpy dtype string)"""
+    dtype = column.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        return "category", dtype
+    if isinstance(dtype, pd.Int64Dtype):
+        return "Int64", None
+    if isinstance(dtype, np.dtype) and dtype.kind in "biuf":
+        # NaN is stored as NULL
+        return "numpy", dtype.str
+    raise ValueError(f"Column {column.name} of dtype {dtype} cannot be stored")
+
+
+def table_columns(df):
+    """(name, kind, dtype) of each column of df as stored"""
+    return [(name, *column_kind(column)) for name, column in df.items()]
+
+
+def stored_values(column, kind):
+    if kind == "category":
+        return column.cat.codes.to_numpy().tolist()
+    if kind == "Int64":
+        return column.to_numpy(dtype=object, na_value=None).tolist()
+    return column.tolist()
+
+
+def table_frame(columns, rows):
+    """Frame of rows (tuples of position and column values) of a table of columns, with the dtypes of the stored columns"""
+    values = list(zip(*rows)) or [()] * (len(columns) + 1)
+    data = {}
+    for (name, kind, dtype), column in zip(columns, values[1:]):
+        if kind == "category":
+            data[name] = pd.Categorical.from_codes(np.array(column, dtype=np.int64), dtype=dtype)
+        elif kind == "Int64":
+            data[name] = pd.array(column, dtype="Int64")
+        else:
+            data[name] = np.array(column, dtype=dtype)
+    return pd.DataFrame(data, index=pd.Index(np.array(values[0], dtype=np.int64)))
+
+
+def create_table(connection, table, columns, record=True):
+    """Creates table, the position of each row (its iloc) being the primary key, and records its columns in store_columns"""
+    connection.execute(f"CREATE TABLE {table} (position INTEGER PRIMARY KEY, {', '.join(quote(name) for name, _, _ in columns)})")
+    if record:
+        connection.executemany("INSERT INTO store_columns VALUES (?, ?, ?, ?, ?, ?, ?)", [
+            (table, position, name, kind, None if kind == "category" else dtype,
+             json.dumps(dtype.categories.tolist()) if kind == "category" else None, bool(dtype.ordered) if kind == "category" else None)
+            for position, (name, kind, dtype) in enumerate(columns)
+        ])
+
+
+def insert_rows(connection, table, columns, df, start):
+    """Inserts the rows of df into table at positions start, start + 1, ..."""
+    values = [stored_values(df[name], kind) for name, kind, _ in columns]
+    connection.executemany(
+        f"INSERT INTO {table} VALUES ({', '.join('?' * (len(columns) + 1))})",
+        zip(range(start, start + len(df)), *values),
+    )
+
+
+def create_indexes(connection, table):
+    for index_table, levels in STORE_INDEXES:
+        if index_table == table:
+            name = f"{table}_by_" + "_".join(level.lower().replace(" ", "_") for level in levels)
+            connection.execute(f"CREATE INDEX {name} ON {table} ({', '.join(quote(level) for level in levels)})")
+
+
+def write_cube(connection, table, levels, row_columns, course_count):
+    """Writes the cube of levels, aggregated a batch of courses at a time (a group never spans two courses) like
+    Analytics.build_aggregate_cube: groups ordered by term, bidding window, then first appearance in filtered_data"""
+    groups_table = f"{table}_groups"
+    aggregates = {**CUBE_AGGREGATES, "first_position": ("position", "min")}
+    columns = None
+    count = 0
+    for first_code in range(0, max(course_count, 1), CUBE_BATCH_COURSES):
+        rows = table_frame(row_columns, connection.execute(
+            'SELECT * FROM filtered_data WHERE "Course Code" BETWEEN ? AND ? ORDER BY position', (first_code, first_code + CUBE_BATCH_COURSES - 1),
+        ).fetchall())
+        rows["position"] = rows.index.to_numpy()
+        cube = aggregate_cube(rows, levels, aggregates)
+        if columns is None:
+            columns = table_columns(cube)
+            create_table(connection, groups_table, columns, record=False)
+        insert_rows(connection, groups_table, columns, cube, count)
+        count += len(cube)
+    cube_columns = [column for column in columns if column[0] != "first_position"]
+    names = ", ".join(quote(name) for name, _, _ in cube_columns)
+    create_table(connection, table, cube_columns)
+    connection.execute(
+        f'INSERT INTO {table} SELECT ROW_NUMBER() OVER (ORDER BY "Term", "Bidding Window", first_position) - 1, {names} FROM {groups_table}'
+    )
+    connection.execute(f"DROP TABLE {groups_table}")
+
+
+def write_store(chunks, path, version):
+    """Writes the store of a dataset to path. chunks() returns an iterable over the raw dataset (frames like the snapshot)
+    and is called twice: for the categories, then to insert the rows. Only one chunk, or the rows of one batch of courses
+    for the cubes, is in memory at a time. Goes through a temp file so readers never see half a store"""
+    distinct = {}
+    for chunk in chunks():
+        for col, values in distinct_values(clean_rows(chunk)).items():
+            distinct.setdefault(col, {}).update(dict.fromkeys(values))
+    dtypes = category_dtypes({col: list(values) for col, values in distinct.items()})
+
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    connection = sqlite3.connect(tmp_path)
+    try:
+        connection.execute("CREATE TABLE store_metadata (key TEXT PRIMARY KEY, value TEXT)")
+        connection.execute("CREATE TABLE store_columns (table_name TEXT, position INTEGER, name TEXT, kind TEXT, dtype TEXT, categories TEXT, ordered INTEGER)")
+        columns = None
+        count = 0
+        for chunk in chunks():
+            rows = encode_rows(clean_rows(chunk), dtypes)
+            if columns is None:
+                columns = table_columns(rows)
+                create_table(connection, "filtered_data", columns)
+            insert_rows(connection, "filtered_data", columns, rows, count)
+            count += len(rows)
+        # the cubes read filtered_data a batch of courses at a time through its index
+        create_indexes(connection, "filtered_data")
+        for table, levels in STORE_CUBES:
+            write_cube(connection, table, levels, columns, len(dtypes["Course Code"].categories))
+            create_indexes(connection, table)
+        # statistics of the indexes, without them the planner may pick the term or window index over the composite one
+        connection.execute("ANALYZE")
+        connection.execute("INSERT INTO store_metadata VALUES ('version', ?)", (version,))
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(tmp_path, path)
+
+
+def store_version(path):
+    """Dataset version the store at path was written from, None if there is no store"""
+    if not os.path.exists(path):
+        return None
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        row = connection.execute("SELECT value FROM store_metadata WHERE key = 'version'").fetchone()
+    except sqlite3.DatabaseError:
+        return None
+    finally:
+        connection.close()
+    return row[0] if row else None
+
+
+def open_lock(lock_path, operation):
+    """Opens and flocks lock_path, again if remove_store removed it in between so the lock is on the file at lock_path"""
+    while True:
+        lock = open(lock_path, "a")
+        try:
+            fcntl.flock(lock, operation)
+            if os.fstat(lock.fileno()).st_ino == os.stat(lock_path).st_ino:
+                return lock
+        except FileNotFoundError:
+            pass
+        except BaseException:
+            lock.close()
+            raise
+        lock.close()
+
+
+def remove_store(path):
+    """Removes the store at path with its lock files, the caller holding the exclusive lock on path.lock"""
+    for file_path in (path, path + ".build", path + ".lock"):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+def remove_unused_stores(xlsx_path, keep_path=None):
+    """Removes the stores of the xlsx other than keep_path that no process serves: every process serving a store holds
+    a shared lock on its path.lock, so the exclusive lock is only granted once the last one has let go"""
+    folder = os.path.dirname(xlsx_path) or "."
+    for filename in os.listdir(folder):
+        path = os.path.join(folder, filename)
+        if not is_store_file(xlsx_path, filename) or not filename.endswith(SQLITE_EXTENSION) or path == keep_path:
+            continue
+        try:
+            lock = open_lock(path + ".lock", fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            continue
+        with lock:
+            remove_store(path)
+
+
+def ensure_store(xlsx_path, version, chunks):
+    """Writes the store of version from chunks (see write_store) unless it exists, processes arriving meanwhile wait for
+    it instead of writing their own. Returns its path"""
+    path = sqlite_path_for(xlsx_path, version)
+    with open(path + ".build", "a") as build_lock:
+        fcntl.flock(build_lock, fcntl.LOCK_EX)
+        if store_version(path) != version:
+            write_store(chunks, path, version)
+    return path
+
+
+def open_sqlite_analytics(xlsx_path, version, chunks):
+    """SqliteAnalytics over the store of version, written from chunks if it is missing (see ensure_store). Stores of other
+    versions that no process serves anymore are removed, the store of version once closed by the last process serving it"""
+    path = sqlite_path_for(xlsx_path, version)
+    # shared from before the store is checked until the analytics is closed, so no other process removes it meanwhile
+    lock = open_lock(path + ".lock", fcntl.LOCK_SH)
+    try:
+        ensure_store(xlsx_path, version, chunks)
+        analytics = SqliteAnalytics(path, lock)
+    except BaseException:
+        lock.close()
+        raise
+    remove_unused_stores(xlsx_path, keep_path=path)
+    return analytics
+
+
+class SqliteAnalytics(Analytics):
+    """Analytics answering from the SQLite store at path instead of holding filtered_data and the cubes in memory.
+    Lookups and filters are queries on the composite indexes, and rows_at and the cube lookups only read the rows
+    asked for. Everything computed from those rows is inherited from Analytics, so both give the same results"""
+
+    def __init__(self, path, lock=None):
+        self.path = path
+        # open lock file holding the shared lock on the store (see open_sqlite_analytics), None in pool workers
+        self.lock = lock
+        # sqlite3 connections cannot be shared between threads, each thread opens its own
+        self.local = threading.local()
+        self.version = self.execute("SELECT value FROM store_metadata WHERE key = 'version'")[0][0]
+        self.columns = {}
+        for table, position, name, kind, dtype, categories, ordered in self.execute("SELECT * FROM store_columns ORDER BY table_name, position"):
+            if kind == "category":
+                dtype = pd.CategoricalDtype(json.loads(categories), ordered=bool(ordered))
+            self.columns.setdefault(table, []).append((name, kind, dtype))
+        # codes of the categorical columns of each table, the cubes have categories of their own
+        self.table_encoders = {
+            table: {name: LevelEncoder(dtype.categories) for name, kind, dtype in columns if kind == "category"}
+            for table, columns in self.columns.items()
+        }
+        self.describe_dimensions()
+        self.build_catalog()
+        self.lookup_index = SqliteNode(self, ())
+        for name, (table, levels) in GROUP_INDEXES.items():
+            setattr(self, name, SqliteGroupIndex(self, table, levels))
+
+    def connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            # read only, and immutable as the file of a version is only removed once no state serves it
+            connection = sqlite3.connect(f"file:{self.path}?mode=ro&immutable=1", uri=True, check_same_thread=False)
+            self.local.connection = connection
+        return connection
+
+    def close(self):
+        """Lets go of the store once the state serving it is retired, removing it if no other process serves it"""
+        if self.lock is None:
+            return
+        try:
+            fcntl.flock(self.lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            remove_store(self.path)
+        except BlockingIOError:
+            pass
+        finally:
+            self.lock.close()
+            self.lock = None
+
+    def execute(self, sql, params=()):
+        return self.connection().execute(sql, params).fetchall()
+
+    def where(self, table, levels, values):
+        """WHERE clause and params selecting the rows of table whose levels have values, None if a value never occurs"""
+        codes = []
+        for level, value in zip(levels, values):
+            code = self.table_encoders[table][level].code(value)
+            if code is None:
+                return None
+            codes.append(code - 1)
+        clause = " AND ".join(f"{quote(level)} = ?" for level in levels) or "1"
+        return clause, codes
+
+    def frame(self, table, rows):
+        return table_frame(self.columns[table], rows)
+
+    def select(self, table, levels, values):
+        """Rows of table whose levels have values, in table order"""
+        where = self.where(table, levels, values)
+        if where is None:
+            return self.frame(table, [])
+        clause, params = where
+        return self.frame(table, self.execute(f"SELECT * FROM {table} WHERE {clause} ORDER BY position", params))
+
+    def positions(self, table, levels, values):
+        """Sorted positions of the rows of table whose levels have values"""
+        where = self.where(table, levels, values)
+        if where is None:
+            return _NO_ROWS
+        clause, params = where
+        return np.array([row[0] for row in self.execute(f"SELECT position FROM {table} WHERE {clause} ORDER BY position", params)], dtype=np.intp)
+
+    def distinct(self, levels, values, level):
+        """Values of level in the rows of filtered_data whose levels have values, in order of first appearance"""
+        where = self.where("filtered_data", levels, values)
+        if where is None:
+            return []
+        clause, params = where
+        codes = self.execute(f"SELECT {quote(level)} FROM filtered_data WHERE {clause} GROUP BY {quote(level)} ORDER BY MIN(position)", params)
+        return [self.encoders[level].values[code + 1] for code, in codes]
+
+    ### Storage of Analytics Start ###
+    def column_dtypes(self):
+        return {name: dtype for name, _, dtype in self.columns["filtered_data"]}
+
+    def distinct_rows(self, columns, subset=None):
+        groups = ", ".join(quote(column) for column in subset or columns)
+        rows = self.execute(f"SELECT * FROM filtered_data WHERE position IN (SELECT MIN(position) FROM filtered_data GROUP BY {groups}) ORDER BY position")
+        return self.frame("filtered_data", rows)[columns].reset_index(drop=True)
+
+    def rows_at(self, positions):
+        positions = np.asarray(positions)
+        rows = self.execute("SELECT * FROM filtered_data WHERE position IN (SELECT value FROM json_each(?)) ORDER BY position", (json.dumps(positions.tolist()),))
+        frame = self.frame("filtered_data", rows)
+        if len(positions) > 1 and not np.all(positions[1:] > positions[:-1]):
+            # rows in the order asked for, like iloc
+            frame = frame.iloc[np.searchsorted(frame.index.to_numpy(), positions)]
+        return frame
+
+    def row_count(self):
+        return self.execute("SELECT COUNT(*) FROM filtered_data")[0][0]
+
+    def filter_by_faculty(self, faculty):
+        # matches Course Code, like Analytics.filter_by_faculty
+        return self.select("filtered_data", ["Course Code"], (faculty,))
+
+    def get_instructors_by_faculty(self, faculty):
+        # takes faculty as a column name, like Analytics.get_instructors_by_faculty
+        if faculty not in self.column_dtypes():
+            raise KeyError(faculty)
+        return self.distinct_rows([faculty])[faculty].unique()
+
+    def cube_rows(self, cube_index, key):
+        return cube_index.rows(key)
+
+    def section_cube_rows(self, cube_index, key):
+        return cube_index.rows(key)
+
+    def lookup(self, *keys):
+        where = self.where("filtered_data", INDEX_LEVELS[:len(keys)], keys)
+        if where is None or not self.execute(f"SELECT 1 FROM filtered_data WHERE {where[0]} LIMIT 1", where[1]):
+            return None
+        return SqliteNode(self, keys)
+
+    def window_positions_across_terms(self, course_code, instructor_name, window):
+        return self.positions("filtered_data", ["Course Code", "Instructor", "Bidding Window"], (course_code, instructor_name, window))
+
+    def windows_of(self, instructor_node):
+        windows = self.distinct(INDEX_LEVELS[:2], instructor_node.key, "Bidding Window") if instructor_node else []
+        return sorted(windows, key=lambda window: self.window_rank.get(window, len(self.window_rank)))
+
+    def sections_of(self, term_node):
+        return sorted(self.distinct(INDEX_LEVELS[:3], term_node.key, "Section")) if term_node else []
+
+    def matching_positions(self, course_code=None, instructor_name=None, term=None, window=None, section=None):
+        filters = {
+            "Course Code": course_code.upper() if course_code is not None else None,
+            "Instructor": instructor_name.strip() if instructor_name is not None else None,
+            "Term": term,
+            "Bidding Window": window,
+            "Section": section,
+        }
+        filters = {level: value for level, value in filters.items() if value is not None}
+        return self.positions("filtered_data", list(filters), list(filters.values()))
+    ### Storage of Analytics End ###
+
+
+class SqliteNode:
+    """Node of the lookup index of a SqliteAnalytics, the rows whose first len(key) INDEX_LEVELS have the values of key"""
+    __slots__ = ("analytics", "key")
+
+    def __init__(self, analytics, key):
+        self.analytics = analytics
+        self.key = tuple(key)
+
+    @property
+    def positions(self):
+        return self.analytics.positions("filtered_data", INDEX_LEVELS[:len(self.key)], self.key)
+
+    @property
+    def children(self):
+        return SqliteChildren(self)
+
+
+class SqliteChildren(Mapping):
+    """Read only mapping of the values of the next level under a node to their nodes, in order of first appearance"""
+
+    def __init__(self, node):
+        self.node = node
+        depth = len(node.key)
+        self.values_in_order = node.analytics.distinct(INDEX_LEVELS[:depth], node.key, INDEX_LEVELS[depth]) if depth < len(INDEX_LEVELS) else []
+        self.value_set = set(self.values_in_order)
+
+    def __getitem__(self, value):
+        try:
+            found = value in self.value_set
+        except TypeError:
+            # unhashable values are never keys
+            found = False
+        if not found:
+            raise KeyError(value)
+        return SqliteNode(self.node.analytics, self.node.key + (value,))
+
+    def __iter__(self):
+        return iter(self.values_in_order)
+
+    def __len__(self):
+        return len(self.values_in_order)
+
+
+class SqliteGroupIndex:
+    """Group index of a SqliteAnalytics table: get works like GroupIndex.get and rows reads the rows of a key"""
+
+    def __init__(self, analytics, table, levels):
+        self.analytics = analytics
+        self.table = table
+        self.levels = levels
+
+    def values_of(self, key):
+        return key if len(self.levels) > 1 else (key,)
+
+    def get(self, key, default=None):
+        positions = self.analytics.positions(self.table, self.levels, self.values_of(key))
+        return positions if len(positions) else default
+
+    def rows(self, key):
+        return self.analytics.select(self.table, self.levels, self.values_of(key))
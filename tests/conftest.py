@@ -0,0 +1,54 @@
+### Shared fixtures of the tests: the API app serving a small hand made dataset ###
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from excel_merge import reference_columns, to_snapshot_frame
+
+TERM = "2021-22 Term 1"
+# (term, bidding window, course code, section, instructor, median bid, min bid, vacancy, before process vacancy, after process vacancy)
+ROWS = [
+    (TERM, "Round 1 Window 1", "IS111", "G1", "PROF A", 40.0, 30.0, 40, 20, 5),
+    # nobody bid under the median, the min bid is missing
+    (TERM, "Round 1 Window 1", "IS111", "G2", "PROF A", 50.0, np.nan, 40, 10, 0),
+    (TERM, "Round 1 Window 2", "IS111", "G1", "PROF A", 45.0, 20.0, 40, 5, 1),
+    ("2022-23 Term 1", "Round 1 Window 1", "IS111", "G1", "PROF B", 60.0, 55.0, 45, 30, 10),
+    # never offered in Round 1 Window 1, so its overview has no values
+    ("2021-22 Term 2", "Round 2 Window 1", "IS112", "G1", "PROF A", 20.0, 10.0, 30, 3, 0),
+]
+
+
+def boss_frame():
+    df = pd.DataFrame(ROWS, columns=[
+        "Term", "Bidding Window", "Course Code", "Section", "Instructor", "Median Bid", "Min Bid",
+        "Vacancy", "Before Process Vacancy", "After Process Vacancy",
+    ])
+    df["Session"] = "Regular Academic Session"
+    df["Description"] = df["Course Code"] + " Topics"
+    df["Opening Vacancy"] = df["Vacancy"]
+    df["D.I.C.E"] = 0
+    df["Enrolled Students"] = df["Vacancy"] - df["After Process Vacancy"]
+    df["School/Department"] = "School of Computing and Information Systems"
+    return to_snapshot_frame(df[reference_columns])
+
+
+@pytest.fixture(scope="session")
+def api_client(tmp_path_factory):
+    """(api module, TestClient) of the app on the dataset of ROWS, loaded once: api reads its settings on import"""
+    data_dir = tmp_path_factory.mktemp("data")
+    # a snapshot without an xlsx next to it is read as is
+    boss_frame().to_parquet(data_dir / "merged_file.parquet", index=False)
+    os.environ["DATA_PATH"] = str(data_dir / "merged_file.xlsx")
+    # /query may aggregate every row of a dataset this small
+    os.environ["QUERY_MAX_ROWS_FRACTION"] = "1"
+    import api
+    from fastapi.testclient import TestClient
+
+    with TestClient(api.app) as client:
+        api.dataset_loader.wait()
+        yield api, client
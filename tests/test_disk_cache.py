@@ -0,0 +1,67 @@
+### The disk cache stays within its byte budget, removing the least recently used responses first ###
+import os
+import time
+
+from disk_cache import EVICT_TO_FRACTION, DiskResponseCache, encode_entry
+from response_cache import CachedResponse
+
+BODY = b"x" * 1000
+
+
+def key(i):
+    return ("/search", (("q", f"query {i}"),))
+
+
+def entry_bytes():
+    return len(encode_entry(CachedResponse(BODY, "application/json")))
+
+
+def age(cache, i, seconds):
+    """Makes the file of key(i) look last used seconds ago"""
+    path = cache.file_for(key(i))
+    when = time.time() - seconds
+    os.utime(path, (when, when))
+
+
+def test_writes_past_the_budget_evict_down_to_it(tmp_path):
+    cache = DiskResponseCache.open(str(tmp_path), "v1", max_bytes=10 * entry_bytes())
+    for i in range(50):
+        cache.put(key(i), CachedResponse(BODY, "application/json"))
+    files = cache.cache_files()
+    assert sum(size for _, _, size in files) <= cache.max_bytes
+    assert cache.bytes == sum(size for _, _, size in files)
+    assert cache.evictions == 50 - len(files)
+    # the latest write is kept
+    assert cache.get(key(49)).body == BODY
+
+
+def test_least_recently_used_is_evicted_first(tmp_path):
+    cache = DiskResponseCache.open(str(tmp_path), "v1", max_bytes=5 * entry_bytes())
+    for i in range(5):
+        cache.put(key(i), CachedResponse(BODY, "application/json"))
+        age(cache, i, 100 - i)
+    # a hit makes the oldest entry the most recently used one
+    assert cache.get(key(0)) is not None
+    cache.put(key(5), CachedResponse(BODY, "application/json"))
+    kept = int(5 * EVICT_TO_FRACTION)
+    assert cache.get(key(0)) is not None
+    assert cache.get(key(1)) is None
+    assert len(cache.cache_files()) == kept
+
+
+def test_budget_counts_the_files_already_on_disk(tmp_path):
+    first = DiskResponseCache.open(str(tmp_path), "v1", max_bytes=100 * entry_bytes())
+    for i in range(3):
+        first.put(key(i), CachedResponse(BODY, "application/json"))
+    reopened = DiskResponseCache.open(str(tmp_path), "v1", max_bytes=100 * entry_bytes())
+    assert reopened.bytes == 3 * entry_bytes()
+
+
+def test_put_later_writes_in_the_background_until_closed(tmp_path):
+    cache = DiskResponseCache.open(str(tmp_path), "v1")
+    cache.put_later(key(0), CachedResponse(BODY, "application/json"))
+    cache.writer.submit(lambda: None).result()
+    assert cache.get(key(0)).body == BODY
+    cache.close()
+    cache.put_later(key(1), CachedResponse(BODY, "application/json"))
+    assert cache.get(key(1)) is None
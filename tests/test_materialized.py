@@ -0,0 +1,55 @@
+### Materialized charts are only served when they were rendered from the dataset version and by the code being served ###
+import os
+
+from materialize import MaterializedCharts, materialized_file, save_manifest
+from response_cache import sources_fingerprint
+
+# a route no other test requests, so it is not in the response cache yet
+PATH = "/coursedata/overview/instructor_median_bid_chart/IS112"
+MATERIALIZED_BODY = b'{"title":"materialized"}'
+
+
+def write_build(out_dir, version, renderer):
+    """A build of out_dir holding MATERIALIZED_BODY as the response of PATH"""
+    file_path = materialized_file(out_dir, PATH)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, "wb") as f:
+        f.write(MATERIALIZED_BODY)
+    manifest = {"dataset_version": version, "renderer": renderer, "courses": {"IS112": {"fingerprint": "", "paths": [PATH], "failed": {}}}}
+    save_manifest(manifest, out_dir)
+
+
+def serve_build(api, client, build):
+    state = api.dataset_state
+    previous = state.materialized
+    state.materialized = build
+    state.response_cache.clear()
+    try:
+        return client.get(PATH)
+    finally:
+        state.materialized = previous
+        state.response_cache.clear()
+
+
+def test_build_of_the_current_code_is_served(api_client, tmp_path):
+    api, client = api_client
+    write_build(str(tmp_path), api.dataset_state.version, sources_fingerprint())
+    build = MaterializedCharts.open(str(tmp_path), api.dataset_state.version)
+    assert build is not None
+    assert serve_build(api, client, build).content == MATERIALIZED_BODY
+
+
+def test_build_of_other_code_falls_through_to_the_route(api_client, tmp_path):
+    api, client = api_client
+    write_build(str(tmp_path), api.dataset_state.version, "rendered-by-an-older-deploy")
+    build = MaterializedCharts.open(str(tmp_path), api.dataset_state.version)
+    assert build is None
+    response = serve_build(api, client, build)
+    assert response.status_code == 200
+    assert response.json()["title"].startswith("Median and Mean 'Median Bid' Price against Instructors")
+
+
+def test_build_of_another_dataset_version_is_not_served(api_client, tmp_path):
+    api, _ = api_client
+    write_build(str(tmp_path), "another version", sources_fingerprint())
+    assert MaterializedCharts.open(str(tmp_path), api.dataset_state.version) is None
@@ -0,0 +1,31 @@
+### /query only answers queries narrowed down through an index and within the row limit ###
+import pytest
+
+from query import query_row_limit
+
+AGGREGATES = "aggregates=median_bid:median"
+
+
+@pytest.mark.parametrize("filters", ["", "&instructor_name=PROF A", "&section=G1", "&instructor_name=PROF A&section=G1"])
+def test_query_without_an_indexed_filter_is_rejected(api_client, filters):
+    _, client = api_client
+    response = client.get(f"/query?group_by=term&{AGGREGATES}{filters}")
+    assert response.status_code == 400
+    assert "course_code, term, window" in response.json()["detail"]
+
+
+def test_query_over_the_row_limit_is_rejected(api_client, monkeypatch):
+    api, client = api_client
+    api.dataset_state.response_cache.clear()
+    # IS111 has 4 rows
+    monkeypatch.setattr(api, "QUERY_MAX_ROWS", 3)
+    response = client.get(f"/query?group_by=term&{AGGREGATES}&course_code=IS111")
+    assert response.status_code == 400
+    assert "more than the 3 allowed" in response.json()["detail"]
+    assert client.get(f"/query?group_by=term&{AGGREGATES}&course_code=IS111&section=G2").status_code == 200
+
+
+def test_row_limit_is_a_fraction_of_the_dataset():
+    assert query_row_limit(20000, 0.1) == 2000
+    assert query_row_limit(5, 0.1) == 1
+    assert query_row_limit(20000, 0.1, max_rows=500) == 500
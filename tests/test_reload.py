@@ -0,0 +1,46 @@
+### Reloads: nothing is read or swapped while the first load is running or when the data files did not change ###
+from dataset import dataset_version
+from dataset_state import DatasetReloader
+
+
+class FakeState:
+    def __init__(self, version):
+        self.version = version
+
+
+def reloader(xlsx_path, current_version, loads, swaps):
+    def load_state():
+        loads.append(1)
+        return FakeState("new")
+    return DatasetReloader(xlsx_path, load_state=load_state, current_version=current_version, on_swap=swaps.append)
+
+
+def test_reload_before_the_first_load_does_nothing(api_client):
+    api, _ = api_client
+    loads, swaps = [], []
+    target = reloader(api.DATA_PATH, lambda: None, loads, swaps)
+    target._reload()
+    assert loads == [] and swaps == [] and target.last_error is None
+
+
+def test_reload_of_the_same_version_reads_nothing(api_client):
+    api, _ = api_client
+    loads, swaps = [], []
+    target = reloader(api.DATA_PATH, lambda: dataset_version(api.DATA_PATH), loads, swaps)
+    target._reload()
+    assert loads == [] and swaps == []
+
+
+def test_reload_of_a_new_version_swaps_it_in(api_client):
+    api, _ = api_client
+    loads, swaps = [], []
+    target = reloader(api.DATA_PATH, lambda: "old", loads, swaps)
+    target._reload()
+    assert loads == [1] and [state.version for state in swaps] == ["new"]
+    assert target.last_reload["version"] == "new" and target.last_error is None
+
+
+def test_app_current_version_is_none_before_the_first_load(api_client, monkeypatch):
+    api, _ = api_client
+    monkeypatch.setattr(api, "dataset_state", None)
+    assert api.dataset_reloader.current_version() is None
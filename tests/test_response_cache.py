@@ -0,0 +1,70 @@
+### Response cache: keys only cover the params a route reads, and the cache stays within its entry and byte budgets ###
+from response_cache import CachedResponse, ResponseCache, entry_size
+
+
+def entry(size, variant_size=0):
+    return CachedResponse(b"x" * size, "application/json", {"gzip": b"z" * variant_size} if variant_size else {})
+
+
+def test_undeclared_params_share_the_entry_of_the_route(api_client):
+    api, client = api_client
+    cache = api.dataset_state.response_cache
+    cache.clear()
+    first = client.get("/coursedata/overview/IS111")
+    for i in range(20):
+        response = client.get(f"/coursedata/overview/IS111?_={i}&utm_source=x")
+        assert response.content == first.content
+        assert response.headers["etag"] == first.headers["etag"]
+    assert len(cache.entries) == 1
+
+
+def test_declared_query_params_keep_their_own_entries(api_client):
+    api, client = api_client
+    cache = api.dataset_state.response_cache
+    cache.clear()
+    client.get("/coursedata/coursepage/IS111")
+    client.get("/coursedata/coursepage/IS111?instructor_name=PROF A")
+    client.get("/coursedata/coursepage/IS111?instructor_name=PROF A&junk=1")
+    assert len(cache.entries) == 2
+
+
+def test_byte_budget_evicts_least_recently_used():
+    cache = ResponseCache(max_entries=100, max_bytes=300)
+    cache.put("a", entry(100))
+    cache.put("b", entry(80, variant_size=20))
+    cache.put("c", entry(100))
+    assert cache.get("a") is not None
+    cache.put("d", entry(100))
+    # b was the least recently used once a was read
+    assert list(cache.entries) == ["c", "a", "d"]
+    assert cache.bytes == 300 and cache.evictions == 1
+
+
+def test_replacing_an_entry_counts_its_bytes_once():
+    cache = ResponseCache(max_entries=100, max_bytes=1000)
+    cache.put("a", entry(100))
+    cache.put("a", entry(200))
+    assert cache.bytes == entry_size(cache.entries["a"]) == 200
+
+
+def test_entry_bigger_than_the_budget_is_not_cached():
+    cache = ResponseCache(max_entries=100, max_bytes=300)
+    cache.put("a", entry(100))
+    cache.put("huge", entry(301))
+    assert list(cache.entries) == ["a"] and cache.bytes == 100
+
+
+def test_if_none_match_star_needs_an_existing_response(api_client):
+    api, client = api_client
+    api.dataset_state.response_cache.clear()
+    assert client.get("/coursedata/overview/NOPE000", headers={"If-None-Match": "*"}).status_code == 404
+    # computed on this request, then answered from the cache
+    assert client.get("/coursedata/overview/IS111", headers={"If-None-Match": "*"}).status_code == 304
+    assert client.get("/coursedata/overview/IS111", headers={"If-None-Match": "*"}).status_code == 304
+
+
+def test_if_none_match_etag_gets_a_304(api_client):
+    _, client = api_client
+    etag = client.get("/coursedata/overview/IS111").headers["etag"]
+    assert client.get("/coursedata/overview/IS111", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/coursedata/overview/IS111", headers={"If-None-Match": '"other"'}).status_code == 200
@@ -0,0 +1,177 @@
+### Contract test of the wire schema of the data routes: field names and order, json types, and NaN sent as null ###
+# usage: python -m pytest tests
+# The routes encode plain dicts with orjson instead of validating them against the response models, so this pins
+# their output to the models (and to exact bodies for the small hand made dataset of conftest.py)
+import json
+import typing
+
+import pytest
+from pydantic import BaseModel
+
+from conftest import TERM
+
+OVERVIEW_LABELS = ["Min 'median bid'", "Median 'median bid'", "Mean 'median bid'", "Max 'median bid'"]
+
+
+def get_json(client, url):
+    response = client.get(url)
+    assert response.status_code == 200, response.text
+    return json.loads(response.content)
+
+
+def assert_same_json(actual, expected, path="body"):
+    """Equal values of the same json types (1 and 1.0 differ) with keys in the same order"""
+    assert type(actual) is type(expected), f"{path}: {actual!r} is not a {type(expected).__name__}"
+    if isinstance(expected, dict):
+        assert list(actual) == list(expected), f"{path}: keys {list(actual)} instead of {list(expected)}"
+        for key in expected:
+            assert_same_json(actual[key], expected[key], f"{path}.{key}")
+    elif isinstance(expected, list):
+        assert len(actual) == len(expected), f"{path}: {len(actual)} items instead of {len(expected)}"
+        for i, (a, e) in enumerate(zip(actual, expected)):
+            assert_same_json(a, e, f"{path}[{i}]")
+    else:
+        assert actual == expected, f"{path}: {actual!r} instead of {expected!r}"
+
+
+def assert_matches_type(value, annotation, path):
+    """value is the json of annotation (a response model or a field type). Numbers of a float field are always json floats,
+    or null where the value is NaN"""
+    origin = typing.get_origin(annotation)
+    if origin is typing.Union:
+        if value is None and type(None) in typing.get_args(annotation):
+            return
+        (annotation,) = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        origin = typing.get_origin(annotation)
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        fields = typing.get_type_hints(annotation)
+        assert isinstance(value, dict), f"{path}: {value!r} is not an object"
+        assert list(value) == list(fields), f"{path}: keys {list(value)} instead of {list(fields)}"
+        for name, field_type in fields.items():
+            assert_matches_type(value[name], field_type, f"{path}.{name}")
+    elif origin is list:
+        assert isinstance(value, list), f"{path}: {value!r} is not an array"
+        (item_type,) = typing.get_args(annotation)
+        for i, item in enumerate(value):
+            assert_matches_type(item, item_type, f"{path}[{i}]")
+    elif origin is dict:
+        assert isinstance(value, dict), f"{path}: {value!r} is not an object"
+        _, item_type = typing.get_args(annotation)
+        for key, item in value.items():
+            assert_matches_type(item, item_type, f"{path}.{key}")
+    elif annotation is float:
+        assert value is None or type(value) is float, f"{path}: {value!r} is not a float or null"
+    else:
+        assert type(value) is annotation, f"{path}: {value!r} is not a {annotation.__name__}"
+
+
+def model_json(model, body):
+    """body as the response model would have sent it, the output of the routes before they skipped validation"""
+    from fastapi.encoders import jsonable_encoder
+    return json.loads(json.dumps(jsonable_encoder(model.parse_obj(body))))
+
+
+def has_null(value):
+    if isinstance(value, dict):
+        return any(has_null(item) for item in value.values())
+    if isinstance(value, list):
+        return any(has_null(item) for item in value)
+    return value is None
+
+
+# every route with a response model, with values of the hand made dataset
+MODEL_ROUTES = [
+    ("CourseDataResponse", "/coursedata/overview/IS111"),
+    ("CourseDataResponse", "/coursedata/overview/IS112"),
+    ("CourseDataResponse", "/coursedata/overview/instructor_median_bid_chart/IS111"),
+    ("CourseDataResponse", "/coursedata/bidpriceacrossterms/IS111/Round 1 Window 1/PROF A"),
+    ("CourseDataResponse", f"/coursedata/bidpriceacrosswindows/IS111/{TERM}/PROF A"),
+    ("CourseDataResponse", f"/coursedata/sectionbidpriceacrosswindows/IS111/{TERM}/PROF A/G1"),
+    ("CourseDataResponse", f"/coursedata/sectionbidpriceacrosswindows/IS111/{TERM}/PROF A/G2"),
+    ("ReturnMultichartDatasetArr", "/coursedata/bidpriceacrossterms/vacancies/IS111/Round 1 Window 1/PROF A"),
+    ("ReturnMultichartDatasetArr", f"/coursedata/bidpriceacrosswindows/vacancies/IS111/{TERM}/PROF A"),
+    ("ReturnMultichartDatasetArr", f"/coursedata/sectionbidpriceacrosswindows/vacancies/IS111/{TERM}/PROF A/G1"),
+    ("CoursePageResponse", "/coursedata/coursepage/IS111"),
+    ("CoursePageResponse", f"/coursedata/coursepage/IS111?instructor_name=PROF A&term={TERM}&window=Round 1 Window 1&section=G2"),
+    ("CoursePageResponse", "/coursedata/coursepage/IS112?instructor_name=PROF A&term=2021-22 Term 2&window=Round 2 Window 1&section=G1"),
+    ("QueryResponse", "/query?group_by=term&aggregates=median_bid:median,min_bid:min,vacancy:sum&course_code=IS111"),
+    ("QueryResponse", "/query?group_by=section&aggregates=min_bid:mean&course_code=IS111&term=2021-22 Term 1"),
+]
+
+
+@pytest.mark.parametrize("model_name, url", MODEL_ROUTES)
+def test_routes_match_response_models(api_client, model_name, url):
+    api, client = api_client
+    model = getattr(api, model_name)
+    body = get_json(client, url)
+    assert_matches_type(body, model, model_name)
+    # the models reject null in a List[float], NaN made those routes answer 500 before
+    if not has_null(body):
+        assert_same_json(body, model_json(model, body))
+
+
+def chart(title, labels, datasets):
+    return {"title": title, "chartData": {"responsive": True, "labels": labels, "datasets": datasets}}
+
+
+def test_overview_body(api_client):
+    _, client = api_client
+    expected = chart(
+        "IS111 Overview (across all sections and windows for Round 1 Window 1 from AY 2019/20 onwards)",
+        OVERVIEW_LABELS,
+        [{"label": "Median Bid", "data": [40.0, 50.0, 50.0, 60.0], "borderColor": "", "backgroundColor": "rgba(41, 128, 185, 1)"}],
+    )
+    assert_same_json(get_json(client, "/coursedata/overview/IS111"), expected)
+
+
+def test_overview_without_values_sends_null(api_client):
+    _, client = api_client
+    expected = chart(
+        "IS112 Overview (across all sections and windows for Round 1 Window 1 from AY 2019/20 onwards)",
+        OVERVIEW_LABELS,
+        [{"label": "Median Bid", "data": [None, None, None, None], "borderColor": "", "backgroundColor": "rgba(41, 128, 185, 1)"}],
+    )
+    assert_same_json(get_json(client, "/coursedata/overview/IS112"), expected)
+    assert_same_json(get_json(client, "/coursedata/coursepage/IS112")["overview"], expected)
+
+
+def test_missing_min_bid_sends_null(api_client):
+    _, client = api_client
+    expected = chart(
+        f"Median, Min Bid Price against Bidding Window for {TERM}, Section G2",
+        ["Round 1 Window 1"],
+        [
+            {"label": "Median Bid", "data": [50.0], "borderColor": "rgba(75, 192, 192, 1)", "backgroundColor": "rgba(41, 128, 185, 1)"},
+            {"label": "Min Bid", "data": [None], "borderColor": "rgba(75, 50, 192, 1)", "backgroundColor": "rgba(41, 128, 185, 1)"},
+        ],
+    )
+    assert_same_json(get_json(client, f"/coursedata/sectionbidpriceacrosswindows/IS111/{TERM}/PROF A/G2"), expected)
+
+
+def test_vacancies_body(api_client):
+    _, client = api_client
+    # counts are integers in the data and floats on the wire
+    expected = {"data": [
+        {"type": "bar", "label": "Before Process Vacancies", "data": [20.0, 5.0], "borderColor": "rgb(255, 99, 132)", "backgroundColor": "rgba(255, 99, 132, 0.2)", "yAxisID": "y1"},
+        {"type": "bar", "label": "After Process Vacancies", "data": [5.0, 1.0], "borderColor": "rgb(53, 162, 235)", "backgroundColor": "rgba(53, 162, 235, 0.2)", "yAxisID": "y1"},
+    ]}
+    assert_same_json(get_json(client, f"/coursedata/sectionbidpriceacrosswindows/vacancies/IS111/{TERM}/PROF A/G1"), expected)
+
+
+def test_course_page_leaves_unrequested_parts_null(api_client):
+    api, client = api_client
+    body = get_json(client, "/coursedata/coursepage/IS111")
+    assert list(body) == list(typing.get_type_hints(api.CoursePageResponse))
+    assert body["terms_available"] is None and body["sectionbidpriceacrosswindows_vacancies"] is None
+    assert_same_json(body["instructors"], {"data": ["PROF A", "PROF B"]})
+
+
+def test_query_body(api_client):
+    _, client = api_client
+    expected = {
+        "group_by": "term",
+        "rows": 4,
+        "groups": [TERM, "2022-23 Term 1"],
+        "aggregates": {"median_bid_median": [45.0, 60.0], "min_bid_min": [20.0, 55.0]},
+    }
+    assert_same_json(get_json(client, "/query?group_by=term&aggregates=median_bid:median,min_bid:min&course_code=IS111"), expected)